@@ -1,5 +1,14 @@
 import appdaemon.plugins.hass.hassapi as hass
 
+from sungrow_engine.arbitration import send_command
+from sungrow_engine.quality import check_sample
+from sungrow_engine.rules import compile_rules
+
+# Default rules, override any part under `rules:` in apps.yaml
+RECHARGE_RULES = {
+    "limits": {"battery_threshold": 5},  # Battery level to start/stop charging
+}
+
 class BatteryChargingApp(hass.Hass):
 
     # This app is a safeguard to recharge battery to 5% when discharged to 1% the day before, no matter tomorrow prices. 
@@ -8,8 +17,8 @@ class BatteryChargingApp(hass.Hass):
     def initialize(self):
         """Initialize the app and schedule the battery check at 03:00."""
         self.battery_entity = "sensor.battery_level_nominal"  # Adjust if needed
-        self.battery_threshold = 5  # Battery threshold to start/stop charging
-        self.monitor_interval = 60  # Interval for checking battery level in seconds
+        self.battery_threshold = compile_rules(self.args.get("rules"), RECHARGE_RULES).limits["battery_threshold"]
+        self.monitor_interval = int(self.args.get("monitor_interval", 60))  # Interval for checking battery level in seconds
         self.monitoring = False  # Flag to track if we are currently monitoring the battery level
         self.charging_started_by_app = False  # Flag to track if charging was started by this app
 
@@ -19,6 +28,15 @@ class BatteryChargingApp(hass.Hass):
     def check_battery_level(self, kwargs=None):
         """Check the battery level at 03:00 and take action."""
         battery_level = self.get_battery_level()
+        if battery_level is None:
+            # The sensor is unavailable (inverter restarting, lost modbus), try again a little later
+            retries = (kwargs or {}).get("retries", 0)
+            if retries < 10:
+                self.log(f"Battery level unavailable, checking again in {self.monitor_interval} seconds.")
+                self.run_in(self.check_battery_level, self.monitor_interval, retries=retries + 1)
+            else:
+                self.log("Battery level unavailable, no action taken.")
+            return
 
         # Log the initial battery level
         self.log(f"Battery level at 03:00: {battery_level}%")
@@ -34,29 +52,21 @@ class BatteryChargingApp(hass.Hass):
             self.log(f"Battery level is above {self.battery_threshold}%, no action taken.")
 
     def get_battery_level(self):
-        """Get the battery level from the sensor."""
-        return float(self.get_state(self.battery_entity))
+        """Get the battery level from the sensor, None if it is unavailable or not a valid level."""
+        try:
+            level = float(self.get_state(self.battery_entity))
+        except (TypeError, ValueError):
+            return None
+        return check_sample(self.battery_entity, level)
 
     def start_charging(self):
         """Start charging the battery."""
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Forced mode"
-        )
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Forced charge"
-        )
+        send_command(self, "input_select.set_sg_ems_mode", "Forced mode")
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Forced charge")
 
     def stop_charging(self):
         """Stop charging the battery."""
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Stop (default)"
-        )
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)")
 
     def monitor_battery_level(self, kwargs):
         """Monitor the battery level every 60 seconds and stop charging when above 5%."""
@@ -66,7 +76,7 @@ class BatteryChargingApp(hass.Hass):
         self.log(f"Monitoring - Current battery level: {battery_level}%")
 
         # If the battery level is above or equal to the threshold, stop charging
-        if battery_level >= self.battery_threshold:
+        if battery_level is not None and battery_level >= self.battery_threshold:
             # Only stop charging if it was started by this app
             if self.charging_started_by_app:
                 self.stop_charging()
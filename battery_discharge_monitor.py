@@ -1,47 +1,62 @@
 import appdaemon.plugins.hass.hassapi as hass
+import datetime
+
+from sungrow_engine.arbitration import EMS_MODE, FORCED_CMD, release_command, send_command
+from sungrow_engine.prices import get_price_index
+from sungrow_engine.publish import Publisher
 
     # This app exist to potentially stop discharging when next day Nordpool data becomes available.
     # Sometimes we have scheduled discharging but next night prices come in near level or higher than our scheduled discharging hours.
     # This most often mean higher prices the following day and we should save the power for these hours instead.
     # We stop discharging if current hour price compared to night charging prices has a difference of 40 or lower since we cant recharge cheaper than our threshold value.
-    # Repeats stop discharging every hour until midnight.
+    # The check runs when the price slot or the planned recharge cost changes (from 14:00 until midnight) and holds the
+    # energy until the end of the slot, a later slot with a high enough price discharges again. If the spread recovers
+    # inside the slot the hold is released early, before start_hour the sensor shows that discharging is allowed.
 
 class BatteryDischargeMonitor(hass.Hass):
     def initialize(self):
-        # Schedule the check for 1 second after each hour between 14:00 and 23:00
-        self.run_daily(self.check_battery_discharge, "14:00:01")
-        self.run_daily(self.check_battery_discharge, "15:00:01")
-        self.run_daily(self.check_battery_discharge, "16:00:01")
-        self.run_daily(self.check_battery_discharge, "17:00:01")
-        self.run_daily(self.check_battery_discharge, "18:00:01")
-        self.run_daily(self.check_battery_discharge, "19:00:01")
-        self.run_daily(self.check_battery_discharge, "20:00:01")
-        self.run_daily(self.check_battery_discharge, "21:00:01")
-        self.run_daily(self.check_battery_discharge, "22:00:01")
-        self.run_daily(self.check_battery_discharge, "23:00:01")
-
-    def check_battery_discharge(self, kwargs):
-        # Fetch value from the "nordpool_kwh_se3_sek_3_10_025" sensor
-        nordpool_value = self.get_state("sensor.nordpool_kwh_se3_sek_3_10_025")
-
-        # Ensure we have a valid sensor value for nordpool
-        try:
-            nordpool_value = float(nordpool_value)
-        except ValueError:
-            self.log("Invalid nordpool value. Cannot proceed with discharging check.")
-            return
+        """Subscribe to the current price and the planned recharge cost."""
+        self.price_sensor = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.recharge_sensor = "sensor.mock_selected_charging_hours_prices"
+        self.fallback_recharge_sensor = "sensor.mock_chosen_3_hours"
+        self.output_sensor = "sensor.battery_discharge_monitor"
+        self.start_hour = int(self.args.get("start_hour", 14))  # Tomorrow's prices are published around 13:00
+        self.spread_min = float(self.args.get("spread_min", 40))
+        self.publisher = Publisher(self)
+        self.recheck_timer = None
+        self.forced_timer = None
+        self.held_until = None  # End of the slot the energy is held in
 
-        # Fetch the value from "sensor.mock_selected_charging_hours_prices"
-        charging_hours_value = self.get_state("sensor.mock_selected_charging_hours_prices")
+        for entity in (self.price_sensor, self.recharge_sensor, self.fallback_recharge_sensor):
+            self.listen_state(self.price_changed, entity)
 
-        # If mock_selected_charging_hours_prices has an invalid state, use mock_chosen_3_hours
-        if charging_hours_value is None or charging_hours_value == "unavailable" or charging_hours_value == "unknown":
-            charging_hours_value = self.get_state("sensor.mock_chosen_3_hours")
+        self.check_battery_discharge()
 
-        # Ensure we have a valid value for charging_hours_value
-        try:
-            charging_hours_value = float(charging_hours_value)
-        except ValueError:
+    def price_changed(self, entity, attribute, old, new, kwargs):
+        """The slot price or the recharge cost changed."""
+        self.check_battery_discharge()
+
+    def check_battery_discharge(self, kwargs=None):
+        """Hold the energy for the current slot if it is not worth more than recharging it tonight."""
+        now = self.datetime(aware=True)
+        if now.hour < self.start_hour:
+            # A hold from last evening ended at its slot end, don't leave it on the sensor until start_hour
+            self.held_until = None
+            self.publisher.publish(self.output_sensor, "Discharging allowed", {"held_until": None})
+            return
+
+        # Price of the current slot, the sensor state if the slot isn't in the price index
+        slot = get_price_index(self, self.price_sensor).slot_at(now)
+        nordpool_value = slot.value if slot is not None else self.get_float(self.price_sensor)
+        if nordpool_value is None:
+            self.log("Invalid nordpool value. Cannot proceed with discharging check.")
+            return
+
+        # Planned cost of tonight's charge, the mean of the 3 cheapest night hours if no charge is planned
+        charging_hours_value = self.get_float(self.recharge_sensor)
+        if charging_hours_value is None:
+            charging_hours_value = self.get_float(self.fallback_recharge_sensor)
+        if charging_hours_value is None:
             self.log("Invalid charging hours value. Cannot proceed with discharging check.")
             return
 
@@ -51,28 +66,57 @@ class BatteryDischargeMonitor(hass.Hass):
         # Log the calculation
         self.log(f"Price difference between current hour and cheapest next night {price_difference}")
 
-        # If the result is below 40, stop discharging
-        if price_difference < 40:
-            self.log(f"Price difference is low: {price_difference}, stopping discharging if currently discharging.")
-            self.set_state(self.output_selected_hours, state="Price difference too low")
-            self.stop_discharging()
+        slot_end = slot.end if slot is not None else now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        if price_difference < self.spread_min:
+            if self.held_until != slot_end:
+                self.log(f"Price difference is low: {price_difference}, stopping discharging if currently discharging.")
+                self.log_to_logbook(f"Holding the battery energy until {slot_end.strftime('%H:%M')}, price difference {price_difference:.2f}")
+                self.held_until = slot_end
+                self.stop_discharging({"until": slot_end})
 
-    def stop_discharging(self, kwargs):
-        """Stop discharging the battery."""
-        self.run_in(self.set_forced_mode, 10)
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Stop (default)"
+            # The next slot may have the same price and then there is no state change, check again when it starts
+            if self.recheck_timer is not None:
+                self.cancel_timer(self.recheck_timer)
+            self.recheck_timer = self.run_at(self.check_battery_discharge, slot_end)
+        elif self.held_until is not None:
+            if now < self.held_until:
+                self.log(f"Price difference recovered: {price_difference}, releasing the hold before {self.held_until.strftime('%H:%M')}.")
+                self.release_hold()
+            self.held_until = None
+
+        self.publisher.publish(
+            self.output_sensor,
+            "Holding energy" if self.held_until else "Discharging allowed",
+            {"price": nordpool_value, "recharge_price": charging_hours_value, "price_difference": price_difference,
+             "held_until": self.held_until.isoformat() if self.held_until else None},
         )
 
+    def get_float(self, entity):
+        """Numeric state of an entity, None if it is unavailable."""
+        try:
+            return float(self.get_state(entity))
+        except (TypeError, ValueError):
+            return None
+
+    def stop_discharging(self, kwargs):
+        """Stop discharging the battery until the end of the slot."""
+        if self.forced_timer is not None:
+            self.cancel_timer(self.forced_timer)
+        self.forced_timer = self.run_in(self.set_forced_mode, 10, until=kwargs.get("until"))
+        send_command(self, FORCED_CMD, "Stop (default)", until=kwargs.get("until"))
+
     def set_forced_mode(self, kwargs):
         """Set EMS mode to Forced mode."""
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Forced mode"
-        )
+        self.forced_timer = None
+        send_command(self, EMS_MODE, "Forced mode", until=kwargs.get("until"))
+
+    def release_hold(self):
+        """End the hold before its slot end, the other apps' commands decide the inverter again."""
+        if self.forced_timer is not None:
+            self.cancel_timer(self.forced_timer)
+            self.forced_timer = None
+        release_command(self, FORCED_CMD)
+        release_command(self, EMS_MODE)
 
     def log_to_logbook(self, message):
         """Logs a message to the Home Assistant Logbook."""
@@ -80,5 +124,5 @@ class BatteryDischargeMonitor(hass.Hass):
             "logbook/log",
             name="Battery discharge monitor",
             message=message,
-            entity_id="sensor.battery_discharge_monitor"  
+            entity_id="sensor.battery_discharge_monitor"
         )
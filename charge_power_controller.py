@@ -0,0 +1,103 @@
+import appdaemon.plugins.hass.hassapi as hass
+
+from sungrow_engine.arbitration import FORCED_CMD, release_command, send_command
+from sungrow_engine.control import PowerController, cumulative_targets, slot_targets
+from sungrow_engine.prices import get_price_index
+from sungrow_engine.telemetry import telemetry
+
+    # This app adjusts the charging power inside the planned night charging hours.
+    # The energy of each charging range is spread over its price slots with the cheapest slots first, and every minute
+    # the max charge power is set to what is needed to reach the energy target of the current slot, measured with
+    # sensor.battery_power_raw from the telemetry buffers. Small changes are skipped and writes are rate limited.
+    # When smart_night_charging has planned the energy per slot for the battery temperature, those targets are used.
+    # Every setpoint holds until the end of its slot; when the range ends or the battery leaves Forced charge the
+    # planned max charge power is restored, so PV and the safeguard charge aren't left at a low setpoint.
+    # Needs the telemetry_recorder app for the measured power.
+
+
+class ChargePowerController(hass.Hass):
+    def initialize(self):
+        """Initialize the controller and start the control loop."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.charging_sensor = self.args.get("charging_sensor", "sensor.selected_charging_hours")
+        self.power_sensor = self.args.get("power_sensor", "sensor.battery_power_raw")  # Unsigned, W
+        self.power_entity = "input_number.set_sg_battery_max_charge_power"
+        self.max_power = float(self.args.get("max_power", 6200))
+        self.interval = int(self.args.get("interval", 60))
+
+        self.controller = PowerController(
+            self.max_power,
+            min_power=float(self.args.get("min_power", 500)),  # Keeps charging while in range, a target met early is topped up slowly
+            deadband=float(self.args.get("deadband", 200)),
+            max_step=float(self.args.get("max_step", 2000)),
+            min_interval=float(self.args.get("min_write_interval", 60)),
+        )
+        self.targets = {}  # slot start -> (range start, cumulative target kWh at the slot end)
+        self.planned_power = self.max_power  # W, the night charging's max charge power, restored outside the ranges
+        self.controlling = False  # A setpoint of this app holds the charge power
+
+        # New plans come with the charging sensor, the loop itself runs every minute
+        self.listen_state(self.update_targets, self.charging_sensor, attribute="all")
+        self.run_every(self.control, "now", self.interval)
+        self.update_targets()
+
+    def update_targets(self, *args):
+        """Energy targets per slot from the selected charging slots and their planned power."""
+        attributes = (self.get_state(self.charging_sensor, attribute="all") or {}).get("attributes", {})
+        starts = set(attributes.get("slot_starts") or [])
+        planned_kw = float(attributes.get("max_charge_power") or 0) / 1000
+        self.planned_power = float(attributes.get("max_charge_power") or self.max_power)
+        # Energy per slot within the temperature envelope, when the night charging planned it
+        slot_energy = dict(zip(attributes.get("slot_starts") or [], attributes.get("slot_energy_kwh") or []))
+        prices = get_price_index(self, self.sensor_name)
+
+        # Group the selected slots into contiguous ranges
+        ranges = []
+        for slot in prices.slots:
+            if slot.start.isoformat() not in starts:
+                continue
+            if ranges and ranges[-1][-1].end == slot.start:
+                ranges[-1].append(slot)
+            else:
+                ranges.append([slot])
+
+        self.targets = {}
+        for slots in ranges:
+            if all(slot.start.isoformat() in slot_energy for slot in slots):
+                targets = [float(slot_energy[slot.start.isoformat()]) for slot in slots]
+            else:
+                targets = slot_targets(slots, planned_kw, self.max_power / 1000)
+            self.targets.update(cumulative_targets(slots, targets))
+        self.controller.reset()
+        if self.targets:
+            self.log(f"Charging energy targets set for {len(self.targets)} slots in {len(ranges)} ranges.")
+
+    def control(self, kwargs):
+        """Set the charge power needed to reach the target of the current slot."""
+        now = self.datetime(aware=True)
+        slot = get_price_index(self, self.sensor_name).slot_at(now)
+        if slot is None or slot.start not in self.targets or self.get_state(FORCED_CMD) != "Forced charge":
+            self.restore_power()
+            return
+
+        range_start, target_kwh = self.targets[slot.start]
+        buffer = telemetry(self.power_sensor).ring
+        start_integral = buffer.integral_at(range_start.timestamp())
+        now_integral = buffer.integral_at(now.timestamp())
+        if start_integral is None or now_integral is None:
+            return  # No telemetry for the whole range yet
+        delivered_kwh = (now_integral - start_integral) / 3600 / 1000
+
+        setpoint = self.controller.update(target_kwh - delivered_kwh, (slot.end - now).total_seconds(), now.timestamp())
+        if setpoint is not None:
+            self.log(f"Charge power {setpoint} W: {delivered_kwh:.2f} of {target_kwh:.2f} kWh by {slot.end.strftime('%H:%M')}.")
+            send_command(self, self.power_entity, setpoint, until=slot.end)
+            self.controlling = True
+
+    def restore_power(self):
+        """End the controller's setpoint and go back to the planned max charge power."""
+        if self.controlling:
+            self.log(f"Charge power control ended, max charge power back to {self.planned_power:.0f} W.")
+            release_command(self, self.power_entity, self.planned_power)
+            self.controlling = False
+        self.controller.reset()
@@ -0,0 +1,143 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+
+from sungrow_engine import shared
+from sungrow_engine.arbitration import EMS_MODE, FORCED_CMD, Arbiter
+from sungrow_engine.publish import Publisher
+
+    # This app decides between the inverter commands of the other apps.
+    # The apps send their EMS mode, forced charge/discharge and power commands here instead of straight to the inverter,
+    # the command of the app with the highest priority wins while it holds, and only real changes are written.
+    # Commands that contradict each other are logged to sensor.command_arbiter and the logbook.
+    # Apps fall back to writing the inverter directly when this app is not running.
+
+DEFAULT_PRIORITIES = {
+    "battery_charging_app": 100,  # Safeguard recharge from 1%
+    "peak_shaving": 90,
+    "battery_discharge_monitor": 80,
+    "extra_night_discharging": 70,
+    "smart_day_discharging": 60,
+    "charge_power_controller": 55,  # Adjusts the charge power inside the night charging hours
+    "smart_night_charging": 50,
+    "smart_cheap_night_charging": 40,
+}
+
+WATCHED_ENTITIES = (
+    EMS_MODE,
+    FORCED_CMD,
+    "input_number.set_sg_battery_max_charge_power",
+    "input_number.set_sg_forced_charge_discharge_power",
+)
+
+
+class CommandArbiter(hass.Hass):
+    def initialize(self):
+        """Initialize the arbiter with the configured priorities and the current inverter settings."""
+        self.output_sensor = "sensor.command_arbiter"
+        # The charge power controller sends a command every minute, the decision log doesn't need every one
+        self.publisher = Publisher(self, min_interval=float(self.args.get("publish_interval", 10)))
+        priorities = dict(DEFAULT_PRIORITIES, **self.args.get("priorities", {}))
+
+        # Shared so the intents survive a reload of this app
+        self.arbiter = shared(("arbiter", self.name), lambda: Arbiter(priorities))
+        self.arbiter.priorities = priorities
+        self.arbiter.max_hold = float(self.args.get("max_hold_hours", 12)) * 3600
+        for entity in WATCHED_ENTITIES:
+            self.arbiter.emitted[entity] = self.current_value(entity)
+            # Changes from the dashboard or the inverter itself, so a net change is measured against the real value
+            self.listen_state(self.inverter_changed, entity)
+
+        self.boundary_handle = None
+        self.reported_contradictions = self.arbiter.contradiction_count
+        self.schedule_next_boundary()
+        self.publish()
+
+    def current_value(self, entity):
+        state = self.get_state(entity)
+        if entity.startswith("input_number."):
+            try:
+                return float(state)
+            except (TypeError, ValueError):
+                return None
+        return state
+
+    def inverter_changed(self, entity, attribute, old, new, kwargs):
+        self.arbiter.emitted[entity] = self.current_value(entity)
+
+    def now(self):
+        return self.datetime(aware=True).timestamp()
+
+    def command(self, source, entity_id, value, until=None):
+        """A command from an app, called through sungrow_engine.arbitration.send_command."""
+        if entity_id.startswith("input_number."):
+            value = float(value)
+        until = until.timestamp() if until is not None else None
+        self.apply(self.arbiter.request(source, entity_id, value, self.now(), until))
+
+    def plan(self, source, commands, start, end):
+        """Planned commands {entity: value} of an app for [start, end) (aware datetimes)."""
+        self.arbiter.submit(source, commands, start.timestamp(), end.timestamp())
+        self.apply(self.arbiter.resolve(self.now()))
+
+    def release(self, source, entity_id, value=None):
+        """End an app's command for one entity, `value` is written if no other app holds it."""
+        if value is not None and entity_id.startswith("input_number."):
+            value = float(value)
+        self.apply(self.arbiter.release(source, entity_id, self.now(), value))
+
+    def withdraw(self, source):
+        """Drop everything an app has asked for."""
+        self.apply(self.arbiter.withdraw(source, self.now()))
+
+    def apply(self, changes):
+        """Write the changed values to the inverter and keep the decision log up to date."""
+        for entity, value in changes.items():
+            if entity.startswith("input_number."):
+                self.call_service("input_number/set_value", entity_id=entity, value=value)
+            else:
+                self.call_service("input_select/select_option", entity_id=entity, option=value)
+        self.schedule_next_boundary()
+        self.publish()
+
+    def schedule_next_boundary(self):
+        """Decide again when the next intent starts or ends."""
+        if self.boundary_handle is not None:
+            self.cancel_timer(self.boundary_handle)
+            self.boundary_handle = None
+        boundary = self.arbiter.next_boundary(self.now())
+        if boundary is not None:
+            when = self.datetime(aware=True) + datetime.timedelta(seconds=boundary - self.now())
+            self.boundary_handle = self.run_at(self.at_boundary, when)
+
+    def at_boundary(self, kwargs):
+        self.boundary_handle = None
+        self.apply(self.arbiter.resolve(self.now()))
+
+    def publish(self):
+        """Publish the active intents, the latest decisions and new contradictions."""
+        contradictions = list(self.arbiter.contradictions)
+        new = min(len(contradictions), self.arbiter.contradiction_count - self.reported_contradictions)
+        for contradiction in contradictions[len(contradictions) - new:]:
+            message = f"Conflicting commands for {contradiction['entity']}: {contradiction['winner']} overrides {contradiction['loser']}"
+            self.log(message)
+            self.log_to_logbook(message)
+        self.reported_contradictions = self.arbiter.contradiction_count
+
+        active = self.arbiter.active(self.now())
+        self.publisher.publish(self.output_sensor, len(active), {
+            "active": [
+                {"source": i.source, "entity": i.entity, "value": i.value, "priority": i.priority}
+                for i in active
+            ],
+            "decisions": list(self.arbiter.decisions)[-20:],
+            "contradictions": contradictions[-20:],
+        })
+
+    def log_to_logbook(self, message):
+        """Logs a message to the Home Assistant Logbook."""
+        self.call_service(
+            "logbook/log",
+            name="Command arbiter",
+            message=message,
+            entity_id=self.output_sensor
+        )
@@ -1,61 +1,97 @@
 import appdaemon.plugins.hass.hassapi as hass
 import datetime
 
+from sungrow_engine.prices import get_price_index
+from sungrow_engine.soc_limits import BALANCING, balance_today, choose_soc_limits
+from sungrow_engine.telemetry import telemetry
+
 class DynamicSOCManager(hass.Hass):
     
-    # This app automatically sets SOC values. If large price difference tomorrow charge to 99% and discharge to 1%.
-    # If small price difference tomorrow charge to 98% and discharge to 5%.
-    # Every sunday set max SOC to 100% and min to 1% for battery balancing purposes.
+    # This app automatically sets SOC values from the 48h price horizon (today + tomorrow or its forecast).
+    # The min/max SOC window is widened only when the extra energy is worth more than the wear of the deeper cycle,
+    # and never when the battery is cold.
+    # Battery balancing (1-100%) is done at least once a week, on the day with the cheapest night charge once allowed.
     
     def initialize(self):
         """Initialize the app and schedule the daily check."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.forecast_sensor = "sensor.nordpool_price_forecast"
+        self.temperature_sensor = "sensor.battery_temperature"
+        self.output_sensor = "sensor.dynamic_soc_manager"
+
+        self.battery_capacity_kwh = float(self.args.get("battery_capacity_kwh", 16.0))
+        self.degradation_cost = float(self.args.get("degradation_cost", 5))  # öre per extra kWh of deeper cycling
+        self.cold_limit = float(self.args.get("cold_limit", 10))  # °C, below this keep the narrow window
+        self.balance_min_interval = int(self.args.get("balance_min_interval", 4))  # Days
+        self.balance_max_interval = int(self.args.get("balance_max_interval", 7))  # Days
+
         # Schedule daily at 01:01 to check and adjust SOC based on electricity prices
         self.run_daily(self.adjust_soc_based_on_prices, datetime.time(1, 1))
 
-    def adjust_soc_based_on_prices(self, kwargs):
-        """Evaluate electricity price and adjust SOC values accordingly."""
-        
-        # Get the current value from the sensor (today's electricity price)
-        price_value = self.get_state("sensor.nordpool_mean_low_vs_high_price_today")
-        
+    def horizon_prices(self):
+        """Today's prices and tomorrow's, or tomorrow's median forecast before publication."""
+        prices = get_price_index(self, self.sensor_name)
+        today_prices = prices.today_values()
+        tomorrow_prices = prices.tomorrow_values()
+        if not tomorrow_prices:
+            tomorrow_date = (self.date() + datetime.timedelta(days=1)).isoformat()
+            if self.get_state(self.forecast_sensor, attribute="date") == tomorrow_date:
+                tomorrow_prices = self.get_state(self.forecast_sensor, attribute="p50") or []
+        return today_prices, tomorrow_prices
+
+    def battery_temperature(self):
+        """Mean battery temperature the last hour from the telemetry buffer, else the current state."""
+        value = telemetry(self.temperature_sensor).mean(3600, self.datetime(aware=True).timestamp())
+        if value is not None:
+            return value
         try:
-            price_value = float(price_value)  # Convert to float
+            return float(self.get_state(self.temperature_sensor))
         except (TypeError, ValueError):
+            return None
+
+    def days_since_balancing(self):
+        last = self.get_state(self.output_sensor, attribute="last_balancing")
+        try:
+            return (self.date() - datetime.date.fromisoformat(last)).days
+        except (TypeError, ValueError):
+            return None
+
+    def adjust_soc_based_on_prices(self, kwargs):
+        """Evaluate the price horizon and adjust SOC values accordingly."""
+        today_prices, tomorrow_prices = self.horizon_prices()
+        if not today_prices:
             self.log("Error: Invalid price data from sensor.")
             return
-        
-        # Log the current price for reference
-        self.log(f"Today's electricity price (sensor value): {price_value}")
-        
-        # Get the current day of the week (0=Monday, 6=Sunday)
-        today = datetime.datetime.now().weekday()
-        
-        if today == 6:  # Check if it's Sunday (6 represents Sunday in Python's weekday())
-            # On Sunday, set SOC values to 100% high and 1% low
-            self.set_state("input_number.set_sg_min_soc", state=1)
-            self.set_state("input_number.set_sg_max_soc", state=100)
-            self.log("Today is Sunday, time for battery balancing. Min SOC set to 1% and Max SOC set to 100%.")
-            self.call_service("logbook/log", 
-                name="Dynamic SOC Manager", 
-                message="Today is Sunday, time for battery balancing. Min SOC set to 1% and Max SOC set to 100%.",
-                entity_id="input_number.set_sg_min_soc")
+
+        temperature = self.battery_temperature()
+        days_since = self.days_since_balancing()
+        last_balancing = self.get_state(self.output_sensor, attribute="last_balancing")
+
+        if balance_today(days_since, today_prices, tomorrow_prices, self.balance_min_interval, self.balance_max_interval):
+            min_soc, max_soc = BALANCING
+            values = {}
+            last_balancing = self.date().isoformat()
+            message = f"Time for battery balancing ({days_since} days since last). Min SOC set to {min_soc}% and Max SOC set to {max_soc}%."
         else:
-            # Check the price and adjust SOC values accordingly for Mon-Sat
-            if price_value <= 75:
-                # Set SOC values to 5% min and 98% max
-                self.set_state("input_number.set_sg_min_soc", state=5)
-                self.set_state("input_number.set_sg_max_soc", state=98)
-                self.log("Electricity price difference is 75 or below. Min SOC set to 5% and Max SOC set to 98%.")
-                self.call_service("logbook/log", 
-                    name="Dynamic SOC Manager", 
-                    message="Electricity price difference is 75 or below. Min SOC set to 5% and Max SOC set to 98%.",
-                    entity_id="input_number.set_sg_min_soc")
-            else:
-                # Set SOC values to 1% min and 99% max
-                self.set_state("input_number.set_sg_min_soc", state=1)
-                self.set_state("input_number.set_sg_max_soc", state=99)
-                self.log("Electricity price difference is above 75. Min SOC set to 1% and Max SOC set to 99%.")
-                self.call_service("logbook/log", 
-                    name="Dynamic SOC Manager", 
-                    message="Electricity price difference is above 75. Min SOC set to 1% and Max SOC set to 99%.",
-                    entity_id="input_number.set_sg_min_soc")
+            days = [today_prices] + ([tomorrow_prices] if tomorrow_prices else [])
+            min_soc, max_soc, values = choose_soc_limits(
+                days, self.battery_capacity_kwh, self.degradation_cost, temperature, self.cold_limit
+            )
+            reason = "battery is cold" if temperature is not None and temperature < self.cold_limit else "best value over the price horizon"
+            message = f"Min SOC set to {min_soc}% and Max SOC set to {max_soc}% ({reason})."
+
+        self.set_state("input_number.set_sg_min_soc", state=min_soc)
+        self.set_state("input_number.set_sg_max_soc", state=max_soc)
+        self.set_state(self.output_sensor, state=f"{min_soc}-{max_soc}", attributes={
+            "min_soc": min_soc,
+            "max_soc": max_soc,
+            "candidate_values": {f"{a}-{b}": v for (a, b), v in values.items()},
+            "battery_temperature": temperature,
+            "horizon_days": 1 + bool(tomorrow_prices),
+            "last_balancing": last_balancing,
+        })
+        self.log(message)
+        self.call_service("logbook/log", 
+            name="Dynamic SOC Manager", 
+            message=message,
+            entity_id="input_number.set_sg_min_soc")
@@ -1,14 +1,29 @@
 import appdaemon.plugins.hass.hassapi as hass
 import datetime
 
+from sungrow_engine.arbitration import release_command, send_command
+from sungrow_engine.prices import get_price_index
+from sungrow_engine.rules import compile_rules
+from sungrow_engine.selection import mean
+
 # This app triggers extra night discharging if still juice left in battery and price difference enough.
 
+# Default rules, override any part under `rules:` in apps.yaml
+EXTRA_NIGHT_DISCHARGING_RULES = {
+    "window": {"first_slot": 0, "slots": 6},  # Tomorrow's night slots (00:00-06:00)
+    "select": {"order": "cheapest", "base": 2},  # Mean of the 2 cheapest night hours is the recharge price
+    "spread": {"min": 50},  # Needed price difference now vs the recharge price
+    "limits": {"min_battery_level": 1},  # Don't discharge at or below this level
+}
+
 class ExtraNightDischarging(hass.Hass):
     def initialize(self):
         self.nordpool_sensor = "sensor.nordpool_kwh_se3_sek_3_10_025"
         self.battery_sensor = "sensor.battery_level"
-        self.check_hours = [21, 22, 23]  # Adjust hourly triggers to check prices for the next day
-        self.price_threshold_offset = 50
+        self.check_hours = self.args.get("check_hours", [21, 22, 23])  # Adjust hourly triggers to check prices for the next day
+        self.rules = compile_rules(self.args.get("rules"), EXTRA_NIGHT_DISCHARGING_RULES)
+        self.price_threshold_offset = self.rules.spread_min
+        self.min_battery_level = self.rules.limits["min_battery_level"]
 
         # Schedule checks at specified hours
         for hour in self.check_hours:
@@ -29,11 +44,13 @@ class ExtraNightDischarging(hass.Hass):
             return
 
         # Fetch tomorrow's prices and calculate the mean of the 2 cheapest hours (00:00-06:00)
-        tomorrow_prices = self.get_state(self.nordpool_sensor, attribute="tomorrow") or []
-        if len(tomorrow_prices) >= 6:
+        self.prices = get_price_index(self, self.nordpool_sensor)
+        tomorrow_prices = self.prices.tomorrow_values()
+        night = self.rules.window(self.prices.tomorrow)
+        cheapest = self.rules.select([(hour, tomorrow_prices[hour]) for hour in night if hour < len(tomorrow_prices)])
+        if night and max(night) < len(tomorrow_prices) and cheapest:
             # Calculate the mean of the 2 cheapest hours directly from the first 6 hours (00:00-06:00)
-            sorted_prices = sorted(tomorrow_prices[:6])  # Only use the first 6 hours for night time
-            mean_cheapest_2 = sum(sorted_prices[:2]) / 2
+            mean_cheapest_2 = mean(price for _, price in cheapest)
         else:
             self.log_to_logbook("Insufficient price data for tomorrow. Discharge skipped.")
             return
@@ -42,13 +59,13 @@ class ExtraNightDischarging(hass.Hass):
         price_difference = current_price - mean_cheapest_2
 
         # Check discharging conditions: current price vs. mean of the cheapest 2 hours + offset
-        if battery_level > 1 and price_difference >= self.price_threshold_offset:
+        if battery_level > self.min_battery_level and price_difference >= self.price_threshold_offset:
             self.start_discharging()
             # Schedule stop discharging at the end of the hour
             self.run_at(self.stop_discharging, self.calculate_end_of_hour())
         else:
             # Log specific reasons for not starting discharge
-            if battery_level <= 1:
+            if battery_level <= self.min_battery_level:
                 self.log_to_logbook(
                     f"Discharge not started: Battery level too low ({battery_level}%)."
                 )
@@ -67,39 +84,23 @@ class ExtraNightDischarging(hass.Hass):
     def set_self_consumption_mode(self, kwargs):
         """Set EMS mode to Self Consumption with delays for actions."""
         # Set EMS mode to "Self-consumption mode (default)"
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Self-consumption mode (default)"
-        )
+        send_command(self, "input_select.set_sg_ems_mode", "Self-consumption mode (default)", until=self.calculate_end_of_hour())
         self.run_in(self.stop_forced_mode, 2)
 
     def stop_forced_mode(self, kwargs):
         """Stop forced charging/discharging after EMS mode is set."""
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Stop (default)"
-        )
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)")
         self.log_to_logbook("EMS mode set to Self-consumption mode. Discharge started.")
 
     def stop_discharging(self, kwargs):
         """Stop discharging at the end of each hour."""
-        # Set EMS mode back to "Forced mode"
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Forced mode"
-        )
+        # Set EMS mode back to "Forced mode", unless another app holds it
+        release_command(self, "input_select.set_sg_ems_mode", "Forced mode")
         self.run_in(self.stop_forced_mode_at_hour_end, 2)
 
     def stop_forced_mode_at_hour_end(self, kwargs):
         """Stop forced mode at the end of the hour."""
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Stop (default)"
-        )
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)")
         self.log_to_logbook("Discharge stopped for this hour.")
 
     def log_to_logbook(self, message):
@@ -111,6 +112,9 @@ class ExtraNightDischarging(hass.Hass):
         )
 
     def calculate_end_of_hour(self):
-        """Calculate the time when the current hour ends (start of next hour)."""
-        now = self.datetime()
-        return self.datetime().replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        """Calculate the time when the current price slot ends (start of next hour)."""
+        now = self.datetime(aware=True)
+        slot = self.prices.slot_at(now)
+        if slot is not None:
+            return slot.end
+        return now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
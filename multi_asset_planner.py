@@ -0,0 +1,147 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+import time
+
+from sungrow_engine.assets import EvCharge, HeatPump, co_optimize
+from sungrow_engine.battery_model import BatteryModel
+from sungrow_engine.horizon import get_timeline
+from sungrow_engine.publish import Publisher
+
+    # This app plans the battery together with the EV charger and the heat pump, which compete for the same cheap
+    # night slots and the same main fuse. The EV gets the energy it needs by departure, the heat pump may run up to a
+    # few hours before the heat is needed (pre-heating), and the battery charges in the room they leave under the fuse.
+    # The plan covers the rest of today and tomorrow (or tomorrow's forecast) in quarter hours, about 0.2 s to solve.
+    # It only publishes the plan to sensor.multi_asset_plan, the other apps still do the switching.
+    #
+    # ev:          plugged_entity, energy_entity (kWh still needed), departure_entity (input_datetime), max_kw
+    # heat_pump:   demand_kw (mean electric power the heating needs), max_kw, preheat_hours
+
+
+class MultiAssetPlanner(hass.Hass):
+    def initialize(self):
+        """Initialize the app and schedule the planning runs."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.forecast_sensor = "sensor.nordpool_price_forecast"
+        self.battery_sensor = "sensor.battery_level_nominal"
+        self.output_sensor = "sensor.multi_asset_plan"
+        self.publisher = Publisher(self, max_items=800)  # An entry per planned quarter hour
+
+        self.model = BatteryModel.from_args(self.args)
+        self.fuse_kw = float(self.args.get("fuse_kw", 13.8))  # 3 x 20 A
+        self.load_kw = float(self.args.get("load_kw", 0.5))  # Expected other house load
+        self.slot_minutes = int(self.args.get("slot_minutes", 15))
+        self.step_kwh = float(self.args.get("step_kwh", 0.5))
+        self.export_price_factor = float(self.args.get("export_price_factor", 0.8))
+        self.export_price_offset = float(self.args.get("export_price_offset", 0))
+        self.ev = dict(self.args.get("ev") or {})
+        self.heat_pump = dict(self.args.get("heat_pump") or {})
+
+        # Plan every hour, when tomorrow's prices are published and when the EV is plugged in or its needs change
+        self.run_hourly(self.update_plan, datetime.time(0, 3, 0))
+        self.listen_state(self.inputs_changed, self.sensor_name, attribute="tomorrow_valid")
+        for key in ("plugged_entity", "energy_entity", "departure_entity"):
+            if self.ev.get(key):
+                self.listen_state(self.inputs_changed, self.ev[key])
+        self.update_plan()
+
+    def inputs_changed(self, entity, attribute, old, new, kwargs):
+        self.update_plan()
+
+    def horizon(self):
+        """Slot starts and prices from the current slot, split into slot_minutes parts."""
+        timeline = get_timeline(self, self.sensor_name, self.forecast_sensor)
+        now = self.datetime(aware=True)
+        current = timeline.position(now) or 0
+        step = datetime.timedelta(minutes=self.slot_minutes)
+        starts, prices = [], []
+        for slot in timeline.slots[current:]:
+            if slot.value is None:
+                continue
+            start = slot.start
+            while start < slot.end:
+                if start + step > now:
+                    starts.append(start)
+                    prices.append(slot.value)
+                start += step
+        return starts, prices
+
+    def ev_charge(self, starts):
+        """EvCharge for a plugged in EV, None if there is none or nothing to charge."""
+        if not self.ev.get("plugged_entity") or self.get_state(self.ev["plugged_entity"]) != "on":
+            return None
+        energy = self.get_float(self.ev.get("energy_entity"), float(self.ev.get("energy_kwh", 0)))
+        if energy <= 0:
+            return None
+        departure = self.departure(starts)
+        return EvCharge(energy, float(self.ev.get("max_kw", 11)), 0, departure)
+
+    def departure(self, starts):
+        """Slot position of the next departure, the end of the horizon if it is unknown."""
+        value = self.get_state(self.ev["departure_entity"]) if self.ev.get("departure_entity") else self.ev.get("departure")
+        try:
+            departure_time = datetime.time.fromisoformat(str(value))
+        except ValueError:
+            return len(starts)
+        now = self.datetime(aware=True)
+        when = now.replace(hour=departure_time.hour, minute=departure_time.minute, second=0, microsecond=0)
+        if when <= now:
+            when += datetime.timedelta(days=1)
+        return next((i for i, start in enumerate(starts) if start >= when), len(starts))
+
+    def update_plan(self, *args):
+        """Plan the battery, the EV and the heat pump under the fuse and publish the plan."""
+        starts, prices = self.horizon()
+        if len(prices) < 2:
+            self.publisher.publish(self.output_sensor, "unknown", {"error": "Not enough price data"})
+            return
+        soc = self.get_float(self.battery_sensor, None)
+        if soc is None:
+            self.log("Invalid battery level, multi asset plan skipped.")
+            return
+
+        self.model.min_soc = self.get_float("input_number.set_sg_min_soc", self.model.min_soc)
+        self.model.max_soc = self.get_float("input_number.set_sg_max_soc", self.model.max_soc)
+        slot_hours = self.slot_minutes / 60
+        ev = self.ev_charge(starts)
+        heat_pump = None
+        if self.heat_pump:
+            demand = float(self.heat_pump.get("demand_kw", 1.0)) * slot_hours
+            heat_pump = HeatPump([demand] * len(prices), float(self.heat_pump.get("max_kw", 3.0)),
+                                 int(float(self.heat_pump.get("preheat_hours", 3)) / slot_hours))
+
+        started = time.perf_counter()
+        plan = co_optimize(
+            prices, [self.load_kw * slot_hours] * len(prices), self.fuse_kw, self.model, self.model.soc_kwh(soc),
+            ev, heat_pump, [price * self.export_price_factor + self.export_price_offset for price in prices],
+            slot_hours, self.step_kwh,
+        )
+        solve_seconds = time.perf_counter() - started
+
+        self.publisher.publish(self.output_sensor, round(plan.cost / 100, 2), {
+            "unit_of_measurement": "SEK",
+            "plan": [
+                {"start": start.isoformat(), "battery_kwh": round(battery, 2), "ev_kwh": round(ev_kwh, 2),
+                 "heat_pump_kwh": round(hp_kwh, 2)}
+                for start, battery, ev_kwh, hp_kwh in zip(starts, plan.battery, plan.ev, plan.heat_pump)
+                if battery or ev_kwh or hp_kwh
+            ],
+            "fuse_kw": self.fuse_kw,
+            "peak_import_kw": round(max(plan.grid) / slot_hours, 2),
+            "ev_kwh": round(sum(plan.ev), 2),
+            "heat_pump_kwh": round(sum(plan.heat_pump), 2),
+            "shortfall_kwh": {name: round(value, 2) for name, value in plan.shortfall.items()},
+            "iterations": plan.iterations,
+            "solve_seconds": round(solve_seconds, 3),
+        })
+        self.log(f"Multi asset plan: {plan.cost:.1f} öre over {len(prices)} slots, peak import "
+                 f"{max(plan.grid) / slot_hours:.1f} kW, solved in {solve_seconds:.2f}s.")
+        if any(value > 0.05 for value in plan.shortfall.values()):
+            self.log(f"Not everything fits under the {self.fuse_kw} kW fuse: {plan.shortfall}")
+
+    def get_float(self, entity, default):
+        if not entity:
+            return default
+        try:
+            return float(self.get_state(entity))
+        except (TypeError, ValueError):
+            return default
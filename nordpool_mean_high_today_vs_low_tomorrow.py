@@ -1,10 +1,13 @@
 import appdaemon.plugins.hass.hassapi as hass
 import datetime
 
+from sungrow_engine.publish import Publisher
+
 class NordpoolMeanHighTodayVsLowTomorrow(hass.Hass):
     def initialize(self):
         self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
         self.output_sensor = "sensor.nordpool_mean_high_today_vs_low_tomorrow"
+        self.publisher = Publisher(self)
 
         # Run the calculation every day at 13:59
         self.run_daily(self.calculate_mean_difference, datetime.time(13, 59))
@@ -19,14 +22,13 @@ class NordpoolMeanHighTodayVsLowTomorrow(hass.Hass):
         today_prices = self.get_state(self.sensor_name, attribute="today") or []
         tomorrow_prices = self.get_state(self.sensor_name, attribute="tomorrow") or []
 
-        # Ensure there are enough data points for both today and tomorrow
-        if len(today_prices) >= 24 and len(tomorrow_prices) >= 6:  # Ensure at least 24 prices for today and 6 for tomorrow
-            
-            # Filter today's prices for hours between 14:00 and 23:00 (indices 14-23)
-            today_prices_filtered = today_prices[14:24]
+        # Filter today's prices for hours between 14:00 and 23:00 (indices 14-23)
+        # and tomorrow's prices for hours between 00:00 and 06:00 (indices 0-5), missing prices left out
+        today_prices_filtered = [price for price in today_prices[14:24] if price is not None]
+        tomorrow_prices_filtered = [price for price in tomorrow_prices[:6] if price is not None]
 
-            # Filter tomorrow's prices for hours between 00:00 and 06:00 (indices 0-5)
-            tomorrow_prices_filtered = tomorrow_prices[:6]
+        # Ensure there are enough data points for both today and tomorrow
+        if len(today_prices) >= 24 and today_prices_filtered and tomorrow_prices_filtered:
 
             # Top 5 most expensive hours for today
             today_top_5 = sorted(today_prices_filtered, reverse=True)[:5]
@@ -39,22 +41,22 @@ class NordpoolMeanHighTodayVsLowTomorrow(hass.Hass):
             mean_tomorrow_bottom_5 = sum(tomorrow_bottom_5) / len(tomorrow_bottom_5)
 
             # Set the output sensor with the result
-            self.set_state(self.output_sensor, state=mean_today_top_5 - mean_tomorrow_bottom_5, attributes={
+            self.publisher.publish(self.output_sensor, mean_today_top_5 - mean_tomorrow_bottom_5, {
                 "mean_today_top_5": mean_today_top_5,
                 "mean_tomorrow_bottom_5": mean_tomorrow_bottom_5,
                 "today_top_5": today_top_5,
                 "tomorrow_bottom_5": tomorrow_bottom_5
             })
         else:
-            self.set_state(self.output_sensor, state="unknown", attributes={
+            self.publisher.publish(self.output_sensor, "unknown", {
                 "error": "Not enough data for calculation",
-                "today_prices": today_prices,
-                "tomorrow_prices": tomorrow_prices
+                "today_price_count": len(today_prices),
+                "tomorrow_price_count": len(tomorrow_prices)
             })
 
     def reset_sensor(self, *args):
         # Reset the output sensor at midnight to clear previous data
-        self.set_state(self.output_sensor, state="unknown", attributes={
+        self.publisher.publish(self.output_sensor, "unknown", {
             "error": "Sensor reset at midnight",
             "mean_today_top_5": None,
             "mean_tomorrow_bottom_5": None,
@@ -0,0 +1,90 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+import json
+import os
+
+from sungrow_engine import shared
+from sungrow_engine.forecast import PriceForecastModel
+
+    # This app forecasts Nordpool prices for the days that are not yet published (tomorrow before ~13:00 and the day after).
+    # It stores the published prices in a local history file and learns incrementally every time a new day is published.
+    # The forecast is a seasonal naive price (yesterday + same weekday last week) corrected with the quantiles of the
+    # errors it made for the same hour in the past, which gives P10/P50/P90 price curves in a few milliseconds.
+
+
+class NordpoolPriceForecast(hass.Hass):
+    def initialize(self):
+        """Initialize the app, load the price history and learn from the published days."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.output_sensor = "sensor.nordpool_price_forecast"
+        self.history_file = self.args.get(
+            "history_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nordpool_price_history.json")
+        )
+
+        # The model lives in the engine so a reload of this app doesn't read and train the history again
+        self.model = shared(("price_forecast", self.history_file), self.create_model)
+
+        # New days are published once a day, the sensor state changes every hour which is often enough
+        self.listen_state(self.update_forecast, self.sensor_name)
+
+        # Run once at startup
+        self.update_forecast()
+
+    def create_model(self):
+        model = PriceForecastModel(int(self.args.get("history_days", 56)))
+        try:
+            with open(self.history_file) as f:
+                model.load_json(json.load(f))
+        except FileNotFoundError:
+            self.log("No price history found, starting a new one.")
+        except (ValueError, OSError) as e:
+            self.log(f"Could not read price history: {e}")
+        return model
+
+    def save_history(self):
+        try:
+            with open(self.history_file, "w") as f:
+                json.dump(self.model.to_json(), f)
+        except OSError as e:
+            self.log(f"Could not write price history: {e}")
+
+    def update_forecast(self, *args):
+        """Learn from newly published days and publish the forecast for the unpublished ones."""
+        today = self.date()
+        tomorrow = today + datetime.timedelta(days=1)
+        today_prices = self.get_state(self.sensor_name, attribute="today") or []
+        tomorrow_prices = self.get_state(self.sensor_name, attribute="tomorrow") or []
+
+        learned = self.model.update(today, today_prices)
+        if tomorrow_prices:
+            learned = self.model.update(tomorrow, tomorrow_prices) or learned
+        if learned:
+            self.save_history()
+
+        # Forecast the next two days that are not published yet
+        first = tomorrow + datetime.timedelta(days=1) if tomorrow_prices else tomorrow
+        slots = len(today_prices) if len(today_prices) >= 24 else 24
+        forecasts = []
+        for day in (first, first + datetime.timedelta(days=1)):
+            curves = self.model.predict(day, slots)
+            if curves is not None:
+                forecasts.append(dict(date=day.isoformat(), **curves))
+
+        if not forecasts:
+            self.set_state(self.output_sensor, state="unknown", attributes={"error": "Not enough price history"})
+            return
+
+        p50 = forecasts[0]["p50"]
+        self.set_state(
+            self.output_sensor,
+            state=f"{sum(p50) / len(p50):.2f}",
+            attributes={
+                "date": forecasts[0]["date"],
+                "p10": forecasts[0]["p10"],
+                "p50": p50,
+                "p90": forecasts[0]["p90"],
+                "forecasts": forecasts,
+                "history_days": len(self.model.history),
+            }
+        )
+        self.log(f"Price forecast updated for {', '.join(f['date'] for f in forecasts)}")
@@ -0,0 +1,192 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+
+from sungrow_engine.arbitration import release_command, send_command
+from sungrow_engine.peaks import MonthlyPeaks
+
+    # This app shaves monthly power (effekt) tariff peaks using the battery.
+    # The grid operator bills on the mean of the top N hourly peaks of the month, so we keep those peaks in a min-heap.
+    # Every change of the grid power sensor updates the projected energy for the current hour.
+    # If the hour is about to set a new top N peak the battery is put in self consumption mode to cover the house load.
+    # Only discharging started by this app is stopped again, so the price arbitrage apps keep control of their own hours.
+    # A forced charge interrupted by the shaving is resumed: the EMS mode and command are restored when it stops.
+
+
+class PeakShaving(hass.Hass):
+    def initialize(self):
+        """Initialize the app, restore this month's peaks and listen to the grid power sensor."""
+        self.grid_power_sensor = "sensor.meter_active_power"  # Positive = import in W, adjust if needed
+        self.battery_sensor = "sensor.battery_level_nominal"
+        self.output_peaks = "sensor.peak_shaving_monthly_peaks"
+        self.output_reserved_soc = "sensor.peak_shaving_reserved_soc"
+
+        self.top_n = int(self.args.get("top_n", 3))  # Number of peaks the tariff is based on
+        self.one_per_day = bool(self.args.get("one_per_day", True))
+        self.min_peak_kwh = float(self.args.get("min_peak_kwh", 3.0))  # Don't shave below this while the month is young
+        self.margin_kwh = float(self.args.get("margin_kwh", 0.2))  # Start shaving this much before the threshold
+        self.battery_capacity_kwh = float(self.args.get("battery_capacity_kwh", 16.0))
+        self.min_soc = float(self.args.get("min_soc", 5))  # Never shave below this SOC
+        self.max_reserved_soc = float(self.args.get("max_reserved_soc", 40))
+        self.peak_hours = list(self.args.get("peak_hours", [7, 8, 17, 18, 19]))  # Predicted peak hours
+
+        self.peaks = MonthlyPeaks(self.top_n, self.one_per_day)
+        self.hour_profile = {}  # hour of day -> smoothed hourly import in kWh
+        self.restore_peaks()
+
+        now = self.datetime()
+        self.hour_start = now.replace(minute=0, second=0, microsecond=0)
+        self.hour_energy_kwh = 0.0
+        self.last_power_w = self.get_grid_power()
+        self.last_update = now
+        self.shaving = False
+        self.previous_mode = None  # EMS mode and forced command before the shaving started
+        self.previous_cmd = None
+
+        # React on every change of the grid power sensor
+        self.listen_state(self.on_grid_power, self.grid_power_sensor)
+
+        # Close the hour exactly at the hour change even if the sensor is quiet
+        self.run_hourly(self.close_hour, datetime.time(0, 0, 0))
+
+        self.update_reserved_soc()
+
+    def restore_peaks(self):
+        """Restore this month's peaks from the output sensor after a restart."""
+        month = self.datetime().strftime("%Y-%m")
+        self.peaks.reset(month)
+        if self.get_state(self.output_peaks, attribute="month") != month:
+            return
+        for kwh, key in self.get_state(self.output_peaks, attribute="peaks") or []:
+            self.peaks.add(float(kwh), key)
+        self.hour_profile = {int(h): float(v) for h, v in (self.get_state(self.output_peaks, attribute="hour_profile") or {}).items()}
+
+    def get_grid_power(self):
+        try:
+            return max(0.0, float(self.get_state(self.grid_power_sensor)))
+        except (TypeError, ValueError):
+            return 0.0
+
+    def on_grid_power(self, entity, attribute, old, new, kwargs):
+        """Integrate the import energy and act if the hour is about to set a new peak."""
+        now = self.datetime()
+        if now >= self.hour_start + datetime.timedelta(hours=1):
+            self.close_hour({})
+
+        self.accumulate(now)
+        try:
+            self.last_power_w = max(0.0, float(new))
+        except (TypeError, ValueError):
+            return
+
+        remaining_h = (self.hour_start + datetime.timedelta(hours=1) - now).total_seconds() / 3600
+        projected_kwh = self.hour_energy_kwh + self.last_power_w / 1000 * remaining_h
+        threshold = self.current_threshold()
+
+        if not self.shaving and projected_kwh > threshold - self.margin_kwh:
+            if self.get_battery_level() > self.min_soc:
+                self.log(f"Projected hour import {projected_kwh:.2f} kWh exceeds peak threshold {threshold:.2f} kWh, shaving.")
+                self.start_shaving()
+        elif self.shaving and projected_kwh < threshold - 2 * self.margin_kwh:
+            self.log(f"Projected hour import {projected_kwh:.2f} kWh back below peak threshold {threshold:.2f} kWh.")
+            self.stop_shaving()
+
+    def accumulate(self, now):
+        seconds = (now - self.last_update).total_seconds()
+        if seconds > 0:
+            self.hour_energy_kwh += self.last_power_w / 1000 * seconds / 3600
+        self.last_update = now
+
+    def current_threshold(self):
+        threshold = self.peaks.threshold()
+        return max(self.min_peak_kwh, threshold if threshold is not None else self.min_peak_kwh)
+
+    def close_hour(self, kwargs):
+        """Store the finished hour as a possible peak and start a new hour."""
+        now = self.datetime()
+        if now < self.hour_start + datetime.timedelta(hours=1):
+            return
+        self.accumulate(min(now, self.hour_start + datetime.timedelta(hours=1)))
+
+        hour = self.hour_start.hour
+        self.hour_profile[hour] = 0.8 * self.hour_profile.get(hour, self.hour_energy_kwh) + 0.2 * self.hour_energy_kwh
+
+        month = self.hour_start.strftime("%Y-%m")
+        if month != self.peaks.month:
+            self.peaks.reset(month)
+        if self.peaks.add(self.hour_energy_kwh, self.hour_start.strftime("%Y-%m-%dT%H")):
+            self.log(f"New monthly peak {self.hour_energy_kwh:.2f} kWh at {self.hour_start.strftime('%Y-%m-%d %H:00')}.")
+
+        self.hour_start = now.replace(minute=0, second=0, microsecond=0)
+        if self.hour_start.strftime("%Y-%m") != self.peaks.month:
+            self.peaks.reset(self.hour_start.strftime("%Y-%m"))
+        self.hour_energy_kwh = 0.0
+        self.last_update = self.hour_start
+        self.accumulate(now)
+
+        self.set_state(self.output_peaks, state=round(self.peaks.mean(), 3), attributes={
+            "month": self.peaks.month,
+            "peaks": self.peaks.as_list(),
+            "threshold_kwh": round(self.current_threshold(), 3),
+            "hour_profile": {str(h): round(v, 3) for h, v in self.hour_profile.items()},
+            "unit_of_measurement": "kWh",
+        })
+
+        if self.shaving:
+            self.stop_shaving()
+        self.update_reserved_soc()
+
+    def update_reserved_soc(self):
+        """Reserve SOC for the predicted peak hours left today."""
+        threshold = self.current_threshold()
+        current_hour = self.datetime().hour
+        excess_kwh = sum(
+            max(0.0, self.hour_profile.get(hour, 0.0) - threshold + self.margin_kwh)
+            for hour in self.peak_hours if hour >= current_hour
+        )
+        reserved_soc = min(self.max_reserved_soc, self.min_soc + excess_kwh / self.battery_capacity_kwh * 100)
+        self.set_state(self.output_reserved_soc, state=round(reserved_soc, 1), attributes={
+            "peak_hours": self.peak_hours,
+            "expected_excess_kwh": round(excess_kwh, 3),
+            "unit_of_measurement": "%",
+        })
+
+    def get_battery_level(self):
+        try:
+            return float(self.get_state(self.battery_sensor))
+        except (TypeError, ValueError):
+            return 0.0
+
+    def start_shaving(self):
+        """Let the battery cover the house load unless another app already discharges."""
+        if self.get_state("input_select.set_sg_ems_mode") == "Self-consumption mode (default)":
+            return
+        self.shaving = True
+        self.previous_mode = self.get_state("input_select.set_sg_ems_mode")
+        self.previous_cmd = self.get_state("input_select.set_sg_battery_forced_charge_discharge_cmd")
+        self.log_to_logbook(f"Peak shaving started, {self.previous_mode} / {self.previous_cmd} is restored afterwards.")
+        # Held until the hour ends at the latest, so a planned forced charge can't win over the shaving
+        now = self.datetime(aware=True)
+        hour_end = (now.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+                    + datetime.timedelta(hours=1)).astimezone(now.tzinfo)
+        send_command(self, "input_select.set_sg_ems_mode", "Self-consumption mode (default)", until=hour_end)
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)", until=hour_end)
+
+    def stop_shaving(self):
+        """Give the EMS mode and forced command back, to what they were before the shaving."""
+        self.shaving = False
+        self.log_to_logbook("Peak shaving stopped.")
+        # The arbiter hands the entities back to the command of the interrupted app if it still holds,
+        # without it the saved values are written
+        arbitrated = self.get_app("command_arbiter") is not None
+        release_command(self, "input_select.set_sg_ems_mode", None if arbitrated else self.previous_mode or "Forced mode")
+        release_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd",
+                        None if arbitrated else self.previous_cmd or "Stop (default)")
+
+    def log_to_logbook(self, message):
+        """Logs a message to the Home Assistant Logbook."""
+        self.call_service(
+            "logbook/log",
+            name="Peak shaving",
+            message=message,
+            entity_id=self.output_peaks
+        )
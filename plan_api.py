@@ -0,0 +1,175 @@
+import appdaemon.plugins.hass.hassapi as hass
+import hashlib
+import json
+import struct
+import sys
+import time
+from array import array
+
+from sungrow_engine.horizon import get_timeline
+from sungrow_engine.lazy import lazy_import
+from sungrow_engine.prices import get_price_index
+from sungrow_engine.quality import describe
+
+    # This app serves the battery plan and the processed prices as JSON to other systems (EV charger, heat pump),
+    # so they don't have to parse sensor strings like "02:00-05:00 | Mean: 34.12".
+    # The documents are built when a source sensor changes and kept in memory, a request only sends the cached bytes.
+    # Every answer has an ETag; a poll with If-None-Match and an unchanged document gets 304 Not Modified.
+    #
+    # GET /app/battery_plan?resource=plan     charging and discharging slots, energy, power and the monitor's hold
+    # GET /app/battery_plan?resource=prices   the price timeline of today, tomorrow and the forecast
+    #     &format=binary                      little endian header (first start unix time int64, slot seconds int32,
+    #                                         count uint32, forecast from uint32) and float64 prices, NaN if missing
+    # GET /app/battery_plan?resource=metrics  build and request counters of this API
+    #
+    # Without register_route (AppDaemon before 4.2) the JSON is served from /api/appdaemon/battery_plan instead,
+    # with the resource in the request body and without ETags.
+
+web = lazy_import("aiohttp.web")  # Comes with AppDaemon, only needed when a request is served
+
+SOURCES = [
+    "sensor.nordpool_kwh_se3_sek_3_10_025",
+    "sensor.nordpool_price_forecast",
+    "sensor.selected_charging_hours",
+    "sensor.selected_discharging_hours",
+    "sensor.selected_charging_hours_explanation",
+    "sensor.selected_discharging_hours_explanation",
+    "sensor.battery_discharge_monitor",
+]
+
+
+def etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+
+
+class PlanApi(hass.Hass):
+    def initialize(self):
+        """Build the documents, rebuild them on source changes and register the route."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.forecast_sensor = "sensor.nordpool_price_forecast"
+        self.documents = {}  # (resource, format) -> (body bytes, etag, content type)
+        self.metrics = {"builds": 0, "build_ms": 0.0, "requests": 0, "not_modified": 0, "started": time.time()}
+
+        for entity in SOURCES:
+            self.listen_state(self.source_changed, entity, attribute="all")
+        # The timeline starts at the current slot's day and is cut 60 h from now
+        self.run_hourly(self.build_documents, "00:00:05")
+        self.build_documents()
+
+        if hasattr(self, "register_route"):
+            self.register_route(self.plan_route, "battery_plan")
+        else:
+            self.register_endpoint(self.plan_endpoint, "battery_plan")
+
+    def source_changed(self, entity, attribute, old, new, kwargs):
+        self.build_documents()
+
+    def build_documents(self, *args):
+        """Build the plan and price documents, only the ones whose content changed get a new ETag."""
+        started = time.perf_counter()
+        timeline = get_timeline(self, self.sensor_name, self.forecast_sensor)
+        self.store(("plan", "json"), json.dumps(self.plan(), separators=(",", ":")).encode(), "application/json")
+        self.store(("prices", "json"), json.dumps(self.prices(timeline), separators=(",", ":")).encode(), "application/json")
+        self.store(("prices", "binary"), self.binary_prices(timeline), "application/octet-stream")
+        self.metrics["builds"] += 1
+        self.metrics["build_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def store(self, key, body, content_type):
+        current = self.documents.get(key)
+        if current is None or current[0] != body:
+            self.documents[key] = (body, etag(body), content_type)
+
+    def attributes(self, entity):
+        return (self.get_state(entity, attribute="all") or {}).get("attributes") or {}
+
+    def plan(self):
+        """Charging and discharging plan from the planners' sensors."""
+        charging = self.attributes("sensor.selected_charging_hours")
+        discharging = self.attributes("sensor.selected_discharging_hours")
+        monitor = self.get_state("sensor.battery_discharge_monitor", attribute="all") or {}
+        explanations = {
+            plan: self.attributes(f"sensor.selected_{plan}_hours_explanation").get("slots") or []
+            for plan in ("charging", "discharging")
+        }
+        return {
+            "charging": {
+                "slot_starts": charging.get("slot_starts") or [],
+                "slot_energy_kwh": charging.get("slot_energy_kwh") or [],
+                "max_charge_power_w": charging.get("max_charge_power"),
+                "mean_price": charging.get("mean_price_for_selected_hours"),
+                "degraded": bool(charging.get("degraded")),
+                "slots": explanations["charging"],
+            },
+            "discharging": {
+                "slot_starts": discharging.get("slot_starts") or [],
+                "export_power_w": discharging.get("export_power") or {},
+                "held_slot_starts": discharging.get("held_slot_starts") or [],
+                "carry_over_until": discharging.get("carry_over_until"),
+                "mean_price": discharging.get("mean_price_for_selected_hours"),
+                "degraded": bool(discharging.get("degraded")),
+                "slots": explanations["discharging"],
+            },
+            "hold": {
+                "state": monitor.get("state"),
+                "held_until": (monitor.get("attributes") or {}).get("held_until"),
+            },
+        }
+
+    def prices(self, timeline):
+        """The price timeline with the forecast bands and the data quality of the published days."""
+        prices = get_price_index(self, self.sensor_name)
+        return {
+            "unit": "öre/kWh",
+            "starts": [slot.start.isoformat() for slot in timeline.slots],
+            "ends": [slot.end.isoformat() for slot in timeline.slots],
+            "prices": timeline.values(),
+            "p10": timeline.p10,
+            "p90": timeline.p90,
+            "forecast_from": timeline.forecast_from,
+            "quality": {
+                "today": describe(prices.today_quality),
+                "tomorrow": describe(prices.tomorrow_quality),
+                "degraded": prices.today_quality.degraded or prices.tomorrow_quality.degraded,
+            },
+        }
+
+    def binary_prices(self, timeline):
+        """Header and float64 prices, the slots are equally long so the starts are implicit."""
+        if not timeline.slots:
+            return struct.pack("<qiII", 0, 0, 0, 0)
+        first = timeline.slots[0]
+        step = int((first.end - first.start).total_seconds())
+        values = array("d", (float("nan") if value is None else value for value in timeline.values()))
+        if sys.byteorder == "big":
+            values.byteswap()
+        return struct.pack("<qiII", int(first.start.timestamp()), step, len(values), timeline.forecast_from) + values.tobytes()
+
+    def document(self, resource, fmt="json"):
+        """(body, etag, content type) of a resource, metrics are built on request since they change every time."""
+        if resource == "metrics":
+            metrics = dict(self.metrics, documents={f"{name}.{kind}": len(body) for (name, kind), (body, _, _) in self.documents.items()})
+            body = json.dumps(metrics, separators=(",", ":")).encode()
+            return body, etag(body), "application/json"
+        return self.documents.get((resource, fmt))
+
+    async def plan_route(self, request, kwargs):
+        """HTTP route, answers from the cached documents."""
+        self.metrics["requests"] += 1
+        document = self.document(request.query.get("resource", "plan"), request.query.get("format", "json"))
+        if document is None:
+            return web.json_response({"error": "Unknown resource or format"}, status=404)
+        body, tag, content_type = document
+        headers = {"ETag": tag, "Cache-Control": "no-cache"}
+        matches = [match.strip().replace("W/", "") for match in request.headers.get("If-None-Match", "").split(",")]
+        if tag in matches or "*" in matches:
+            self.metrics["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type=content_type, headers=headers)
+
+    def plan_endpoint(self, data, *args, **kwargs):
+        """AppDaemon API endpoint for AppDaemon versions without routes."""
+        self.metrics["requests"] += 1
+        document = self.document((data or {}).get("resource", "plan"))
+        if document is None:
+            return {"error": "Unknown resource"}, 404
+        return json.loads(document[0]), 200
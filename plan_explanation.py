@@ -0,0 +1,73 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+
+    # This app answers why the charging and discharging plans look like they do.
+    # SmartNightCharging and SmartDayDischarging publish a per slot explanation of every plan they make (price, action,
+    # energy, value of a kWh and the constraint that decided the slot) to sensor.selected_charging_hours_explanation and
+    # sensor.selected_discharging_hours_explanation. Ask through the AppDaemon endpoint
+    # /api/appdaemon/battery_plan_explanation or by firing the event battery_plan_explanation, the event answer is fired
+    # as battery_plan_explanation_result.
+    #
+    # Request fields (all optional):
+    #   plan:  "charging" or "discharging", default both
+    #   start: only slots from this time, e.g. "2024-01-02T06:00:00+01:00"
+    #   end:   only slots before this time
+    #   actions: only slots with these actions, e.g. ["charge", "export"]
+
+PLANS = {
+    "charging": "sensor.selected_charging_hours_explanation",
+    "discharging": "sensor.selected_discharging_hours_explanation",
+}
+
+
+class PlanExplanation(hass.Hass):
+    def initialize(self):
+        """Register the endpoint and the event."""
+        self.register_endpoint(self.explanation_endpoint, "battery_plan_explanation")
+        self.listen_event(self.explanation_event, "battery_plan_explanation")
+
+    def explanation_endpoint(self, data, *args, **kwargs):
+        """AppDaemon API endpoint, answers with the explanation as JSON."""
+        try:
+            return self.explain(data or {}), 200
+        except (TypeError, ValueError) as e:
+            return {"error": str(e)}, 400
+
+    def explanation_event(self, event_name, data, kwargs):
+        """Event from a Home Assistant script or automation, the answer is fired as an event."""
+        request = {key: value for key, value in (data or {}).items() if key in ("plan", "start", "end", "actions")}
+        try:
+            result = self.explain(request)
+        except (TypeError, ValueError) as e:
+            self.log(f"Plan explanation request failed: {e}")
+            result = {"error": str(e)}
+        self.fire_event("battery_plan_explanation_result", **result)
+
+    def explain(self, request):
+        """The published explanations, filtered by plan, time and action."""
+        plans = [request["plan"]] if request.get("plan") else list(PLANS)
+        unknown = [plan for plan in plans if plan not in PLANS]
+        if unknown:
+            raise ValueError(f"Unknown plan {unknown[0]}, expected one of {', '.join(PLANS)}")
+        start = datetime.datetime.fromisoformat(request["start"]) if request.get("start") else None
+        end = datetime.datetime.fromisoformat(request["end"]) if request.get("end") else None
+        actions = set(request["actions"]) if request.get("actions") else None
+
+        result = {}
+        for plan in plans:
+            explanation = self.get_state(PLANS[plan], attribute="all") or {}
+            attributes = explanation.get("attributes", {})
+            slots = [
+                entry for entry in attributes.get("slots") or []
+                if (start is None or datetime.datetime.fromisoformat(entry["start"]) >= start)
+                and (end is None or datetime.datetime.fromisoformat(entry["start"]) < end)
+                and (actions is None or entry["action"] in actions)
+            ]
+            result[plan] = {
+                "summary": explanation.get("state"),
+                "energy_kwh": attributes.get("energy_kwh", {}),
+                "cost": attributes.get("cost"),
+                "constraints": attributes.get("constraints", {}),
+                "slots": slots,
+            }
+        return result
@@ -0,0 +1,116 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+import os
+
+from sungrow_engine import shared
+from sungrow_engine.accounting import SlotRecord, append_archive, rebuild
+from sungrow_engine.prices import get_price_index
+
+    # This app accounts what the battery apps actually save.
+    # Just before the end of every price slot it reads the daily import/export and battery charge/discharge counters,
+    # prices the slot and compares the real cost with a no-battery and a naive fixed schedule counterfactual.
+    # Every slot is appended to a local archive, the daily and monthly totals are published as sensors.
+
+COUNTERS = {
+    "imported": "sensor.daily_imported_energy",
+    "exported": "sensor.daily_exported_energy",
+    "charged": "sensor.daily_battery_charge",
+    "discharged": "sensor.daily_battery_discharge",
+}
+
+
+class SavingsAccounting(hass.Hass):
+    def initialize(self):
+        """Initialize the app, rebuild the ledger from the archive and schedule the first slot close."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.output_today = "sensor.battery_savings_today"
+        self.output_month = "sensor.battery_savings_month"
+        self.export_price_factor = float(self.args.get("export_price_factor", 0.8))
+        self.export_price_offset = float(self.args.get("export_price_offset", 0))
+        self.archive_file = self.args.get(
+            "archive_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "savings_archive.jsonl")
+        )
+
+        # Rebuilt from the archive once per process, a reload of this app reuses it
+        self.ledger = shared(("savings_ledger", self.archive_file), lambda: rebuild(self.archive_file))
+
+        self.last_counters = self.read_counters()
+        self.slot_start = None
+        self.slot_end = None
+        self.schedule_next_slot()
+
+    def read_counters(self):
+        counters = {}
+        for name, entity in COUNTERS.items():
+            try:
+                counters[name] = float(self.get_state(entity))
+            except (TypeError, ValueError):
+                counters[name] = None
+        return counters
+
+    def schedule_next_slot(self, at=None):
+        """Close the slot running at the given time (default now) a few seconds before its real end."""
+        # Read before the end, the daily counters reset at midnight and would lose the last slot of the day
+        now = self.datetime(aware=True)
+        at = at or now
+        slot = get_price_index(self, self.sensor_name).slot_at(at)
+        if slot is None:
+            self.slot_start = None
+            self.slot_end = at.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        else:
+            self.slot_start = slot.start
+            self.slot_end = slot.end
+        self.run_at(self.close_slot, max(self.slot_end - datetime.timedelta(seconds=5), now))
+
+    def close_slot(self, kwargs):
+        """Price the energy of the slot that just ended and publish the totals."""
+        counters = self.read_counters()
+        prices = get_price_index(self, self.sensor_name)
+
+        if self.slot_start is not None and all(v is not None for v in counters.values()) \
+                and all(v is not None for v in self.last_counters.values()):
+            # The daily counters reset at midnight, then the new value is the slot's energy
+            deltas = {
+                name: counters[name] - self.last_counters[name] if counters[name] >= self.last_counters[name] else counters[name]
+                for name in COUNTERS
+            }
+            price = prices.price_at(self.slot_start)
+            if price is not None:
+                day = [slot for slot in prices.slots if slot.start.date() == self.slot_start.date() and slot.value is not None]
+                night = [slot.value for slot in day if slot.start.hour < 6] or [price]
+                daytime = [slot.value for slot in day if 6 <= slot.start.hour < 22] or [price]
+                record = SlotRecord(
+                    self.slot_start.isoformat(),
+                    round(deltas["imported"], 4),
+                    round(deltas["exported"], 4),
+                    round(deltas["charged"], 4),
+                    round(deltas["discharged"], 4),
+                    price,
+                    price * self.export_price_factor + self.export_price_offset,
+                    sum(night) / len(night),
+                    sum(daytime) / len(daytime),
+                )
+                if self.ledger.add(record):
+                    append_archive(self.archive_file, record)
+                    self.publish(self.slot_start)
+
+        self.last_counters = counters
+        self.schedule_next_slot(self.slot_end)
+
+    def publish(self, when):
+        today = self.ledger.day(when.date().isoformat())
+        month = self.ledger.month(when.strftime("%Y-%m"))
+        for entity, totals, period in ((self.output_today, today, when.date().isoformat()), (self.output_month, month, when.strftime("%Y-%m"))):
+            saved = (totals["no_battery"] - totals["actual"]) / 100
+            self.set_state(entity, state=round(saved, 2), attributes={
+                "period": period,
+                "unit_of_measurement": "SEK",
+                "actual_cost": round(totals["actual"] / 100, 2),
+                "no_battery_cost": round(totals["no_battery"] / 100, 2),
+                "naive_schedule_cost": round(totals["naive"] / 100, 2),
+                "saved_vs_naive": round((totals["naive"] - totals["actual"]) / 100, 2),
+                "imported_kwh": round(totals["imported"], 2),
+                "exported_kwh": round(totals["exported"], 2),
+                "charged_kwh": round(totals["charged"], 2),
+                "discharged_kwh": round(totals["discharged"], 2),
+            })
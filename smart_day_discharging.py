@@ -1,61 +1,146 @@
 import appdaemon.plugins.hass.hassapi as hass
 import datetime
 
+from sungrow_engine.arbitration import release_command, send_command
+from sungrow_engine.explain import slot_entry, summary
+from sungrow_engine.horizon import Timeline, get_timeline
+from sungrow_engine.prices import get_price_index, slots_from_list
+from sungrow_engine.publish import Publisher
+from sungrow_engine.quality import describe
+from sungrow_engine.ranges import format_ranges, group_ranges
+from sungrow_engine.rules import NIGHT_CHARGING_RULES, compile_rules, configured_rules, night_charge
+
+# Default rules, override any part under `rules:` in apps.yaml
+DAY_DISCHARGING_RULES = {
+    "window": {"start_hour": 6, "end_hour": 22},  # Day hours considered for discharging
+    "select": {"order": "expensive", "max": 7},  # At most the 7 most expensive hours
+    "spread": {"min": 40},  # Needed price over the mean price of the last charge, öre/kWh
+}
+
     # This app triggers non sequential discharging during day hours if price condition is met.
+    # With export_enabled, hours where the export price beats the cost of the stored energy are discharged to the grid in forced mode,
+    # with a discharge power per hour sized to empty exactly the energy planned for export.
+    # The hours are chosen on the rolling price timeline up to the next night charge, so when tomorrow has no cheap night
+    # the energy is held past midnight for tomorrow's expensive hours. The plan is made again when tomorrow's prices come.
 
 class SmartDayDischarging(hass.Hass):
     def initialize(self):
         """Initialize the app and set up the routines for regular updates."""
         # Define sensor names
         self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"  # Nordpool sensor for prices
+        self.forecast_sensor = "sensor.nordpool_price_forecast"  # Tomorrow's prices before publication
+        self.charging_sensor = "sensor.selected_charging_hours"
         self.mean_price_sensor = "sensor.selected_charging_hours_prices"  # Mean price sensor
         self.output_selected_hours = "sensor.selected_discharging_hours"
         self.output_prices_for_selected_hours = "sensor.selected_discharging_hours_prices"
+        self.output_explanation = "sensor.selected_discharging_hours_explanation"
+        self.battery_sensor = "sensor.battery_level_nominal"
+        self.reserved_soc_sensor = "sensor.peak_shaving_reserved_soc"  # SOC kept for power tariff peaks
+
+        # Export to grid settings
+        self.export_enabled = bool(self.args.get("export_enabled", False))
+        self.export_price_factor = float(self.args.get("export_price_factor", 0.8))  # Sensor price incl. VAT -> export price
+        self.export_price_offset = float(self.args.get("export_price_offset", 0))  # Grid benefit compensation etc, öre/kWh
+        self.cycle_cost = float(self.args.get("cycle_cost", 10))  # Battery wear per discharged kWh, öre/kWh
+        self.battery_capacity_kwh = float(self.args.get("battery_capacity_kwh", 16.0))
+        self.max_discharge_power = int(self.args.get("max_discharge_power", 7000))  # W
+        self.house_load_w = float(self.args.get("house_load_w", 500))  # Expected house load during the discharging hours
+        self.degraded_hours = list(self.args.get("degraded_hours", [17, 18, 19]))  # Discharged to the house when the prices can't be trusted
+        self.export_power = {}  # hour -> forced discharge power in W
+        self.export_constraints = {}  # hour -> what decided its export power, see sungrow_engine.explain
+        self.hour_slots = {}  # hour -> today's price slots of the hour as one slot with real start/end
+        self.selected_hour_indices = []  # Today's hours of the current plan
+        self.held_slots = []  # Slots after midnight the energy is held for
+        self.discharge_timers = []
+        self.rules = compile_rules(self.args.get("rules"), DAY_DISCHARGING_RULES)
+        self.publisher = Publisher(self, max_items=200)  # Only real changes of the output sensors are written
 
         # Trigger the update calculation every day at 02:00
         self.run_daily(self.update_discharging_hours, datetime.time(2, 0))
+        # And again when tomorrow's prices are published, they decide what is worth holding past midnight
+        self.listen_state(self.prices_published, self.sensor_name, attribute="tomorrow_valid")
         # Run the calculation once at startup
         self.update_discharging_hours()
 
     def update_discharging_hours(self, *args):
         """Update the discharging hours based on the 7 most expensive hours."""
-        # Clear previous state and attributes of selected_discharging_hours
-        self.set_state(self.output_selected_hours, state="unknown", attributes={})
-        self.set_state(self.output_prices_for_selected_hours, state="unknown", attributes={})
-
-        # Fetch today's prices from the Nordpool sensor (hourly prices for today)
-        today_prices = self.get_state(self.sensor_name, attribute="today") or []
-        if not today_prices or len(today_prices) != 24:
+        # Fetch today's prices from the Nordpool sensor (hourly or quarter hourly prices for today, fewer or more on DST days)
+        prices = get_price_index(self, self.sensor_name)
+        today_slots = prices.today
+        if len(today_slots) < 23:
             self.log("Error: Not enough data for price calculation")
+            # The plan of the earlier prices doesn't hold any more
+            for handle in self.discharge_timers:
+                self.cancel_timer(handle)
+            self.discharge_timers = []
+            self.selected_hour_indices = []
+            self.publisher.publish(self.output_selected_hours, "unknown")
+            self.publisher.publish(self.output_prices_for_selected_hours, "unknown")
             return
 
-        # Proceed with selecting discharging hours
-        # Only consider the hours between 6:00 and 22:00 (indices 6 to 22)
-        filtered_prices = today_prices[6:23]  # hours 6 to 22 (inclusive)
-        self.log(f"Filtered prices (6:00-22:00): {filtered_prices}")
+        # Prices that failed the data quality checks can't pick hours, the fallback hours are discharged to the house
+        now = self.datetime(aware=True)
+        degraded = prices.today_quality.degraded
+        if degraded:
+            self.log(f"Today's prices failed the data quality checks ({'; '.join(describe(prices.today_quality))}). "
+                     f"Discharging to the house in the fallback hours {self.degraded_hours}.")
+            # The slots may be for another day, plan on today's clock
+            today_slots = slots_from_list([slot.value for slot in today_slots], self.date(), now.tzinfo)
+
+        # Local start hour -> the hour's price slots as one, used to schedule at the real slot times
+        self.hour_slots = {}
+        for slot in today_slots:
+            first = self.hour_slots.get(slot.start.hour)
+            self.hour_slots[slot.start.hour] = slot if first is None else first._replace(end=slot.end)
 
         # Fetch mean price of last charge
-        mean_price_value = float(self.get_state(self.mean_price_sensor, state=None) or 0)
+        mean_price_value = self.get_float(self.mean_price_sensor, 0)
 
         # If the mean_price_value is 0, use the value from sensor.chosen_3_hours instead
         if mean_price_value == 0:
-            mean_price_value = float(self.get_state('sensor.mock_chosen_3_hours', state=None) or 0)
+            mean_price_value = self.get_float('sensor.mock_chosen_3_hours', 0)
             self.log(f"Missing value of last charge, using value from sensor.mock_chosen_3_hours: {mean_price_value:.2f} öre")
         else:
             self.log(f"Mean price of last charge: {mean_price_value:.2f} öre")
 
-        # Select hours where the price is at least 40 öre more expensive than the mean price
-        selected_hours = []
-        for i, price in enumerate(filtered_prices):
-            if price is not None and price >= mean_price_value + 40:
-                selected_hours.append((i + 6, price))  # Store the hour (adjusting for index) and the price
-
-        # Sort the selected hours by price (descending) to pick the most expensive ones
-        selected_hours.sort(key=lambda x: x[1], reverse=True)
-
-        # Limit the number of selected hours to a maximum of 7
-        selected_hours = selected_hours[:7]
-        self.log(f"Selected hours (most expensive, at least 40 öre more expensive than mean price of last charge): {selected_hours}")
+        # Proceed with selecting discharging hours on the timeline of today and tomorrow (or its forecast)
+        # Only consider the hours between 6:00 and 22:00 (by default) from now until the battery is charged again
+        if degraded:
+            timeline = Timeline(today_slots)
+            recharge = len(timeline)
+            window = [i for i, slot in enumerate(today_slots) if slot.start.hour in self.degraded_hours and slot.end > now]
+        else:
+            timeline = get_timeline(self, self.sensor_name, self.forecast_sensor)
+            recharge = self.next_charge_position(timeline)
+            window = [i for i in self.rules.window(timeline.slots) if i < recharge and timeline.slots[i].end > now]
+        filtered_prices = [(i, timeline.slots[i].value) for i in window]
+        self.log(f"Filtered prices (day window until {self.describe_position(timeline, recharge)}): {[price for _, price in filtered_prices]}")
+
+        # Select hours where the price is at least 40 öre (by default) more expensive than the mean price
+        # sorted by price (descending) and limited to a maximum of 7
+        selected = filtered_prices if degraded else self.rules.select(filtered_prices, mean_price_value + self.rules.spread_min)
+
+        # Today's hours are scheduled now, the ones after midnight keep their energy and are planned again tomorrow
+        # Quarter hour slots are discharged by the hour, at the mean price of the hour's selected slots
+        today = self.date()
+        hour_prices = {}
+        for i, price in selected:
+            if timeline.slots[i].start.date() == today:
+                hour_prices.setdefault(timeline.slots[i].start.hour, []).append(price)
+        selected_hours = [(hour, sum(prices) / len(prices)) for hour, prices in hour_prices.items()]
+        self.held_slots = [timeline.slots[i] for i, _ in selected if timeline.slots[i].start.date() != today]
+        self.log(f"Selected hours (most expensive, at least {self.rules.spread_min} öre more expensive than mean price of last charge): {selected_hours}")
+        if self.held_slots:
+            self.log(f"Energy held past midnight for {', '.join(slot.start.strftime('%a %H:%M') for slot in self.held_slots)}.")
+
+        # A new plan replaces the timers of the previous one, a running discharge the new plan drops is stopped
+        previous_hours = self.selected_hour_indices
+        self.selected_hour_indices = sorted(hour for hour, _ in selected_hours)
+        for handle in self.discharge_timers:
+            self.cancel_timer(handle)
+        self.discharge_timers = []
+        if now.hour in previous_hours and now.hour not in self.selected_hour_indices:
+            self.stop_discharging({})
 
         # If we have selected any hours
         if selected_hours:
@@ -70,62 +155,185 @@ class SmartDayDischarging(hass.Hass):
             # Calculate the mean price of the selected hours
             mean_selected_price = sum(price for _, price in selected_hours) / len(selected_hours)
 
+            # Decide which hours export to the grid and with what power
+            self.export_constraints = {}
+            # The battery is full from the night charge until today's window starts, after that it is what is left
+            today_window = [i for i in window if timeline.slots[i].start.date() == today]
+            charging_ahead = self.charging_planned() and (not today_window or now < timeline.slots[today_window[0]].start)
+            export = self.export_enabled and not degraded
+            self.export_power = self.plan_export(selected_hours, mean_price_value, charging_ahead) if export else {}
+
             # Update the state with the selected hours and the mean price for the selected hours
-            self.set_state(self.output_selected_hours, state=f"{time_range_str} | Mean: {mean_selected_price:.2f}",
-                        attributes={"selected_hours": selected_hour_indices, "mean_price_for_selected_hours": mean_selected_price})
+            self.publisher.publish(self.output_selected_hours, f"{time_range_str} | Mean: {mean_selected_price:.2f}",
+                        {"selected_hours": selected_hour_indices, "mean_price_for_selected_hours": mean_selected_price,
+                         "export_power": {str(hour): power for hour, power in self.export_power.items()},
+                         "slot_starts": [self.hour_slots[hour].start.isoformat() for hour in selected_hour_indices],
+                         "held_slot_starts": [slot.start.isoformat() for slot in self.held_slots],
+                         "carry_over_until": self.carry_over_until(timeline, recharge),
+                         "price_quality": describe(prices.today_quality), "degraded": degraded})
 
             # Update the new sensor for the mean price of the selected hours
-            self.set_state(self.output_prices_for_selected_hours, state=f"{mean_selected_price:.2f}",
-                        attributes={"mean_price_for_selected_hours": mean_selected_price})
+            self.publisher.publish(self.output_prices_for_selected_hours, f"{mean_selected_price:.2f}",
+                        {"mean_price_for_selected_hours": mean_selected_price})
+
+            self.publish_explanation(today_slots, window, selected_hours, mean_price_value)
 
             # Schedule discharging for the selected hours
             self.schedule_discharging(selected_hour_indices)
         else:
-            self.log("No hours found with a price at least 40 öre more expensive than the mean price.")
-            self.log_to_logbook("No hours found with a price at least 40 öre more expensive than the mean price.")
-            self.set_state(self.output_selected_hours, state="No suitable hours found")
-            self.set_state(self.output_prices_for_selected_hours, state="No suitable hours found")
+            self.log(f"No hours found with a price at least {self.rules.spread_min} öre more expensive than the mean price.")
+            self.log_to_logbook(f"No hours found with a price at least {self.rules.spread_min} öre more expensive than the mean price.")
+            self.publisher.publish(self.output_selected_hours, "No suitable hours found",
+                        {"held_slot_starts": [slot.start.isoformat() for slot in self.held_slots],
+                         "carry_over_until": self.carry_over_until(timeline, recharge)})
+            self.publisher.publish(self.output_prices_for_selected_hours, "No suitable hours found")
+            self.export_power = {}
+            self.publish_explanation(today_slots, window, [], mean_price_value)
+
+
+    def prices_published(self, entity, attribute, old, new, kwargs):
+        """Plan again with tomorrow's real prices."""
+        if new and not old:
+            self.update_discharging_hours()
+
+    def next_charge_position(self, timeline):
+        """Timeline position of the next night charge after today, len(timeline) if there is none.
+
+        A charge SmartNightCharging has planned is used, otherwise its configured price
+        rules are run on the following days of the timeline.
+        """
+        today = self.date()
+        first = next((i for i, slot in enumerate(timeline.slots) if slot.start.date() > today), len(timeline))
+        planned = set(self.get_state(self.charging_sensor, attribute="slot_starts") or [])
+        for i in range(first, len(timeline)):
+            if timeline.slots[i].start.isoformat() in planned:
+                return i
+
+        night_rules = compile_rules(configured_rules(self, "smart_night_charging"), NIGHT_CHARGING_RULES)
+        day_start = first
+        while day_start < len(timeline):
+            date = timeline.slots[day_start].start.date()
+            day_end = next((i for i in range(day_start, len(timeline)) if timeline.slots[i].start.date() != date), len(timeline))
+            hours, _, _ = night_charge(night_rules, timeline.slots[day_start:day_end])
+            if hours:
+                return day_start + min(hours)
+            day_start = day_end
+        return len(timeline)
+
+    def describe_position(self, timeline, position):
+        if position >= len(timeline):
+            return "the end of the known prices"
+        return f"the charge at {timeline.slots[position].start.strftime('%a %H:%M')}"
+
+    def carry_over_until(self, timeline, position):
+        """Start of the next charge the energy is held until, None without held slots."""
+        if not self.held_slots:
+            return None
+        return timeline.slots[position].start.isoformat() if position < len(timeline) else timeline.slots[-1].end.isoformat()
+
+    def plan_export(self, selected_hours, mean_price_value, charging_ahead):
+        """Return {hour: discharge power W} for the hours where exporting beats keeping the energy."""
+        stored_energy_cost = mean_price_value + self.cycle_cost
+        export_hours = []
+        for hour, price in selected_hours:
+            export_price = price * self.export_price_factor + self.export_price_offset
+            if export_price >= stored_energy_cost:
+                export_hours.append((export_price, hour))
+            else:
+                self.export_constraints[hour] = "export_price"
+
+        if not export_hours:
+            self.log(f"No hour with export price above stored energy cost {stored_energy_cost:.2f} öre, self consumption only.")
+            return {}
+
+        # Energy we plan to discharge today: battery down to min SOC (plus reserves) after the night charge,
+        # from the current level once the day has started
+        planned_soc = self.get_float("input_number.set_sg_max_soc", 98) if charging_ahead else self.get_float(self.battery_sensor, 0)
+        floor_soc = max(self.get_float("input_number.set_sg_min_soc", 5), self.get_float(self.reserved_soc_sensor, 0))
+        energy_wh = max(0.0, planned_soc - floor_soc) / 100 * self.battery_capacity_kwh * 1000
+
+        # The hours held for after midnight keep at least the house load
+        energy_wh -= sum(self.house_load_w * (slot.end - slot.start).total_seconds() / 3600 for slot in self.held_slots)
+
+        # Every selected hour covers the house load first, the export hours too: their forced discharge feeds the house
+        energy_wh -= sum(self.house_load_w * self.slot_hours(hour) for hour, _ in selected_hours)
+
+        # Give the most valuable export hours full power and the rest to the next, so the planned energy is emptied exactly
+        export_power = {}
+        for export_price, hour in sorted(export_hours, reverse=True):
+            export_w = min(self.max_discharge_power - self.house_load_w, max(0.0, energy_wh) / self.slot_hours(hour))  # Wh == W for a whole hour
+            if export_w < 1:
+                self.export_constraints[hour] = "soc_bound"  # Nothing left to export, discharges to the house
+                continue
+            export_power[hour] = int(round(self.house_load_w + export_w))
+            self.export_constraints[hour] = "power_limit" if export_power[hour] >= self.max_discharge_power else "soc_bound"
+            energy_wh -= export_w * self.slot_hours(hour)
+            self.log(f"Export at {hour:02d}:00 with {export_power[hour]} W ({export_w:.0f} W to the grid), export price {export_price:.2f} öre vs stored energy {stored_energy_cost:.2f} öre.")
+        return export_power
+
+    def slot_hours(self, hour):
+        """Length of the hour's slots in hours, not 1 on DST days or with prices that don't fill the hour."""
+        slot = self.hour_slots[hour]
+        return (slot.end - slot.start).total_seconds() / 3600
+
+    def publish_explanation(self, today_slots, window, selected_hours, mean_price_value):
+        """Per slot explanation of today's plan: price, action, energy, value of a kWh and the deciding constraint."""
+        window = set(window)
+        selected = {hour for hour, _ in selected_hours}
+        floor = mean_price_value + self.rules.spread_min
+        stored_energy_cost = mean_price_value + self.cycle_cost
+        entries = []
+        for i, slot in enumerate(today_slots):
+            hour = slot.start.hour
+            hours = (slot.end - slot.start).total_seconds() / 3600
+            value = None if slot.value is None else slot.value - mean_price_value
+            planned = hour in self.hour_slots and self.hour_slots[hour].start <= slot.start < self.hour_slots[hour].end
+            if i not in window:
+                entries.append(slot_entry(slot, value=value, constraint="window"))
+            elif planned and hour in self.export_power:
+                export_value = slot.value * self.export_price_factor + self.export_price_offset - stored_energy_cost
+                entries.append(slot_entry(slot, "export", self.export_power[hour] / 1000 * hours, export_value,
+                                          self.export_constraints.get(hour)))
+            elif planned and hour in selected:
+                entries.append(slot_entry(slot, "discharge", self.house_load_w / 1000 * hours, value,
+                                          self.export_constraints.get(hour)))
+            else:
+                constraint = "spread_threshold" if slot.value is None or slot.value < floor else "max_slots"
+                entries.append(slot_entry(slot, value=value, constraint=constraint))
+
+        # The slots after midnight the energy is kept for
+        for slot in self.held_slots:
+            hours = (slot.end - slot.start).total_seconds() / 3600
+            entries.append(slot_entry(slot, "hold", self.house_load_w / 1000 * hours, slot.value - mean_price_value, "carry_over"))
+
+        totals = summary(entries)
+        discharged = sum(energy for action, energy in totals["energy_kwh"].items() if action != "hold")
+        state = f"{discharged:.1f} kWh in {len(selected)} slots" if selected else "No suitable hours found"
+        self.publisher.publish(self.output_explanation, state, dict(totals, slots=entries))
+
+    def charging_planned(self):
+        """True if night charging has selected hours, then the battery is full when discharging starts."""
+        return bool(self.get_state("sensor.selected_charging_hours", attribute="selected_hours"))
 
+    def get_float(self, entity, default):
+        try:
+            return float(self.get_state(entity))
+        except (TypeError, ValueError):
+            return default
 
     def split_into_ranges(self, selected_hours):
         """Split selected hours into continuous ranges and output as start-end format."""
-        ranges = self.group_sequential_hours(selected_hours)
-        
-        # Format each group of hours into a readable string
-        formatted_ranges = []
-        for r in ranges:
-            start_hour = r[0]
-            end_hour = r[-1]
-            formatted_ranges.append(f"{start_hour:02}:00-{end_hour + 1:02}:00")
-        
-        return ", ".join(formatted_ranges)
+        return format_ranges(self.hour_slots, selected_hours)
 
     def group_sequential_hours(self, selected_hours):
         """Groups consecutive hours into continuous blocks."""
-        ranges = []
-        current_range = [selected_hours[0]]  # Start with the first hour
-
-        for i in range(1, len(selected_hours)):
-            # If current hour is consecutive to the previous one, add it to the current range
-            if selected_hours[i] == selected_hours[i - 1] + 1:
-                current_range.append(selected_hours[i])
-            else:
-                # If not consecutive, push the current range and start a new one
-                ranges.append(current_range)
-                current_range = [selected_hours[i]]
-
-        # Don't forget to add the last range
-        ranges.append(current_range)
-        
-        return ranges
+        return group_ranges(self.hour_slots, selected_hours)
 
     def schedule_discharging(self, selected_hours):
         """Schedule discharging for the selected hours, preventing stop if following hour is part of the sequence."""
-        now = self.datetime()  # Get the current datetime object for logging
-        today_date = now.date()  # Get today's date
-
         # Group selected hours into continuous ranges (sequences of hours)
         ranges = self.group_sequential_hours(selected_hours)
+        now = self.datetime(aware=True)
 
         # Loop through the ranges and schedule start and stop times for discharging
         for r in ranges:
@@ -133,79 +341,92 @@ class SmartDayDischarging(hass.Hass):
             end_hour = r[-1]  # Last hour of the range
             
             # Schedule the start time (at the start of the range)
-            start_time = datetime.datetime.combine(today_date, datetime.time(start_hour, 0))
-            self.log(f"Scheduling start discharging at {start_time}")
-            self.run_at(self.start_discharging, start_time)
+            start_time = self.hour_slots[start_hour].start
+            if start_time >= now:
+                self.log(f"Scheduling start discharging at {start_time}")
+                self.discharge_timers.append(self.run_at(self.start_discharging, start_time))
+            elif now.hour in r and now < self.hour_slots[end_hour].end:
+                # A replan or restart inside a range that already started, its start timer is gone
+                self.log(f"Discharging range started at {start_time}, discharging from now on")
+                self.apply_discharge_mode(now.hour)
+
+            # Switch between export and self consumption inside the range when the mode changes
+            for previous, hour in zip(r, r[1:]):
+                if (hour in self.export_power or previous in self.export_power) and self.hour_slots[hour].start >= now:
+                    self.discharge_timers.append(self.run_at(self.switch_discharge_mode, self.hour_slots[hour].start, hour=hour))
             
-            # Schedule the stop time (at the last hour + 1, since discharging needs to stop after the last hour)
-            stop_time = datetime.datetime.combine(today_date, datetime.time((end_hour + 1) % 24, 0))
-            self.log(f"Scheduling stop discharging at {stop_time}")
-            self.run_at(self.stop_discharging, stop_time)
+            # Schedule the stop time (at the end of the last slot, since discharging needs to stop after the last hour)
+            stop_time = self.hour_slots[end_hour].end
+            if stop_time >= now:
+                self.log(f"Scheduling stop discharging at {stop_time}")
+                self.discharge_timers.append(self.run_at(self.stop_discharging, stop_time))
 
         # Log the ranges to the logbook
         self.log_to_logbook(f"Discharging scheduled for the following time ranges: {ranges}")
 
     def start_discharging(self, kwargs):
         """Start discharging the battery only if current time is within selected hours."""
-        now = self.datetime()  # Get the current datetime object for validation
-        
-        # Fetch today's dynamic range for discharging
-        selected_hours_str = self.get_state(self.output_selected_hours, state=None)
-        if selected_hours_str:
-            # Parse the selected hours into a list
-            selected_hours = [int(h.split(':')[0]) for h in selected_hours_str.split(',')]  # Assuming format: "15:00,17:00,19:00"
-        else:
+        now = self.datetime(aware=True)
+
+        # The hours of the plan the sensor was published with
+        selected_hours = self.get_state(self.output_selected_hours, attribute="selected_hours")
+        if not selected_hours:
             # If no dynamic range is set, log an error and do not trigger discharging
             self.log(f"Error: No dynamic discharging range found for today. Discharging will not be triggered.")
             self.log_to_logbook("Error: No dynamic discharging range found for today. Discharging will not be triggered.")
             return  # Exit, do not trigger discharging
 
-        # Ensure the current time is within the selected range for today (non-sequential hours)
-        current_hour = now.hour
-
-        # Check if the current hour is one of the selected discharging hours
-        if current_hour in selected_hours:
+        # Check if the current time is in one of the selected discharging hours (non-sequential hours)
+        current_hour = next((hour for hour in selected_hours
+                             if hour in self.hour_slots and self.hour_slots[hour].start <= now < self.hour_slots[hour].end), None)
+        if current_hour is not None:
             # Proceed with discharging
-            self.log_to_logbook(f"Starting battery discharging")
-            self.run_in(self.set_self_consumption_mode, 2)  # Start discharging after 2 seconds delay
-            self.call_service(
-                "input_select/select_option",
-                entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-                option="Stop (default)"  # Start discharging action
-            )
+            self.apply_discharge_mode(current_hour)
         else:
             # Log that the discharging attempt was outside the selected hours
-            self.log(f"Discharging triggered at but current hour {current_hour} is outside of the selected hours ({selected_hours}).")
+            self.log(f"Discharging triggered at {now.strftime('%H:%M')} outside of the selected hours ({selected_hours}).")
             self.log_to_logbook(f"Discharging attempt outside of selected hours ({selected_hours}).")
 
 
+    def switch_discharge_mode(self, kwargs):
+        """Switch mode at an hour inside a discharging range."""
+        self.apply_discharge_mode(kwargs["hour"])
+
+    def apply_discharge_mode(self, hour):
+        """Export with the planned power in forced mode, or discharge to the house in self consumption mode."""
+        if hour in self.export_power:
+            self.log_to_logbook(f"Starting battery export with {self.export_power[hour]} W")
+            send_command(self, "input_select.set_sg_ems_mode", "Forced mode")
+            send_command(self, "input_number.set_sg_forced_charge_discharge_power", self.export_power[hour])
+            send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Forced discharge")
+        else:
+            self.log_to_logbook(f"Starting battery discharging")
+            # Start discharging after 2 seconds delay, a replan in between replaces it with its own
+            self.discharge_timers.append(self.run_in(self.set_self_consumption_mode, 2, hour=hour))
+            send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)")  # Start discharging action
+
     def stop_discharging(self, kwargs):
         """Stop discharging the battery."""
         self.log_to_logbook(f"Stopping battery discharging.")
         self.run_in(self.set_forced_mode, 2)
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Stop (default)"
-        )
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)")
 
     def set_self_consumption_mode(self, kwargs):
-        """Set EMS mode to Self consumption (default)."""
+        """Set EMS mode to Self consumption (default) until the end of the hour's discharging range."""
         self.log_to_logbook("Setting EMS mode to Self consumption (default).")
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Self-consumption mode (default)"
-        )
+        send_command(self, "input_select.set_sg_ems_mode", "Self-consumption mode (default)", until=self.range_end(kwargs["hour"]))
 
     def set_forced_mode(self, kwargs):
-        """Set EMS mode to Forced mode."""
+        """Give up the EMS mode, Forced mode unless another app holds it."""
         self.log_to_logbook("Setting EMS mode to Forced mode.")
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Forced mode"
-        )
+        release_command(self, "input_select.set_sg_ems_mode", "Forced mode")
+
+    def range_end(self, hour):
+        """Real end of the planned discharging range the hour is in, the hour's own end if it isn't planned."""
+        for r in self.group_sequential_hours(self.selected_hour_indices):
+            if hour in r:
+                return self.hour_slots[r[-1]].end
+        return self.hour_slots[hour].end if hour in self.hour_slots else None
 
     def log_to_logbook(self, message):
         """Logs a message to the Home Assistant Logbook."""
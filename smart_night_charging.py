@@ -1,6 +1,18 @@
 import appdaemon.plugins.hass.hassapi as hass
 import datetime
 
+from sungrow_engine.arbitration import send_command
+from sungrow_engine.explain import slot_entry, summary
+from sungrow_engine.prices import get_price_index
+from sungrow_engine.publish import Publisher
+from sungrow_engine.quality import describe
+from sungrow_engine.ranges import format_ranges, range_times
+from sungrow_engine.rules import NIGHT_CHARGING_RULES, compile_rules  # Defaults, override any part under `rules:` in apps.yaml
+from sungrow_engine.selection import choose_cheapest, mean, most_expensive_mean
+from sungrow_engine.telemetry import telemetry
+from sungrow_engine.thermal import forecast, plan_energy, power_limit, trend
+
+
 class SmartNightCharging(hass.Hass):
     def initialize(self):
         """Initialize the app and set up the routines for regular updates."""
@@ -10,73 +22,101 @@ class SmartNightCharging(hass.Hass):
         self.output_selected_hours = "sensor.selected_charging_hours"
         self.output_comparison_sensor = "sensor.night_charging_day_prices_comparison"
         self.output_prices_for_selected_hours = "sensor.selected_charging_hours_prices"  # New sensor for prices
+        self.output_explanation = "sensor.selected_charging_hours_explanation"
+        self.publisher = Publisher(self, max_items=200)  # The explanation has a list entry per slot
+        self.battery_temperature_sensor = self.args.get("battery_temperature_sensor", "sensor.battery_temperature")
+        self.inverter_temperature_sensor = self.args.get("inverter_temperature_sensor", "sensor.inverter_temperature")
+        self.max_charge_power = float(self.args.get("max_charge_power", 6200))  # W, full power of the envelope
+        self.degraded_hours = list(self.args.get("degraded_hours", [2, 3, 4]))  # Night hours charged when the prices can't be trusted
+        self.selected_slots = []  # (start, end) of the slots selected for charging
+        self.plan_slots = []  # Tomorrow's price slots the plan was made for
+        self.night = []  # Positions of the night window in plan_slots
+        self.slot_energy = {}  # Position -> planned kWh within the temperature envelope
+        self.power_limits = {}  # Position -> forecast max charge power W
+        self.planned_power = None
+        self.expensive_mean = None  # Mean of the expensive day slots the night charge is compared with
+        self.charging_timers = []
+        self.selected_hours = []
+        self.rules = compile_rules(self.args.get("rules"), NIGHT_CHARGING_RULES)
 
         # Trigger the update calculation every day at 23:59
         self.run_daily(self.update_charging_hours, datetime.time(23, 59))
 
+        # Check the remaining night slots against the live temperatures
+        self.run_every(self.check_thermal_envelope, "now", int(self.args.get("thermal_check_interval", 1800)))
+
         # Run the calculation once at startup
         self.update_charging_hours()
 
     def update_charging_hours(self, *args):
         """Update the charging hours based on the cheapest hours and price differences."""
         
-        # Fetch tomorrow's prices from the Nordpool sensor
-        tomorrow_prices = self.get_state(self.sensor_name, attribute="tomorrow") or []
-
-        # Ensure there are enough data points (7 night hours)
-        if len(tomorrow_prices) >= 7:
-            # Extract the night prices (first 7 hours) and day prices (next hours)
-            tomorrow_night_prices = tomorrow_prices[:7]
-            tomorrow_day_prices = tomorrow_prices[7:]
-
-            # Create list of (hour, price) tuples for the night hours
-            sorted_hours = sorted([(i, price) for i, price in enumerate(tomorrow_night_prices) if price is not None], key=lambda x: x[1])
-
-            # Cheapest 3, 4, and 5 hours
-            cheapest_3 = sorted_hours[:3]
-            cheapest_4 = sorted_hours[:4]
-            cheapest_5 = sorted_hours[:5]
+        # Fetch tomorrow's prices from the Nordpool sensor, parsed once with their real timestamps
+        self.prices = get_price_index(self, self.sensor_name)
+        tomorrow_prices = self.prices.tomorrow_values()
+        self.slot_energy = {}
+        self.power_limits = {}
+
+        # Ensure there are enough data points (7 night hours by default)
+        night = self.rules.window(self.prices.tomorrow)
+        if night and max(night) < len(tomorrow_prices):
+            # Extract the night prices as (hour, price) tuples and the day prices (the other hours)
+            tomorrow_night_prices = [(hour, tomorrow_prices[hour]) for hour in night]
+            tomorrow_day_prices = [price for hour, price in enumerate(tomorrow_prices) if hour not in night]
+
+            # Cheapest 3, 4, and 5 night hours as (hour, price) tuples
+            cheapest_3 = choose_cheapest(tomorrow_night_prices, 3, ())
+            cheapest_4 = choose_cheapest(tomorrow_night_prices, 4, ())
+            cheapest_5 = choose_cheapest(tomorrow_night_prices, 5, ())
 
             # Calculate means for each set of hours
-            mean_3 = sum(price for _, price in cheapest_3) / len(cheapest_3)
-            mean_4 = sum(price for _, price in cheapest_4) / len(cheapest_4)
-            mean_5 = sum(price for _, price in cheapest_5) / len(cheapest_5)
+            mean_3 = mean(price for _, price in cheapest_3)
+            mean_4 = mean(price for _, price in cheapest_4)
+            mean_5 = mean(price for _, price in cheapest_5)
 
             # Update the sensors with the calculated means
-            self.set_state(
+            self.publisher.publish(
                 "sensor.chosen_3_hours",
                 state=mean_3,
                 attributes={"cheapest_3_hours": [hour for hour, _ in cheapest_3]}
             )
-            self.set_state(
+            self.publisher.publish(
                 "sensor.chosen_4_hours",
                 state=mean_4,
                 attributes={"cheapest_4_hours": [hour for hour, _ in cheapest_4]}
             )
-            self.set_state(
+            self.publisher.publish(
                 "sensor.chosen_5_hours",
                 state=mean_5,
                 attributes={"cheapest_5_hours": [hour for hour, _ in cheapest_5]}
             )
 
             # Calculate the mean of the 7 most expensive day hours
-            if len(tomorrow_day_prices) >= 7:
-                tomorrow_day_sorted = sorted(tomorrow_day_prices, reverse=True)
-                expensive_7_day = tomorrow_day_sorted[:7]
-                mean_7_expensive_tomorrow = sum(expensive_7_day) / 7
+            mean_7_expensive_tomorrow = most_expensive_mean(tomorrow_day_prices, self.rules.expensive_slots)
+            if mean_7_expensive_tomorrow is not None:
                 comparison_tomorrow = mean_7_expensive_tomorrow - mean_3
 
                 # Update the comparison sensor with the calculated price difference
-                self.set_state(
+                self.publisher.publish(
                     self.output_comparison_sensor,
                     state=comparison_tomorrow
                 )
 
-                # Check if day prices are at least 50 öre/kWh more expensive than night prices
-                if comparison_tomorrow < 40:
+                self.plan_slots = self.prices.tomorrow
+                self.night = list(night)
+                self.expensive_mean = mean_7_expensive_tomorrow
+
+                # Prices that failed the data quality checks can't be compared, charge in the fallback hours instead
+                quality = self.prices.tomorrow_quality
+                if quality.degraded:
+                    self.log(f"Tomorrow's prices failed the data quality checks ({'; '.join(describe(quality))}). "
+                             f"Charging in the fallback hours {self.degraded_hours}.")
+
+                # Check if day prices are sufficiently (40 öre/kWh by default) more expensive than night prices
+                elif comparison_tomorrow < self.rules.spread_min:
                     self.log("Day prices are not sufficiently more expensive than night prices. Charging will not be scheduled.")
                     # Update the sensor to indicate the price difference is too low
-                    self.set_state(
+                    self.publisher.publish(
                         self.output_selected_hours,
                         state="Price difference too low",
                         attributes={
@@ -85,6 +125,8 @@ class SmartNightCharging(hass.Hass):
                             "mean_3_cheapest_night": mean_3,
                         }
                     )
+                    self.publish_explanation("Price difference too low")
+                    self.cancel_charging()
                     return
 
                 # Log the results
@@ -93,27 +135,43 @@ class SmartNightCharging(hass.Hass):
                 self.log(f"Tomorrow's calculated mean of the 5 cheapest night hours: {mean_5:.2f}")
                 self.log(f"Tomorrow's price comparison (day vs night): {comparison_tomorrow:.2f}")
 
-                # Now determine the hours to use for charging based on price differences
-                selected_hours = []
-                if mean_5 - mean_3 <= 10:  # If the difference between 5 and 3 is small, choose 5 hours
-                    selected_hours = [hour for hour, _ in cheapest_5]
-                    selected_mean_price = mean_5  # Use the mean price for 5 hours
-                elif mean_4 - mean_3 <= 5:  # If the difference between 4 and 3 is small, choose 4 hours
-                    selected_hours = [hour for hour, _ in cheapest_4]
-                    selected_mean_price = mean_4  # Use the mean price for 4 hours
-                else:  # Otherwise, choose the 3 cheapest hours
-                    selected_hours = [hour for hour, _ in cheapest_3]
-                    selected_mean_price = mean_3  # Use the mean price for 3 hours
+                # Now determine the hours to use for charging, more hours at lower power when they are nearly as cheap
+                if quality.degraded:
+                    selected = [(hour, price) for hour, price in tomorrow_night_prices if hour in self.degraded_hours]
+                else:
+                    selected = self.rules.select(tomorrow_night_prices)
+                selected_hours = [hour for hour, _ in selected]
+                selected_mean_price = mean(price for _, price in selected) if selected else None
 
                 # Validate the selected hours before proceeding
-                if not selected_hours or any(hour < 0 or hour > 23 for hour in selected_hours):
+                if not selected_hours or any(hour < 0 or hour >= len(self.plan_slots) for hour in selected_hours):
                     self.log("Invalid selected hours. Stopping all charging.")
+                    self.cancel_charging()
                     self.stop_charging({})
                     return
 
                 # Sort the selected hours in order
                 selected_hours.sort()
 
+                # Cold cells or a hot inverter take less than the planned power, the energy they can't take
+                # moves to the next cheapest night slots
+                selected_hours_count = len(selected_hours)
+                self.planned_power = self.rules.power(selected_hours_count)
+                energy_kwh = self.planned_power / 1000 * sum(self.slot_hours(hour) for hour in selected_hours)
+                shortfall = self.plan_thermal(self.night, selected_hours, energy_kwh)
+                if sorted(self.slot_energy) != selected_hours:
+                    self.log(f"Charging hours {selected_hours} moved to {sorted(self.slot_energy)} by the temperature envelope.")
+                    selected_hours = sorted(self.slot_energy)
+                    selected_mean_price = mean(tomorrow_prices[hour] for hour in selected_hours) if selected_hours else None
+                if shortfall > 0.05:
+                    self.log(f"{shortfall:.2f} kWh of the planned charge doesn't fit the temperature envelope tonight.")
+                if not selected_hours:
+                    self.log("No night hours can take any charge at the forecast temperatures. Stopping all charging.")
+                    self.publish_explanation()
+                    self.cancel_charging()
+                    self.stop_charging({})
+                    return
+
                 # Store the validated selected hours for later checks
                 self.selected_hours = selected_hours
 
@@ -125,24 +183,17 @@ class SmartNightCharging(hass.Hass):
                 self.log(f"Tomorrow's mean price for selected hours: {selected_mean_price:.2f}")
 
                 # Update the selected hours sensor with the formatted time range, hours, and mean price
-                self.set_state(
-                    self.output_selected_hours,
-                    state=f"{time_range_str} | Mean: {selected_mean_price:.2f}",
-                    attributes={
-                        "selected_hours": selected_hours,
-                        "mean_price_for_selected_hours": selected_mean_price
-                    }
-                )
+                self.publish_selected_hours(selected_hours, selected_mean_price, shortfall)
+                self.publish_explanation()
 
                 # Update the new sensor for the mean price of the selected hours
-                self.set_state(
+                self.publisher.publish(
                     self.output_prices_for_selected_hours,
                     state=f"{selected_mean_price:.2f}",
                     attributes={"mean_price_for_selected_hours": selected_mean_price}
                 )
 
-                # Store the number of selected hours and call set_max_charging_power
-                selected_hours_count = len(selected_hours)
+                # Set the power for the number of hours the price rules selected
                 self.set_max_charging_power(selected_hours_count)
 
                 # Schedule charging
@@ -150,131 +201,172 @@ class SmartNightCharging(hass.Hass):
 
             else:
                 # If not enough data is available, set the sensor to unknown
-                self.set_state(self.output_selected_hours, state="unknown")
-                self.set_state(self.output_comparison_sensor, state="unknown")
+                self.publisher.publish(self.output_selected_hours, state="unknown")
+                self.publisher.publish(self.output_comparison_sensor, state="unknown")
                 self.log("Not enough data available for tomorrow's price calculation.")
 
-    def format_selected_hours(self, selected_hours):
-        """Formats selected charging hours into sequential and non-sequential ranges."""
-        if not selected_hours:
-            return "No valid charging hours"
-        
-        # Convert selected_hours into sequential and non-sequential ranges
-        ranges = []
-        current_range = [selected_hours[0]]
+    def slot_hours(self, position):
+        slot = self.plan_slots[position]
+        return (slot.end - slot.start).total_seconds() / 3600
+
+    def temperature_trend(self, entity, now):
+        """(°C, change per hour) from the telemetry buffer, else the current state without trend."""
+        result = trend(telemetry(entity), now.timestamp())
+        if result is not None:
+            return result
+        try:
+            return float(self.get_state(entity)), 0.0
+        except (TypeError, ValueError):
+            return None, 0.0
+
+    def plan_thermal(self, positions, selected_hours, energy_kwh):
+        """Spread energy_kwh over the slots at `positions` within the forecast power envelope.
+
+        Sets slot_energy and power_limits, returns the kWh that doesn't fit.
+        """
+        now = self.datetime(aware=True)
+        battery, battery_slope = self.temperature_trend(self.battery_temperature_sensor, now)
+        inverter, inverter_slope = self.temperature_trend(self.inverter_temperature_sensor, now)
+        candidates = []
+        for position in positions:
+            slot = self.plan_slots[position]
+            hours_ahead = max(0.0, ((slot.start + (slot.end - slot.start) / 2) - now).total_seconds() / 3600)
+            limit = power_limit(
+                self.max_charge_power,
+                forecast(battery, battery_slope, hours_ahead),
+                forecast(inverter, inverter_slope, hours_ahead),
+            )
+            self.power_limits[position] = round(limit)
+            candidates.append((position, slot.value, self.slot_hours(position), min(self.planned_power, limit) / 1000))
+        energies, shortfall = plan_energy(candidates, selected_hours, energy_kwh)
+        self.slot_energy = {position: kwh for position, kwh in self.slot_energy.items() if position not in positions}
+        self.slot_energy.update(energies)
+        return shortfall
+
+    def check_thermal_envelope(self, kwargs):
+        """Re-plan the coming charging slots when the live temperatures can't deliver their energy."""
+        now = self.datetime(aware=True)
+        remaining = [position for position in self.night if position < len(self.plan_slots) and self.plan_slots[position].start > now]
+        selected = [position for position in remaining if position in self.slot_energy]
+        if not selected:
+            return
+        energy_kwh = sum(self.slot_energy[position] for position in selected)
+        shortfall = self.plan_thermal(remaining, selected, energy_kwh)
+        selected_hours = sorted(self.slot_energy)
+        if selected_hours == self.selected_hours:
+            return
+
+        self.log(f"Charging hours re-planned to {selected_hours} for the live temperatures.")
+        self.log_to_logbook(f"Charging hours re-planned for the battery temperature: {self.format_selected_hours(selected_hours)}.")
+        self.selected_hours = selected_hours
+        selected_mean_price = mean(self.plan_slots[hour].value for hour in selected_hours)
+        self.publish_selected_hours(selected_hours, selected_mean_price, shortfall)
+        self.publish_explanation()
+        self.schedule_sequential_charging(selected_hours)
+
+    def publish_selected_hours(self, selected_hours, selected_mean_price, shortfall=0.0):
+        """Selected hours sensor with the slots, their planned energy and power limits."""
+        self.publisher.publish(
+            self.output_selected_hours,
+            state=f"{self.format_selected_hours(selected_hours)} | Mean: {selected_mean_price:.2f}",
+            attributes={
+                "selected_hours": selected_hours,
+                "mean_price_for_selected_hours": selected_mean_price,
+                "slot_starts": [self.plan_slots[hour].start.isoformat() for hour in selected_hours],
+                "max_charge_power": self.planned_power,
+                "slot_energy_kwh": [round(self.slot_energy.get(hour, 0.0), 3) for hour in selected_hours],
+                "slot_power_limits": [self.power_limits.get(hour) for hour in selected_hours],
+                "energy_shortfall_kwh": round(shortfall, 2),
+                "price_quality": describe(self.prices.tomorrow_quality),
+                "degraded": self.prices.tomorrow_quality.degraded,
+            }
+        )
 
-        for i in range(1, len(selected_hours)):
-            if selected_hours[i] == selected_hours[i - 1] + 1:
-                current_range.append(selected_hours[i])
+    def publish_explanation(self, skipped_reason=None):
+        """Per slot explanation of the plan: price, action, energy, value of a kWh and the deciding constraint."""
+        night = set(self.night)
+        entries = []
+        for position, slot in enumerate(self.plan_slots):
+            value = None if slot.value is None or self.expensive_mean is None else self.expensive_mean - slot.value
+            if position not in night:
+                entries.append(slot_entry(slot, value=value, constraint="window"))
+            elif skipped_reason is not None:
+                entries.append(slot_entry(slot, value=value, constraint="spread_threshold"))
+            elif position in self.slot_energy:
+                limited = self.power_limits.get(position, self.planned_power) < self.planned_power
+                constraint = "power_limit" if limited else "charge_power"
+                entries.append(slot_entry(slot, "charge", self.slot_energy[position], value, constraint))
+            elif self.power_limits.get(position, 1) <= 0:
+                entries.append(slot_entry(slot, value=value, constraint="power_limit"))
             else:
-                ranges.append(current_range)
-                current_range = [selected_hours[i]]
-        
-        # Add the last range
-        ranges.append(current_range)
-
-        # Format the ranges
-        formatted_ranges = []
-        for r in ranges:
-            if len(r) == 1:
-                formatted_ranges.append(f"{r[0]:02d}:00")
-            else:
-                formatted_ranges.append(f"{r[0]:02d}:00-{r[-1] + 1:02d}:00")
+                entries.append(slot_entry(slot, value=value, constraint="cheaper_slots"))
+
+        totals = summary(entries)
+        state = skipped_reason or f"{totals['energy_kwh'].get('charge', 0.0):.1f} kWh in {len(self.slot_energy)} slots"
+        self.publisher.publish(self.output_explanation, state, dict(totals, slots=entries))
 
-        return " , ".join(formatted_ranges)
+    def format_selected_hours(self, selected_hours):
+        """Formats selected charging hours as the clock ranges of their slots."""
+        if not selected_hours:
+            return "No valid charging hours"
+        return format_ranges(self.plan_slots, selected_hours)
 
     def set_max_charging_power(self, selected_hours_count):
         """Set max charging power based on selected hours count."""
-        if selected_hours_count == 3:
-            max_power = 6200
-        elif selected_hours_count == 4:
-            max_power = 4700
-        elif selected_hours_count == 5:
-            max_power = 3800
-        else:
-            max_power = 4000  # Fallback if no valid selection
+        max_power = self.rules.power(selected_hours_count)  # 4000 W fallback if no valid selection
 
         # Set max charging power
-        self.call_service(
-            "input_number/set_value",
-            entity_id="input_number.set_sg_battery_max_charge_power",
-            value=max_power
-        )
+        send_command(self, "input_number.set_sg_battery_max_charge_power", max_power)
         self.log(f"Setting max charging power to {max_power}W.")
         self.log_to_logbook(f"Max charging power set to {max_power}W.")
 
     def schedule_sequential_charging(self, selected_hours):
-        """Schedule charging for the selected hours."""
-        now = datetime.datetime.now()
-        tomorrow = now + datetime.timedelta(days=1)
-
-        # Identify sequential ranges and non-sequential hours
-        sequential_ranges = []
-        non_sequential_hours = []
-
-        # Create the ranges for sequential hours
-        temp_range = [selected_hours[0]]
-        for i in range(1, len(selected_hours)):
-            if selected_hours[i] == selected_hours[i-1] + 1:
-                temp_range.append(selected_hours[i])
-            else:
-                if len(temp_range) > 1:
-                    sequential_ranges.append(temp_range)
-                else:
-                    non_sequential_hours.append(temp_range[0])
-                temp_range = [selected_hours[i]]
-        
-        # Append the last range or non-sequential hour
-        if len(temp_range) > 1:
-            sequential_ranges.append(temp_range)
-        else:
-            non_sequential_hours.append(temp_range[0])
+        """Schedule charging for the selected hours at the real start and end of their price slots."""
+        slots = self.plan_slots
+        now = self.datetime(aware=True)
+
+        # A re-plan replaces the timers of the earlier plan
+        self.cancel_charging_timers()
 
-        # To avoid scheduling the same hour twice, track scheduled hours
-        scheduled_hours = set()
+        # Store the selected slots as (start, end) for the check in start_charging
+        self.selected_slots = [(slots[hour].start, slots[hour].end) for hour in selected_hours]
 
-        # Log and schedule charging for sequential ranges
-        for range_ in sequential_ranges:
-            start_hour = range_[0]
-            end_hour = range_[-1]
+        # To avoid scheduling the same time twice, track scheduled times
+        scheduled_times = set()
 
-            # Log the range
-            self.log(f"Charging scheduled between {start_hour:02d}:00-{end_hour + 1:02d}:00")
+        # Back to back slots are one range, from the start of its first slot to the end of its last one
+        for start_time, stop_time in range_times(slots, selected_hours):
+            self.log(f"Charging scheduled between {start_time.strftime('%H:%M')}-{stop_time.strftime('%H:%M')}")
 
-            # Schedule charging start at the first hour of the range
-            start_time = tomorrow.replace(hour=start_hour, minute=0, second=0, microsecond=0)
-            if start_hour not in scheduled_hours:
-                self.run_at(self.start_charging, start_time)  # Schedule start charging
+            # Schedule charging start at the start of the first slot of the range
+            if start_time not in scheduled_times and start_time >= now:
+                self.charging_timers.append(self.run_at(self.start_charging, start_time))
                 self.log(f"Charging start scheduled at {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                scheduled_hours.add(start_hour)  # Add start hour to the set
+                scheduled_times.add(start_time)
 
-            # Schedule charging stop at the last hour of the range
-            stop_time = tomorrow.replace(hour=end_hour + 1, minute=0, second=0, microsecond=0)
-            if end_hour + 1 not in scheduled_hours:
-                self.run_at(self.stop_charging, stop_time)  # Schedule stop charging
+            # Schedule charging stop at the end of the last slot of the range
+            if stop_time not in scheduled_times and stop_time >= now:
+                self.charging_timers.append(self.run_at(self.stop_charging, stop_time))
                 self.log(f"Charging stop scheduled at {stop_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                scheduled_hours.add(end_hour + 1)  # Add stop hour to the set
-
-        # For non-sequential hours, schedule separately
-        for hour in non_sequential_hours:
-            # Only schedule if the hour has not been scheduled already
-            if hour not in scheduled_hours:
-                target_time = tomorrow.replace(hour=hour, minute=0, second=0, microsecond=0)
-                self.run_at(self.start_charging, target_time)  # Schedule start charging
-                self.log(f"Charging start scheduled at {target_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                scheduled_hours.add(hour)  # Add the hour to the set
-
-                stop_time = tomorrow.replace(hour=hour + 1, minute=0, second=0, microsecond=0)
-                self.run_at(self.stop_charging, stop_time)  # Schedule stop charging
-                self.log(f"Charging stop scheduled at {stop_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                scheduled_hours.add(hour + 1)  # Add the stop hour to the set
+                scheduled_times.add(stop_time)
 
+    def cancel_charging_timers(self):
+        """Cancel the start and stop timers of the earlier plan."""
+        for handle in self.charging_timers:
+            self.cancel_timer(handle)
+        self.charging_timers = []
 
+    def cancel_charging(self):
+        """Drop the earlier plan when no charging is planned: its timers, slots and energy."""
+        self.cancel_charging_timers()
+        self.selected_slots = []
+        self.selected_hours = []
+        self.slot_energy = {}
 
     def start_charging(self, kwargs):
         """Start charging the battery."""
-        current_hour = datetime.datetime.now().hour
-        if current_hour in self.selected_hours:
+        now = self.datetime(aware=True)
+        if any(start <= now < end for start, end in self.selected_slots):
             self.log_to_logbook("Starting battery charging.")
             self.run_in(self.set_forced_mode, 2)
             self.run_in(self.set_forced_charge, 4)
@@ -284,29 +376,17 @@ class SmartNightCharging(hass.Hass):
     def stop_charging(self, kwargs):
         """Stop charging the battery."""
         self.log_to_logbook("Stopping battery charging.")
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Stop (default)"
-        )
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Stop (default)")
 
     def set_forced_mode(self, kwargs):
         """Set EMS mode to Forced mode and start charging."""
         self.log_to_logbook("Setting EMS mode to Forced mode.")
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_ems_mode",
-            option="Forced mode"
-        )
+        send_command(self, "input_select.set_sg_ems_mode", "Forced mode")
 
     def set_forced_charge(self, kwargs):
         """Force battery to charge."""
         self.log_to_logbook("Forcing battery to charge.")
-        self.call_service(
-            "input_select/select_option",
-            entity_id="input_select.set_sg_battery_forced_charge_discharge_cmd",
-            option="Forced charge"
-        )
+        send_command(self, "input_select.set_sg_battery_forced_charge_discharge_cmd", "Forced charge")
 
     def log_to_logbook(self, message):
         """Logs a message to the Home Assistant Logbook."""
@@ -1,6 +1,9 @@
 import appdaemon.plugins.hass.hassapi as hass
 import datetime
 
+from sungrow_engine.prices import slots_from_list
+from sungrow_engine.ranges import format_ranges
+
     # This app creates additional sensors needed for display and other apps working properly.
 
 class SmartNightChargingSensors(hass.Hass):
@@ -12,6 +15,8 @@ class SmartNightChargingSensors(hass.Hass):
         self.output_selected_hours = "sensor.mock_selected_charging_hours"
         self.output_comparison_sensor = "sensor.mock_night_charging_day_prices_comparison"
         self.output_prices_for_selected_hours = "sensor.mock_selected_charging_hours_prices"  # New sensor for prices
+        self.forecast_sensor = "sensor.nordpool_price_forecast"  # P50 forecast used before tomorrow is published
+        self.tomorrow_slots = []  # Tomorrow's prices on the clock, for the time ranges
         
         # Trigger the update calculation every day at 06:01 and 14:00
         self.run_daily(self.update_charging_hours, datetime.time(14, 0))
@@ -26,6 +31,18 @@ class SmartNightChargingSensors(hass.Hass):
         # Fetch tomorrow's prices from the Nordpool sensor (assumed to be "tomorrow")
         tomorrow_prices = self.get_state(self.sensor_name, attribute="tomorrow") or []
 
+        # Before ~13:00 tomorrow is not published yet, use the median forecast instead of running blind
+        source = "nordpool"
+        if len(tomorrow_prices) < 7:
+            tomorrow_date = (self.date() + datetime.timedelta(days=1)).isoformat()
+            if self.get_state(self.forecast_sensor, attribute="date") == tomorrow_date:
+                tomorrow_prices = self.get_state(self.forecast_sensor, attribute="p50") or []
+                source = "forecast"
+
+        # Spread over tomorrow's real day, 23 or 25 hours on DST days
+        tomorrow = self.date() + datetime.timedelta(days=1)
+        self.tomorrow_slots = slots_from_list(tomorrow_prices, tomorrow, self.datetime(aware=True).tzinfo)
+
         # Ensure there are enough data points (7 night hours)
         if len(tomorrow_prices) >= 7:
             # Extract the night prices (first 7 hours) and day prices (next hours)
@@ -126,7 +143,8 @@ class SmartNightChargingSensors(hass.Hass):
                     state=f"{time_range_str} | Mean: {selected_mean_price:.2f}",
                     attributes={
                         "selected_hours": selected_hours,
-                        "mean_price_for_selected_hours": selected_mean_price
+                        "mean_price_for_selected_hours": selected_mean_price,
+                        "source": source
                     }
                 )
 
@@ -134,7 +152,7 @@ class SmartNightChargingSensors(hass.Hass):
                 self.set_state(
                     self.output_prices_for_selected_hours,
                     state=f"{selected_mean_price:.2f}",
-                    attributes={"mean_price_for_selected_hours": selected_mean_price}
+                    attributes={"mean_price_for_selected_hours": selected_mean_price, "source": source}
                 )
 
         else:
@@ -144,30 +162,7 @@ class SmartNightChargingSensors(hass.Hass):
             self.log("Not enough data available for tomorrow's price calculation.")
 
     def format_selected_hours(self, selected_hours):
-        """Formats selected charging hours into sequential and non-sequential ranges."""
+        """Formats selected charging hours as the clock ranges of their slots."""
         if not selected_hours:
             return "No valid charging hours"
-        
-        # Convert selected_hours into sequential and non-sequential ranges
-        ranges = []
-        current_range = [selected_hours[0]]
-
-        for i in range(1, len(selected_hours)):
-            if selected_hours[i] == selected_hours[i - 1] + 1:
-                current_range.append(selected_hours[i])
-            else:
-                ranges.append(current_range)
-                current_range = [selected_hours[i]]
-        
-        # Add the last range
-        ranges.append(current_range)
-
-        # Format the ranges
-        formatted_ranges = []
-        for r in ranges:
-            if len(r) == 1:
-                formatted_ranges.append(f"{r[0]:02d}:00")
-            else:
-                formatted_ranges.append(f"{r[0]:02d}:00-{r[-1] + 1:02d}:00")
-
-        return " , ".join(formatted_ranges)
+        return format_ranges(self.tomorrow_slots, selected_hours)
@@ -0,0 +1,110 @@
+import appdaemon.plugins.hass.hassapi as hass
+import datetime
+import time
+
+from sungrow_engine.battery_model import BatteryModel
+from sungrow_engine.horizon import get_timeline
+from sungrow_engine.scenarios import Scenario, dp_plan, evaluate, sample_scenarios, stochastic_plan
+
+    # This app makes a scenario based battery plan for the rest of today and tomorrow (or tomorrow's forecast).
+    # Hundreds of price/load/PV scenarios are drawn from the P10/P50/P90 forecast and solved together,
+    # the plan with the best expected cost is published with its risk (spread, P90 cost, CVaR).
+    # It only publishes the plan and compares it with the deterministic P50 plan, the other apps still do the switching.
+
+
+class StochasticPlanner(hass.Hass):
+    def initialize(self):
+        """Initialize the app and schedule the planning runs."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.forecast_sensor = "sensor.nordpool_price_forecast"
+        self.battery_sensor = "sensor.battery_level_nominal"
+        self.output_sensor = "sensor.stochastic_battery_plan"
+
+        self.model = BatteryModel.from_args(self.args)
+        self.scenario_count = int(self.args.get("scenarios", 200))
+        self.step_kwh = float(self.args.get("step_kwh", 1.0))
+        self.workers = int(self.args.get("workers", 0))
+        self.load_kw = float(self.args.get("load_kw", 0.5))  # Expected house load
+        self.pv_peak_kw = float(self.args.get("pv_peak_kw", 0))  # Expected PV at noon, 0 = ignore PV
+        self.export_price_factor = float(self.args.get("export_price_factor", 0.8))
+        self.export_price_offset = float(self.args.get("export_price_offset", 0))
+
+        # Plan after the publication of tomorrow's prices and every hour with the current SOC
+        self.run_hourly(self.update_plan, datetime.time(0, 2, 0))
+        self.update_plan()
+
+    def horizon(self):
+        """(slot starts, p10, p50, p90) from the current slot to the end of the known or forecast prices."""
+        # The timeline forecasts the unpublished day so the horizon reaches past midnight
+        timeline = get_timeline(self, self.sensor_name, self.forecast_sensor)
+        current = timeline.position(self.datetime(aware=True)) or 0
+        starts = timeline.starts[current:]
+        p10 = timeline.p10[current:]
+        p50 = timeline.values()[current:]
+        p90 = timeline.p90[current:]
+
+        # Missing prices are filled with the previous one, the planner needs a price in every slot
+        for curve in (p10, p50, p90):
+            for i, value in enumerate(curve):
+                if value is None:
+                    curve[i] = curve[i - 1] if i else next((v for v in curve if v is not None), 0.0)
+        return starts, p10, p50, p90
+
+    def update_plan(self, *args):
+        """Sample scenarios, solve them together and publish the best expected plan."""
+        starts, p10, p50, p90 = self.horizon()
+        if len(p50) < 2:
+            self.set_state(self.output_sensor, state="unknown", attributes={"error": "Not enough price data"})
+            return
+        try:
+            soc = float(self.get_state(self.battery_sensor))
+        except (TypeError, ValueError):
+            self.log("Invalid battery level, stochastic plan skipped.")
+            return
+
+        self.model.min_soc = self.get_float("input_number.set_sg_min_soc", self.model.min_soc)
+        self.model.max_soc = self.get_float("input_number.set_sg_max_soc", self.model.max_soc)
+        slot_hours = (starts[1] - starts[0]).total_seconds() / 3600
+        start_kwh = self.model.soc_kwh(soc)
+
+        started = time.perf_counter()
+        load = [self.load_kw * slot_hours] * len(p50)
+        pv = [self.pv_peak_kw * slot_hours * max(0.0, 1 - abs(start.hour + start.minute / 60 - 12.5) / 5) for start in starts]
+        scenarios = sample_scenarios(
+            p10, p50, p90, self.scenario_count, correlation=0.7,
+            export_factor=self.export_price_factor, export_offset=self.export_price_offset, load_kwh=load, pv_kwh=pv,
+        )
+
+        # The deterministic plan on the median prices, for comparison
+        median = Scenario(p50, [p * self.export_price_factor + self.export_price_offset for p in p50],
+                          [l - v for l, v in zip(load, pv)])
+        deterministic = dp_plan(median, self.model, start_kwh, self.step_kwh, slot_hours)
+
+        result = stochastic_plan(scenarios, self.model, start_kwh, self.step_kwh, slot_hours,
+                                 extra_plans=[deterministic], workers=self.workers)
+        deterministic_costs = evaluate(deterministic, scenarios, self.model, start_kwh, slot_hours)
+        solve_seconds = time.perf_counter() - started
+
+        self.set_state(self.output_sensor, state=round(-result["expected_cost"] / 100, 2), attributes={
+            "unit_of_measurement": "SEK",
+            "plan": [
+                {"start": start.isoformat(), "energy_kwh": round(energy, 2)}
+                for start, energy in zip(starts, result["plan"]) if energy
+            ],
+            "expected_cost": round(result["expected_cost"], 1),
+            "cost_std": round(result["std"], 1),
+            "p10_cost": round(result["p10_cost"], 1),
+            "p90_cost": round(result["p90_cost"], 1),
+            "cvar_90": round(result["cvar_90"], 1),
+            "deterministic_expected_cost": round(sum(deterministic_costs) / len(deterministic_costs), 1),
+            "scenarios": result["scenarios"],
+            "candidate_plans": result["candidates"],
+            "solve_seconds": round(solve_seconds, 3),
+        })
+        self.log(f"Stochastic plan: expected cost {result['expected_cost']:.1f} öre over {len(p50)} slots, solved in {solve_seconds:.2f}s.")
+
+    def get_float(self, entity, default):
+        try:
+            return float(self.get_state(entity))
+        except (TypeError, ValueError):
+            return default
@@ -0,0 +1,14 @@
+"""Shared engine for the Sungrow/Nordpool apps.
+
+The apps import their models and caches from this package instead of defining them
+in the app files. AppDaemon only reloads the app module whose file changed, the
+package stays imported, so a reload keeps the trained models and caches and costs
+milliseconds. Heavy optional dependencies are imported lazily through
+sungrow_engine.lazy, never at import time.
+
+Only absolute imports (`from sungrow_engine.x import y`) are used so AppDaemon can
+walk the folder without breaking anything.
+"""
+
+from sungrow_engine.store import shared, drop
+from sungrow_engine.lazy import lazy_import, optional_import
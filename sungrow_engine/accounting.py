@@ -0,0 +1,91 @@
+"""Realized savings accounting per price slot.
+
+Costs are in the price unit of the Nordpool sensor (öre) and energies in kWh.
+The no-battery counterfactual removes the battery flows from the grid balance of
+the slot; the naive counterfactual moves the same energy at the day's fixed
+window averages (charge 00-06, discharge 06-22).
+"""
+
+import datetime
+import json
+from collections import namedtuple
+
+SlotRecord = namedtuple(
+    "SlotRecord",
+    "start imported exported charged discharged price export_price naive_charge_price naive_discharge_price",
+)
+
+
+def slot_costs(record):
+    """(actual, no battery, naive schedule) cost of one slot."""
+    actual = record.imported * record.price - record.exported * record.export_price
+
+    # Without the battery the house would have imported/exported the net of the grid and battery flows
+    net = record.imported - record.exported - record.charged + record.discharged
+    no_battery = max(net, 0.0) * record.price - max(-net, 0.0) * record.export_price
+
+    naive = no_battery + record.charged * record.naive_charge_price - record.discharged * record.naive_discharge_price
+    return actual, no_battery, naive
+
+
+class SavingsLedger:
+    """Running totals per day and month, updated one slot at a time."""
+
+    FIELDS = ("actual", "no_battery", "naive", "imported", "exported", "charged", "discharged")
+
+    def __init__(self):
+        self.days = {}  # "YYYY-MM-DD" -> totals
+        self.months = {}  # "YYYY-MM" -> totals
+        self.last_start = None
+
+    @staticmethod
+    def _empty():
+        return dict.fromkeys(SavingsLedger.FIELDS, 0.0)
+
+    def add(self, record):
+        """Add a slot, slots already added (same or older start) are ignored."""
+        # Compared in UTC, the repeated autumn hour has the same local clock but a later start
+        start = datetime.datetime.fromisoformat(record.start).astimezone(datetime.timezone.utc)
+        if self.last_start is not None and start <= self.last_start:
+            return False
+        self.last_start = start
+
+        actual, no_battery, naive = slot_costs(record)
+        values = (actual, no_battery, naive, record.imported, record.exported, record.charged, record.discharged)
+        for totals in (
+            self.days.setdefault(record.start[:10], self._empty()),
+            self.months.setdefault(record.start[:7], self._empty()),
+        ):
+            for field, value in zip(self.FIELDS, values):
+                totals[field] += value
+        return True
+
+    def day(self, key):
+        return self.days.get(key) or self._empty()
+
+    def month(self, key):
+        return self.months.get(key) or self._empty()
+
+
+def append_archive(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(list(record)) + "\n")
+
+
+def read_archive(path):
+    """SlotRecords from a JSON lines archive, streamed in file order."""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield SlotRecord(*json.loads(line))
+    except FileNotFoundError:
+        return
+
+
+def rebuild(path):
+    """Ledger recomputed from the archive."""
+    ledger = SavingsLedger()
+    for record in read_archive(path):
+        ledger.add(record)
+    return ledger
@@ -0,0 +1,245 @@
+"""Priority arbitration of the inverter commands sent by the apps.
+
+Every command is an intent: a source app wants an entity at a value from a start time
+until an end time. Intents live in an interval tree; at any time the intent with the
+highest source priority (the newest on a tie) decides each entity. Only a change of
+the decided value is written to the inverter, and overlapping intents that want
+different values are recorded as contradictions.
+
+A command without end holds until the source sends another value for the entity or
+`max_hold` runs out. The idle values (Forced mode, Stop) without an end release the
+source's claim instead of holding the entity against the other apps, and
+release_command ends a claim explicitly, with the value to write if nobody else holds
+the entity. `max_hold` is only a safety net for an app that never ends its command.
+"""
+
+import datetime
+import math
+from collections import deque, namedtuple
+
+EMS_MODE = "input_select.set_sg_ems_mode"
+FORCED_CMD = "input_select.set_sg_battery_forced_charge_discharge_cmd"
+
+IDLE = {
+    EMS_MODE: "Forced mode",
+    FORCED_CMD: "Stop (default)",
+}
+
+Intent = namedtuple("Intent", "source entity value start end priority seq")
+
+
+class IntervalTree:
+    """Centered interval tree of items with [start, end) times, rebuilt lazily after changes.
+
+    Intents change a few times an hour and are queried at every decision, so the
+    tree is built on the first query after a change; stabbing queries are then
+    O(log n + matches).
+    """
+
+    def __init__(self):
+        self.items = []
+        self._root = None
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        self.items.append(item)
+        self._dirty = True
+
+    def remove(self, predicate):
+        """Remove the items for which predicate(item) is true, returns them."""
+        removed = [item for item in self.items if predicate(item)]
+        if removed:
+            self.items = [item for item in self.items if not predicate(item)]
+            self._dirty = True
+        return removed
+
+    def _build(self, items):
+        if not items:
+            return None
+        points = sorted(point for item in items for point in (item.start, item.end) if point != math.inf)
+        center = points[(len(points) - 1) // 2] if points else items[0].start
+        left = [item for item in items if item.end <= center]
+        right = [item for item in items if item.start > center]
+        here = [item for item in items if item.start <= center < item.end]
+        if len(left) == len(items) or len(right) == len(items):
+            left, right, here = [], [], items  # No split possible, keep them at this node
+        return (
+            center,
+            sorted(here, key=lambda item: item.start),
+            sorted(here, key=lambda item: item.end, reverse=True),
+            self._build(left),
+            self._build(right),
+        )
+
+    def _tree(self):
+        if self._dirty:
+            self._root = self._build(self.items)
+            self._dirty = False
+        return self._root
+
+    def at(self, t):
+        """Items with start <= t < end."""
+        found = []
+        node = self._tree()
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if t < center:
+                for item in by_start:
+                    if item.start > t:
+                        break
+                    found.append(item)
+                node = left
+            else:
+                for item in by_end:
+                    if item.end <= t:
+                        break
+                    found.append(item)
+                node = right
+        return found
+
+    def overlapping(self, start, end):
+        """Items that overlap [start, end)."""
+        return [item for item in self.items if item.start < end and start < item.end]
+
+
+class Arbiter:
+    """Intents from all apps and the values last written, resolved by priority."""
+
+    def __init__(self, priorities=None, default_priority=0, max_hold=12 * 3600, log_size=50):
+        self.priorities = dict(priorities or {})
+        self.default_priority = default_priority
+        self.max_hold = max_hold
+        self.tree = IntervalTree()
+        self.emitted = {}  # entity -> value last written
+        self.decisions = deque(maxlen=log_size)
+        self.contradictions = deque(maxlen=log_size)
+        self.contradiction_count = 0  # All time, the deque only keeps the latest
+        self._seq = 0
+        self._reported = set()  # (source, seq of the other intent) already reported as contradicting
+
+    def priority(self, source):
+        return self.priorities.get(source, self.default_priority)
+
+    def _intent(self, source, entity, value, start, end):
+        self._seq += 1
+        return Intent(source, entity, value, start, end, self.priority(source), self._seq)
+
+    def _add(self, intent):
+        for other in self.tree.overlapping(intent.start, intent.end):
+            if other.entity == intent.entity and other.source != intent.source and other.value != intent.value:
+                key = (intent.source, other.seq)
+                if key in self._reported:
+                    continue  # Already reported against this intent, e.g. a controller adjusting its setpoint
+                self._reported.add(key)
+                winner, loser = sorted((intent, other), key=lambda i: (i.priority, i.seq), reverse=True)
+                self.contradiction_count += 1
+                self.contradictions.append({
+                    "time": _iso(max(intent.start, other.start)),
+                    "entity": intent.entity,
+                    "winner": f"{winner.source}={winner.value}",
+                    "loser": f"{loser.source}={loser.value}",
+                })
+        self.tree.add(intent)
+        live = {i.seq for i in self.tree.items}
+        self._reported = {key for key in self._reported if key[1] in live}
+
+    def request(self, source, entity, value, now, until=None):
+        """A command from an app at `now` (unix time). Returns the changes to write now."""
+        self.tree.remove(lambda i: i.source == source and i.entity == entity and i.start <= now < i.end)
+        released = until is None and value == IDLE.get(entity)
+        if not released:
+            self._add(self._intent(source, entity, value, now, until if until is not None else now + self.max_hold))
+        return self.resolve(now, [entity], {entity: (source, value)} if released else None)
+
+    def submit(self, source, commands, start, end):
+        """Planned intents {entity: value} for [start, end), decided when their time comes."""
+        for entity, value in commands.items():
+            self._add(self._intent(source, entity, value, start, end))
+
+    def release(self, source, entity, now, value=None):
+        """Drop the source's claim on an entity, returns the changes to write now.
+
+        `value` (the idle value by default) is written when no other source holds the entity.
+        """
+        self.tree.remove(lambda i: i.source == source and i.entity == entity and i.end > now)
+        value = value if value is not None else IDLE.get(entity)
+        return self.resolve(now, [entity], {entity: (source, value)} if value is not None else None)
+
+    def withdraw(self, source, now):
+        """Drop the current and planned intents of a source, returns the changes to write now."""
+        removed = self.tree.remove(lambda i: i.source == source and i.end > now)
+        released = {i.entity: (source, IDLE[i.entity]) for i in removed if i.entity in IDLE}
+        return self.resolve(now, sorted({i.entity for i in removed}), released)
+
+    def resolve(self, now, entities=None, released=None):
+        """Decide the entities at `now`, returns {entity: value} for the values that change.
+
+        An entity nobody holds keeps its value, unless a source just released it or its
+        intent ended; then the idle value is written.
+        """
+        released = dict(released or {})
+        for intent in self.tree.remove(lambda i: i.end <= now):
+            if intent.entity in IDLE:
+                released.setdefault(intent.entity, (intent.source, IDLE[intent.entity]))
+        active = self.tree.at(now)
+        if entities is None:
+            entities = sorted({intent.entity for intent in active} | set(released))
+        changes = {}
+        for entity in entities:
+            holders = [intent for intent in active if intent.entity == entity]
+            if holders:
+                winner = max(holders, key=lambda i: (i.priority, i.seq))
+                source, value = winner.source, winner.value
+            elif entity in released:
+                source, value = released[entity]
+            else:
+                continue
+            if self.emitted.get(entity) != value:
+                self.emitted[entity] = value
+                changes[entity] = value
+                self.decisions.append({"time": _iso(now), "entity": entity, "value": value, "source": source})
+        return changes
+
+    def next_boundary(self, now):
+        """The next time an intent starts or ends after `now`, None if there is none."""
+        times = [t for intent in self.tree.items for t in (intent.start, intent.end) if now < t < math.inf]
+        return min(times) if times else None
+
+    def active(self, now):
+        return sorted(self.tree.at(now), key=lambda i: (i.entity, -i.priority))
+
+
+def _iso(t):
+    return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).isoformat()
+
+
+def send_command(app, entity_id, value, until=None, arbiter="command_arbiter"):
+    """Send an inverter command through the arbiter app, straight to Home Assistant if it isn't running.
+
+    `until` (aware datetime) ends the command; without it the command holds until the
+    app sends another value for the entity.
+    """
+    target = app.get_app(arbiter)
+    if target is not None:
+        target.command(app.name, entity_id, value, until)
+    elif entity_id.startswith("input_number."):
+        app.call_service("input_number/set_value", entity_id=entity_id, value=value)
+    else:
+        app.call_service("input_select/select_option", entity_id=entity_id, option=value)
+
+
+def release_command(app, entity_id, value=None, arbiter="command_arbiter"):
+    """End the app's command for an entity, the entity goes to the next app's command or to `value`.
+
+    Without the arbiter app `value` is written straight to Home Assistant.
+    """
+    target = app.get_app(arbiter)
+    if target is not None:
+        target.release(app.name, entity_id, value)
+    elif value is not None and entity_id.startswith("input_number."):
+        app.call_service("input_number/set_value", entity_id=entity_id, value=value)
+    elif value is not None:
+        app.call_service("input_select/select_option", entity_id=entity_id, option=value)
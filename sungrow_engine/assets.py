@@ -0,0 +1,165 @@
+"""Joint planning of the battery, an EV charger and a heat pump under the main fuse.
+
+The assets compete for the same cheap slots and the same fuse, so they are planned
+together. The fuse limit is priced into the slots (a Lagrangian price per slot): the
+EV and the heat pump fill the cheapest slots they may use at the slot price plus the
+fuse price, and the battery's SOC dynamic program wants charge at the same prices.
+Slots where the wanted import is over the fuse get a higher fuse price, slots under
+it a lower one, and the assets are planned again.
+
+Every round also gives a plan that fits the fuse: the loads where they were placed,
+and the battery charging only in the room they leave. The cheapest such plan at the
+real prices wins, so the result always fits the fuse, and a round that prices the
+fuse badly costs nothing.
+
+Energies are kWh per slot, prices öre/kWh, powers kW.
+"""
+
+import statistics
+from collections import namedtuple
+
+from sungrow_engine.battery_model import grid_cost, slot_cost
+
+# energy_kwh needed by the departure slot (exclusive), charging from first_slot at up to max_kw
+EvCharge = namedtuple("EvCharge", "energy_kwh max_kw first_slot departure_slot")
+
+# demand_kwh per slot, which the heat pump may run up to preheat_slots earlier at up to max_kw
+HeatPump = namedtuple("HeatPump", "demand_kwh max_kw preheat_slots")
+
+AssetPlan = namedtuple("AssetPlan", "battery ev heat_pump grid cost shortfall iterations")
+
+
+def schedule_ev(ev, prices, room, slot_hours):
+    """(kWh per slot, kWh that doesn't fit) filling the cheapest slots before departure within room."""
+    energy = [0.0] * len(prices)
+    needed = ev.energy_kwh
+    last = min(ev.departure_slot, len(prices))
+    for t in sorted(range(max(0, ev.first_slot), last), key=prices.__getitem__):
+        if needed <= 1e-9:
+            break
+        energy[t] = max(0.0, min(needed, ev.max_kw * slot_hours, room[t]))
+        needed -= energy[t]
+    return energy, max(0.0, needed)
+
+
+def schedule_heat_pump(heat_pump, prices, room, slot_hours):
+    """(kWh per slot, kWh of demand that can't be met) running the heat pump in the cheapest allowed slots.
+
+    Cheapest slots first, each slot serves the unmet demand with the earliest deadline
+    it can reach: the demand of slot t may be run in slots t - preheat_slots to t.
+    """
+    slots = len(prices)
+    demand = [float(value) for value in heat_pump.demand_kwh[:slots]] + [0.0] * max(0, slots - len(heat_pump.demand_kwh))
+    energy = [0.0] * slots
+    reach = heat_pump.preheat_slots
+    for s in sorted(range(slots), key=prices.__getitem__):
+        free = max(0.0, min(heat_pump.max_kw * slot_hours, room[s]))
+        for t in range(s, min(slots, s + reach + 1)):
+            if free <= 1e-9:
+                break
+            if demand[t] > 1e-9:
+                used = min(free, demand[t])
+                demand[t] -= used
+                energy[s] += used
+                free -= used
+    return energy, sum(demand)
+
+
+def grid_energy(battery, ev, heat_pump, base_load, efficiency):
+    """Net grid import per slot, discharged battery energy counted after losses."""
+    return [
+        load + e + h + (b if b >= 0 else b * efficiency)
+        for b, e, h, load in zip(battery, ev, heat_pump, base_load)
+    ]
+
+
+def battery_dp(prices, export_prices, net_load, model, start_kwh, step_kwh, slot_hours, charge_room=None):
+    """Cost minimal battery kWh per slot, charging at most charge_room[t] kWh from the grid in slot t."""
+    levels = int((model.max_kwh - model.min_kwh) / step_kwh) + 1
+    max_up = int(model.charge_kw * slot_hours / step_kwh)
+    max_down = int(model.discharge_kw * slot_hours / step_kwh)
+    end_value = statistics.fmean(sorted(prices)[:max(1, len(prices) // 4)]) * step_kwh
+
+    # Backward pass: value[i] is the cost to go from level i
+    value = [-end_value * i for i in range(levels)]
+    choices = []
+    for t in range(len(prices) - 1, -1, -1):
+        up = max_up if charge_room is None else min(max_up, int(charge_room[t] / step_kwh + 1e-9))
+        deltas = range(-max_down, up + 1)
+        costs = [slot_cost(d * step_kwh, prices[t], export_prices[t], net_load[t], model) for d in deltas]
+        new_value = [0.0] * levels
+        choice = [0] * levels
+        for i in range(levels):
+            best, best_d = None, 0
+            for d, cost in zip(deltas, costs):
+                j = i + d
+                if 0 <= j < levels:
+                    cost += value[j]
+                    if best is None or cost < best:
+                        best, best_d = cost, d
+            new_value[i] = best
+            choice[i] = best_d
+        value = new_value
+        choices.append(choice)
+    choices.reverse()
+
+    level = min(levels - 1, max(0, round((start_kwh - model.min_kwh) / step_kwh)))
+    plan = []
+    for choice in choices:
+        plan.append(choice[level] * step_kwh)
+        level += choice[level]
+    return plan
+
+
+def plan_cost(battery, ev, heat_pump, base_load, prices, export_prices, model):
+    """Grid cost plus battery wear of a plan, the energy left in the battery credited."""
+    grid = grid_energy(battery, ev, heat_pump, base_load, model.efficiency)
+    cost = sum(grid_cost(g, price, export) for g, price, export in zip(grid, prices, export_prices))
+    cost -= sum(b * model.cycle_cost for b in battery if b < 0)
+    if prices:
+        cost -= sum(battery) * statistics.fmean(sorted(prices)[:max(1, len(prices) // 4)])
+    return cost, grid
+
+
+def co_optimize(prices, base_load, fuse_kw, model, start_kwh, ev=None, heat_pump=None, export_prices=None,
+                slot_hours=0.25, step_kwh=0.5, max_iterations=20):
+    """AssetPlan for the slots: battery, EV and heat pump kWh per slot within fuse_kw.
+
+    base_load is the other house load minus PV in kWh per slot. shortfall is the EV
+    and heat pump energy that doesn't fit under the fuse.
+    """
+    slots = len(prices)
+    export_prices = list(export_prices) if export_prices is not None else list(prices)
+    cap = fuse_kw * slot_hours
+    zeros = [0.0] * slots
+    step = (max(prices) - min(prices) + 1.0) if prices else 1.0
+    fuse_price = [0.0] * slots
+    room = [max(0.0, cap - load) for load in base_load]
+    best = None
+
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        effective = [price + extra for price, extra in zip(prices, fuse_price)]
+        # The heat pump goes first, its demand can only move a few hours while the EV has until departure
+        hp_energy, hp_short = schedule_heat_pump(heat_pump, effective, room, slot_hours) if heat_pump else (zeros, 0.0)
+        left = [max(0.0, r - h) for r, h in zip(room, hp_energy)]
+        ev_energy, ev_short = schedule_ev(ev, effective, left, slot_hours) if ev else (zeros, 0.0)
+        left = [max(0.0, r - e) for r, e in zip(left, ev_energy)]
+        net_load = [load + e + h for load, e, h in zip(base_load, ev_energy, hp_energy)]
+
+        # The plan that fits: the battery charges only in the room the loads leave
+        battery = battery_dp(prices, export_prices, net_load, model, start_kwh, step_kwh, slot_hours, left)
+        cost, grid = plan_cost(battery, ev_energy, hp_energy, base_load, prices, export_prices, model)
+        shortfall = {"ev": ev_short, "heat_pump": hp_short}
+        if best is None or (ev_short + hp_short, cost) < (sum(best.shortfall.values()), best.cost):
+            best = AssetPlan(battery, ev_energy, hp_energy, grid, cost, shortfall, iterations)
+
+        # The import the assets want at the current fuse prices, the fuse price follows the excess
+        wanted = battery_dp(effective, export_prices, net_load, model, start_kwh, step_kwh, slot_hours)
+        over = [g - cap for g in grid_energy(wanted, ev_energy, hp_energy, base_load, model.efficiency)]
+        if max(over, default=0.0) <= 1e-6:
+            break
+        rate = step / cap / iterations ** 0.5
+        fuse_price = [max(0.0, extra + rate * excess) for extra, excess in zip(fuse_price, over)]
+
+    return best._replace(iterations=iterations)
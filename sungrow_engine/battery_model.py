@@ -0,0 +1,80 @@
+"""Battery model and slot cost shared by the planners and the what-if evaluation.
+
+Energies are kWh per slot, prices per kWh (öre). A plan is a list of battery energy
+per slot: positive charges the battery from the grid side, negative discharges it.
+"""
+
+
+class BatteryModel:
+    """Capacity, SOC window, power limits and losses of the battery."""
+
+    def __init__(self, capacity_kwh=16.0, min_soc=5, max_soc=98, charge_kw=6.2, discharge_kw=7.0,
+                 efficiency=0.9, cycle_cost=10.0):
+        self.capacity_kwh = capacity_kwh
+        self.min_soc = min_soc
+        self.max_soc = max_soc
+        self.charge_kw = charge_kw
+        self.discharge_kw = discharge_kw
+        self.efficiency = efficiency  # Round trip, applied on discharge
+        self.cycle_cost = cycle_cost  # Wear per discharged kWh
+
+    @classmethod
+    def from_args(cls, args):
+        """Build from app args, unknown keys are ignored."""
+        keys = ("capacity_kwh", "min_soc", "max_soc", "charge_kw", "discharge_kw", "efficiency", "cycle_cost")
+        return cls(**{key: float(args[key]) for key in keys if key in args})
+
+    @property
+    def min_kwh(self):
+        return self.capacity_kwh * self.min_soc / 100
+
+    @property
+    def max_kwh(self):
+        return self.capacity_kwh * self.max_soc / 100
+
+    def soc_kwh(self, soc_percent):
+        return self.capacity_kwh * soc_percent / 100
+
+
+def grid_cost(grid_kwh, price, export_price):
+    """Cost of a grid exchange, import is positive."""
+    return grid_kwh * price if grid_kwh > 0 else grid_kwh * export_price
+
+
+def slot_cost(energy, price, export_price, net_load, model):
+    """Extra cost of a battery energy in a slot compared with no battery.
+
+    net_load is house load minus PV for the slot; discharged energy first covers it
+    and the rest is exported.
+    """
+    delivered = energy if energy >= 0 else energy * model.efficiency
+    cost = grid_cost(net_load + delivered, price, export_price) - grid_cost(net_load, price, export_price)
+    if energy < 0:
+        cost -= energy * model.cycle_cost
+    return cost
+
+
+def simulate(plan, prices, model, start_kwh, export_prices=None, net_load=None, slot_hours=1.0):
+    """Run a plan, clipped to the power and SOC limits.
+
+    Returns (total cost, SOC trajectory in kWh with one entry per slot boundary,
+    the energy actually used per slot).
+    """
+    kwh = start_kwh
+    total = 0.0
+    trajectory = [kwh]
+    used = []
+    for i, (energy, price) in enumerate(zip(plan, prices)):
+        if price is None:
+            energy = 0.0
+        elif energy > 0:
+            energy = min(energy, model.charge_kw * slot_hours, max(0.0, model.max_kwh - kwh))
+        else:
+            energy = max(energy, -model.discharge_kw * slot_hours, -max(0.0, kwh - model.min_kwh))
+        if energy:
+            export_price = export_prices[i] if export_prices else price
+            total += slot_cost(energy, price, export_price, net_load[i] if net_load else 0.0, model)
+        kwh += energy
+        trajectory.append(kwh)
+        used.append(energy)
+    return total, trajectory, used
@@ -0,0 +1,70 @@
+"""Intra-hour power control toward per-slot energy targets.
+
+A charging range planned at one power for whole hours is split into per-slot energy
+targets, cheapest slots first (quarter-hour prices make 02:45 cheaper than 02:00).
+A closed loop then sets the power needed to reach the cumulative target by the end of
+the current slot from the energy actually measured, with a deadband and rate limit
+so the inverter only gets a write when it matters.
+"""
+
+
+def slot_targets(slots, planned_kw, max_kw):
+    """Energy kWh per slot for a contiguous range: the planned energy, cheapest slots first.
+
+    The range gets planned_kw for its whole duration; each slot takes at most max_kw,
+    slots without price share what is left evenly.
+    """
+    hours = [(slot.end - slot.start).total_seconds() / 3600 for slot in slots]
+    energy = planned_kw * sum(hours)
+    targets = [0.0] * len(slots)
+    order = sorted(range(len(slots)), key=lambda i: (slots[i].value is None, slots[i].value or 0.0))
+    for i in order:
+        targets[i] = min(energy, max_kw * hours[i])
+        energy -= targets[i]
+    return targets
+
+
+def cumulative_targets(slots, targets):
+    """{slot start: (range start, cumulative target kWh at the slot end)} for a range."""
+    total = 0.0
+    result = {}
+    for slot, target in zip(slots, targets):
+        total += target
+        result[slot.start] = (slots[0].start, total)
+    return result
+
+
+class PowerController:
+    """Setpoint W from the energy still missing in a slot, with deadband and rate limit."""
+
+    def __init__(self, max_power, min_power=0.0, deadband=200.0, max_step=2000.0, min_interval=60.0):
+        self.max_power = max_power
+        self.min_power = min_power
+        self.deadband = deadband  # Smaller changes than this are not written
+        self.max_step = max_step  # Largest change in one write
+        self.min_interval = min_interval  # Seconds between writes
+        self.reset()
+
+    def reset(self):
+        self.setpoint = None
+        self.last_write = None
+
+    def required_power(self, missing_kwh, seconds_left):
+        if seconds_left <= 0:
+            return self.max_power if missing_kwh > 0 else self.min_power
+        power = missing_kwh * 3600 * 1000 / seconds_left
+        return min(self.max_power, max(self.min_power, power))
+
+    def update(self, missing_kwh, seconds_left, now):
+        """The new setpoint to write, None when the current one is close enough or was just written."""
+        power = self.required_power(missing_kwh, seconds_left)
+        if self.setpoint is not None:
+            if abs(power - self.setpoint) < self.deadband:
+                return None
+            if self.last_write is not None and now - self.last_write < self.min_interval:
+                return None
+            step = max(-self.max_step, min(self.max_step, power - self.setpoint))
+            power = self.setpoint + step
+        self.setpoint = round(power)
+        self.last_write = now
+        return self.setpoint
@@ -0,0 +1,56 @@
+"""Per slot explanation of a charging or discharging plan.
+
+The planning apps fill one entry per price slot from the numbers they selected with,
+so the explanation costs nothing extra and always matches the plan. An entry is
+
+    {"start": iso time, "price": öre/kWh, "action": "charge", "energy_kwh": 3.8,
+     "value": öre/kWh, "constraint": "power_limit"}
+
+`value` is the marginal value of one kWh moved in the slot: the day price it replaces
+minus the slot price for charging, the price over the cost of the stored energy for
+discharging. `constraint` is what decided the slot, one of CONSTRAINTS.
+"""
+
+CONSTRAINTS = {
+    "window": "outside the hours the rules look at",
+    "spread_threshold": "price difference below the rules' spread",
+    "cheaper_slots": "enough cheaper slots were selected",
+    "max_slots": "the rules' maximum number of slots was reached",
+    "charge_power": "charging at the power the rules set for the number of slots",
+    "power_limit": "limited by the inverter power or the temperature envelope",
+    "soc_bound": "limited by the energy between the min and max SOC",
+    "export_price": "export price below the cost of the stored energy, discharging to the house",
+    "carry_over": "energy held past midnight for a more expensive slot before the next charge",
+}
+
+
+def _round(value, digits=2):
+    return None if value is None else round(value, digits)
+
+
+def slot_entry(slot, action="idle", energy_kwh=0.0, value=None, constraint=None):
+    """Explanation entry for a PriceSlot."""
+    return {
+        "start": slot.start.isoformat(),
+        "price": _round(slot.value),
+        "action": action,
+        "energy_kwh": _round(energy_kwh) or 0.0,
+        "value": _round(value),
+        "constraint": constraint,
+    }
+
+
+def summary(entries):
+    """Totals of an explanation: energy per action, their cost and the constraints that decided."""
+    energy = {}
+    cost = 0.0
+    constraints = {}
+    for entry in entries:
+        if entry["action"] != "idle":
+            energy[entry["action"]] = round(energy.get(entry["action"], 0.0) + entry["energy_kwh"], 2)
+            if entry["price"] is not None:
+                sign = 1 if entry["action"] == "charge" else -1
+                cost += sign * entry["price"] * entry["energy_kwh"]
+        if entry["constraint"]:
+            constraints[entry["constraint"]] = constraints.get(entry["constraint"], 0) + 1
+    return {"energy_kwh": energy, "cost": round(cost, 1), "constraints": constraints}
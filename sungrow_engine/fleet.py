@@ -0,0 +1,133 @@
+"""Batch planning of many battery sites without Home Assistant.
+
+The night charging and day discharging selection only depends on the prices, so it
+runs once per price area and day; every site in the area then gets that selection
+scaled to its own SOC, capacity and power limits, a short loop over a handful of
+slots. Large batches can be sharded per area over a process pool:
+
+    plans = plan_fleet(sites, {"SE3": slots}, processes=4)
+"""
+
+import concurrent.futures
+from collections import namedtuple
+
+from sungrow_engine.rules import night_charge
+from sungrow_engine.selection import select_discharging_hours
+from sungrow_engine.whatif import RULE_DEFAULTS, night_rules, slot_hours
+
+Site = namedtuple(
+    "Site", "site_id area soc capacity_kwh charge_kw discharge_kw min_soc max_soc",
+    defaults=(16.0, 6.2, 7.0, 5.0, 98.0),
+)
+
+# Selection of an area: (slot index, start iso, hours) for the charge slots in time
+# order and the discharge slots most expensive first
+AreaPlan = namedtuple("AreaPlan", "area charge_slots charge_price charge_power_kw discharge_slots")
+
+SitePlan = namedtuple("SitePlan", "site_id area charge discharge charged_kwh discharged_kwh end_soc")
+
+
+def area_plan(area, slots, params=None, charge_price=None, night_spec=None):
+    """The rule selection for one day of PriceSlots of an area.
+
+    Follows SmartNightCharging (with its `rules:`, night_spec) and SmartDayDischarging
+    like whatif.rule_plan; `charge_price` is the cost to beat when the day has no charging.
+    """
+    night = night_rules(params, night_spec)
+    params = dict(RULE_DEFAULTS, **(params or {}))
+
+    hours, selected_mean, _ = night_charge(night, slots)
+    charge_slots = tuple((i, slots[i].start.isoformat(), slot_hours(slots[i])) for i in hours)
+    if selected_mean is not None:
+        charge_price = selected_mean
+
+    discharge_slots = ()
+    if charge_price is not None:
+        hour_prices = [
+            (i, slot.value) for i, slot in enumerate(slots)
+            if int(params["day_start_hour"]) <= slot.start.hour <= int(params["day_end_hour"])
+        ]
+        selected = select_discharging_hours(hour_prices, charge_price, float(params["discharge_offset"]),
+                                            int(params["max_discharge_hours"]))
+        discharge_slots = tuple((i, slots[i].start.isoformat(), slot_hours(slots[i])) for i, _ in selected)
+    return AreaPlan(area, charge_slots, charge_price, night.power(len(hours)) / 1000, discharge_slots)
+
+
+def site_plan(site, area):
+    """Energy per slot for one site: charge up to its max SOC, then discharge down to its min SOC.
+
+    Charge and discharge are [(slot start iso, kWh)]; discharging takes the most
+    expensive slots first until the battery is empty.
+    """
+    capacity = site.capacity_kwh
+    level = capacity * site.soc / 100
+    room = capacity * site.max_soc / 100 - level
+    charge_kw = min(site.charge_kw, area.charge_power_kw)
+    charge = []
+    for _, start, hours in area.charge_slots:
+        if room <= 0:
+            break
+        energy = min(charge_kw * hours, room)
+        room -= energy
+        level += energy
+        charge.append((start, round(energy, 3)))
+
+    available = level - capacity * site.min_soc / 100
+    discharge = []
+    for _, start, hours in area.discharge_slots:
+        if available <= 0:
+            break
+        energy = min(site.discharge_kw * hours, available)
+        available -= energy
+        level -= energy
+        discharge.append((start, round(energy, 3)))
+
+    charged = sum(energy for _, energy in charge)
+    discharged = sum(energy for _, energy in discharge)
+    return SitePlan(site.site_id, site.area, charge, discharge, round(charged, 3), round(discharged, 3),
+                    round(level / capacity * 100, 1) if capacity else None)
+
+
+def _plan_chunk(area, sites):
+    return [site_plan(site, area) for site in sites]
+
+
+def plan_fleet(sites, area_slots, params=None, charge_prices=None, processes=1, chunk_size=5000, night_spec=None):
+    """SitePlans for all sites, in the order of `sites`.
+
+    area_slots is {area: day of PriceSlots}; each area is selected once with the
+    `rules:` of SmartNightCharging (night_spec). With processes > 1 the sites are
+    planned in chunks on a process pool, the selection travels along with each
+    chunk. Sites of an area without prices are left out.
+    """
+    charge_prices = charge_prices or {}
+    areas = {
+        area: area_plan(area, slots, params, charge_prices.get(area), night_spec)
+        for area, slots in area_slots.items()
+    }
+
+    by_area = {}
+    for position, site in enumerate(sites):
+        if site.area in areas:
+            by_area.setdefault(site.area, []).append(position)
+
+    chunks = [
+        (area, positions[i:i + chunk_size])
+        for area, positions in by_area.items()
+        for i in range(0, len(positions), chunk_size)
+    ]
+    results = [None] * len(sites)
+    if processes > 1 and len(chunks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = [
+                (positions, pool.submit(_plan_chunk, areas[area], [sites[p] for p in positions]))
+                for area, positions in chunks
+            ]
+            for positions, future in futures:
+                for position, plan in zip(positions, future.result()):
+                    results[position] = plan
+    else:
+        for area, positions in chunks:
+            for position in positions:
+                results[position] = site_plan(sites[position], areas[area])
+    return [plan for plan in results if plan is not None]
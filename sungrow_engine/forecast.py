@@ -0,0 +1,95 @@
+"""Incremental P10/P50/P90 price forecast, see nordpool_price_forecast.py."""
+
+import datetime
+from collections import deque
+
+
+class PriceForecastModel:
+    """Seasonal naive price forecast with per hour empirical error quantiles."""
+
+    def __init__(self, history_days=56, residual_window=120):
+        self.history_days = history_days
+        self.history = {}  # "YYYY-MM-DD" -> list of prices
+        self.residuals = [deque(maxlen=residual_window) for _ in range(24)]
+        self._sorted_residuals = None
+
+    @staticmethod
+    def hour_of_slot(slot, slots):
+        return min(23, slot * 24 // slots)
+
+    @staticmethod
+    def hourly(prices):
+        """Average any resolution (23/24/25 hours or quarters) into 24 hourly values."""
+        hours = [[] for _ in range(24)]
+        for slot, price in enumerate(prices):
+            if price is not None:
+                hours[PriceForecastModel.hour_of_slot(slot, len(prices))].append(price)
+        values = [sum(h) / len(h) if h else None for h in hours]
+        known = [v for v in values if v is not None]
+        fallback = sum(known) / len(known) if known else 0.0
+        return [fallback if v is None else v for v in values]
+
+    def base(self, date, depth=0):
+        """Seasonal naive forecast for a date from yesterday and the same weekday last week."""
+        yesterday = self.history.get((date - datetime.timedelta(days=1)).isoformat())
+        if yesterday is None:
+            if depth >= 2 or not self.history:
+                return None
+            yesterday = self.base(date - datetime.timedelta(days=1), depth + 1)
+            if yesterday is None:
+                return None
+        else:
+            yesterday = self.hourly(yesterday)
+
+        last_week = self.history.get((date - datetime.timedelta(days=7)).isoformat())
+        if last_week is None:
+            return yesterday
+        last_week = self.hourly(last_week)
+        return [0.6 * y + 0.4 * w for y, w in zip(yesterday, last_week)]
+
+    def update(self, date, prices):
+        """Learn from a published day. Returns False if the day was already known."""
+        key = date.isoformat()
+        if key in self.history or not any(price is not None for price in prices):
+            return False
+
+        base = self.base(date)
+        if base is not None:
+            for hour, actual in enumerate(self.hourly(prices)):
+                self.residuals[hour].append(actual - base[hour])
+            self._sorted_residuals = None
+
+        self.history[key] = list(prices)
+        for old in sorted(self.history)[:-self.history_days]:
+            del self.history[old]
+        return True
+
+    def predict(self, date, slots=24):
+        """P10/P50/P90 price curves for a date with the given number of slots."""
+        base = self.base(date)
+        if base is None:
+            return None
+        if self._sorted_residuals is None:
+            self._sorted_residuals = [sorted(r) for r in self.residuals]
+
+        curves = {"p10": [], "p50": [], "p90": []}
+        for slot in range(slots):
+            hour = self.hour_of_slot(slot, slots)
+            price = base[hour]
+            errors = self._sorted_residuals[hour]
+            for name, q in (("p10", 0.1), ("p50", 0.5), ("p90", 0.9)):
+                if errors:
+                    value = price + errors[min(len(errors) - 1, int(q * len(errors)))]
+                else:
+                    value = price * {"p10": 0.8, "p50": 1.0, "p90": 1.2}[name]
+                curves[name].append(round(value, 2))
+        return curves
+
+    def to_json(self):
+        return {"history": self.history, "residuals": [list(r) for r in self.residuals]}
+
+    def load_json(self, data):
+        self.history = dict(data.get("history", {}))
+        for hour, values in enumerate(data.get("residuals", [])[:24]):
+            self.residuals[hour].extend(values)
+        self._sorted_residuals = None
@@ -0,0 +1,95 @@
+"""Rolling price timeline across midnight.
+
+Today's and tomorrow's Nordpool slots and the forecast for the first unpublished day
+in one contiguous slot array, so a plan can hold energy from this evening for
+tomorrow morning without any code knowing where midnight is. Before publication the
+timeline runs to the end of tomorrow's forecast (48 h from today's midnight); after
+publication the forecast of the day after tomorrow extends it up to `max_hours` from
+now (60 h by default).
+"""
+
+import bisect
+import datetime
+
+from sungrow_engine.prices import get_price_index, slots_from_list
+
+
+def forecast_day(values, date, tzinfo):
+    """Slots of a forecast day on its real local clock, and the index of each slot's value.
+
+    The forecast has a value per hour (or quarter hour) of the day. The slots are built
+    like a published day with slots_from_list, so a 23 hour DST day skips the missing
+    hour and a 25 hour day has the repeated hour twice.
+    """
+    per_hour = max(1, len(values) // 24)
+    midnight = datetime.datetime.combine(date, datetime.time(0)).replace(tzinfo=tzinfo)
+    next_midnight = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time(0)).replace(tzinfo=tzinfo)
+    hours = round((next_midnight.astimezone(datetime.timezone.utc) - midnight.astimezone(datetime.timezone.utc)).total_seconds() / 3600)
+    slots = slots_from_list([0.0] * (hours * per_hour), date, tzinfo)
+    indices = [min(len(values) - 1, slot.start.hour * per_hour + slot.start.minute * per_hour // 60) for slot in slots]
+    return [slot._replace(value=values[i]) for slot, i in zip(slots, indices)], indices
+
+
+class Timeline:
+    """Contiguous price slots, the forecast ones from position `forecast_from`.
+
+    p10 and p90 equal the prices for published slots and the forecast bands after.
+    """
+
+    def __init__(self, slots, forecast_from=None, p10=None, p90=None):
+        self.slots = slots
+        self.starts = [slot.start for slot in slots]
+        self.forecast_from = len(slots) if forecast_from is None else forecast_from
+        values = self.values()
+        self.p10 = list(p10) if p10 is not None else values
+        self.p90 = list(p90) if p90 is not None else values
+
+    def __len__(self):
+        return len(self.slots)
+
+    def values(self):
+        return [slot.value for slot in self.slots]
+
+    def position(self, when):
+        """Index of the slot containing `when` (aware datetime), None outside the timeline."""
+        i = bisect.bisect_right(self.starts, when) - 1
+        if i < 0 or when >= self.slots[i].end:
+            return None
+        return i
+
+    def forecast(self, position):
+        """True if the price at position is a forecast."""
+        return position >= self.forecast_from
+
+
+def build_timeline(prices, now, forecast=None, max_hours=60):
+    """Timeline from the start of today for a PriceIndex and the forecast sensor attributes.
+
+    The forecast (date, p10, p50, p90) is appended when it is for the day after the
+    last published slot, on that day's real local clock in the time zone of `now`
+    (see forecast_day). Slots starting max_hours or more after `now` are left out.
+    """
+    slots = list(prices.slots)
+    forecast_from = len(slots)
+    p10 = [slot.value for slot in slots]
+    p90 = list(p10)
+
+    forecast = forecast or {}
+    if slots and forecast.get("p50"):
+        next_day = (slots[-1].end - datetime.timedelta(seconds=1)).date() + datetime.timedelta(days=1)
+        if forecast.get("date") == next_day.isoformat():
+            extra, indices = forecast_day(forecast["p50"], next_day, now.tzinfo)
+            slots.extend(extra)
+            for band, values in ((p10, forecast.get("p10")), (p90, forecast.get("p90"))):
+                band.extend([values[i] for i in indices] if values else [slot.value for slot in extra])
+
+    end = now + datetime.timedelta(hours=max_hours)
+    count = bisect.bisect_left([slot.start for slot in slots], end)
+    return Timeline(slots[:count], min(forecast_from, count), p10[:count], p90[:count])
+
+
+def get_timeline(app, sensor, forecast_sensor="sensor.nordpool_price_forecast", max_hours=60):
+    """Timeline for a Nordpool sensor and the price forecast, read through an AppDaemon app."""
+    prices = get_price_index(app, sensor)
+    forecast = (app.get_state(forecast_sensor, attribute="all") or {}).get("attributes") if forecast_sensor else None
+    return build_timeline(prices, app.datetime(aware=True), forecast, max_hours)
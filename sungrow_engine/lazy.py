@@ -0,0 +1,44 @@
+"""Lazy imports for heavy optional dependencies (NumPy, solvers)."""
+
+import importlib
+
+
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    """Return a proxy for module `name`, imported the first time it is used."""
+    return _LazyModule(name)
+
+
+_optional = {}
+
+
+def optional_import(name):
+    """Import an optional module on first use, None if it is not installed.
+
+    The result is remembered so a missing module costs one failed import per process.
+    """
+    if name not in _optional:
+        try:
+            _optional[name] = importlib.import_module(name)
+        except ImportError:
+            _optional[name] = None
+    return _optional[name]
@@ -0,0 +1,51 @@
+"""Monthly top N hourly peaks for power (effekt) tariffs, see peak_shaving.py."""
+
+import heapq
+
+
+class MonthlyPeaks:
+    """Keeps the top N hourly peaks (kWh) of the month in a min-heap, optionally max one peak per day."""
+
+    def __init__(self, top_n=3, one_per_day=True):
+        self.top_n = top_n
+        self.one_per_day = one_per_day
+        self.month = None
+        self.heap = []  # (kwh, "YYYY-MM-DDTHH") with the smallest of the top peaks first
+
+    def reset(self, month):
+        self.month = month
+        self.heap = []
+
+    def threshold(self):
+        """Energy an hour has to exceed to enter the top N, None while the heap is not yet full."""
+        if len(self.heap) < self.top_n:
+            return None
+        return self.heap[0][0]
+
+    def add(self, kwh, hour_key):
+        """Add a finished hour. Returns True if it became one of the top peaks."""
+        if self.one_per_day:
+            day = hour_key[:10]
+            for i, (peak_kwh, peak_key) in enumerate(self.heap):
+                if peak_key[:10] == day:
+                    if kwh <= peak_kwh:
+                        return False
+                    self.heap[i] = (kwh, hour_key)
+                    heapq.heapify(self.heap)
+                    return True
+
+        if len(self.heap) < self.top_n:
+            heapq.heappush(self.heap, (kwh, hour_key))
+            return True
+        if kwh > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (kwh, hour_key))
+            return True
+        return False
+
+    def mean(self):
+        if not self.heap:
+            return 0.0
+        return sum(kwh for kwh, _ in self.heap) / len(self.heap)
+
+    def as_list(self):
+        return [[round(kwh, 3), key] for kwh, key in sorted(self.heap, reverse=True)]
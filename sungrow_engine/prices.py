@@ -0,0 +1,141 @@
+"""Timestamp keyed Nordpool prices parsed once from raw_today/raw_tomorrow."""
+
+import bisect
+import datetime
+from collections import namedtuple
+
+from sungrow_engine.quality import OK, check_prices, unit_factor
+
+PriceSlot = namedtuple("PriceSlot", "start end value")
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+
+def parse_raw(raw):
+    """Parse raw_today/raw_tomorrow entries into sorted PriceSlots with aware start/end."""
+    slots = []
+    for entry in raw or []:
+        start = _as_datetime(entry["start"])
+        end = _as_datetime(entry["end"]) if entry.get("end") else None
+        value = entry.get("value")
+        slots.append(PriceSlot(start, end, None if value is None else float(value)))
+    slots.sort(key=lambda slot: slot.start)
+
+    # Entries without end run until the next start
+    for i, slot in enumerate(slots):
+        if slot.end is None:
+            end = slots[i + 1].start if i + 1 < len(slots) else slot.start + (slot.start - slots[i - 1].start if i else datetime.timedelta(hours=1))
+            slots[i] = slot._replace(end=end)
+    return slots
+
+
+def slots_from_list(prices, date, tzinfo):
+    """Build slots from a plain today/tomorrow list, spreading them over the real (DST) day length."""
+    if not prices:
+        return []
+    midnight = datetime.datetime.combine(date, datetime.time(0)).replace(tzinfo=tzinfo)
+    next_midnight = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time(0)).replace(tzinfo=tzinfo)
+    start_utc = midnight.astimezone(datetime.timezone.utc)
+    step = (next_midnight.astimezone(datetime.timezone.utc) - start_utc) / len(prices)
+    return [
+        PriceSlot(
+            (start_utc + i * step).astimezone(tzinfo),
+            (start_utc + (i + 1) * step).astimezone(tzinfo),
+            None if price is None else float(price),
+        )
+        for i, price in enumerate(prices)
+    ]
+
+
+class PriceIndex:
+    """Today and tomorrow as one contiguous, timestamp ordered slot array.
+
+    today_quality and tomorrow_quality are the data quality checks of the two days.
+    """
+
+    def __init__(self, today, tomorrow, today_quality=OK, tomorrow_quality=OK):
+        self.today = today
+        self.tomorrow = tomorrow
+        self.today_quality = today_quality
+        self.tomorrow_quality = tomorrow_quality
+        self.slots = today + tomorrow
+        self.starts = [slot.start for slot in self.slots]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def today_values(self):
+        return [slot.value for slot in self.today]
+
+    def tomorrow_values(self):
+        return [slot.value for slot in self.tomorrow]
+
+    def position(self, when):
+        """Index of the slot containing `when` (aware datetime), None outside the index."""
+        i = bisect.bisect_right(self.starts, when) - 1
+        if i < 0 or when >= self.slots[i].end:
+            return None
+        return i
+
+    def slot_at(self, when):
+        i = self.position(when)
+        return None if i is None else self.slots[i]
+
+    def price_at(self, when):
+        slot = self.slot_at(when)
+        return None if slot is None else slot.value
+
+
+_cache = {}  # sensor -> (raw_today, raw_tomorrow, date, PriceIndex)
+
+
+def price_index(attributes, tzinfo=None, date=None, sensor=None):
+    """PriceIndex for the attributes of a Nordpool sensor, cached on the attribute objects.
+
+    Repeated reads of the same attributes return the cached index without parsing. If
+    the sensor has no raw_* attributes the plain lists are used with `date` and `tzinfo`.
+    A new publication goes through the data quality checks once, when it is parsed.
+    """
+    attributes = attributes or {}
+    raw_today = attributes.get("raw_today")
+    raw_tomorrow = attributes.get("raw_tomorrow")
+    if raw_today is None:
+        raw_today, raw_tomorrow = attributes.get("today") or [], attributes.get("tomorrow") or []
+
+    cached = _cache.get(sensor)
+    if cached is not None:
+        cached_today, cached_tomorrow, cached_date, index = cached
+        if cached_date == date:
+            if cached_today is raw_today and cached_tomorrow is raw_tomorrow:
+                return index
+            if cached_today == raw_today and cached_tomorrow == raw_tomorrow:
+                _cache[sensor] = (raw_today, raw_tomorrow, date, index)
+                return index
+
+    if "raw_today" in attributes:
+        today, tomorrow = parse_raw(raw_today), parse_raw(raw_tomorrow)
+    else:
+        tzinfo = tzinfo or datetime.timezone.utc
+        day = date or datetime.datetime.now(tzinfo).date()
+        today = slots_from_list(raw_today, day, tzinfo)
+        tomorrow = slots_from_list(raw_tomorrow, day + datetime.timedelta(days=1), tzinfo)
+
+    factor = unit_factor(attributes)
+    published_today = [slot.value for slot in today]
+    today, today_quality = check_prices(today, date, factor=factor)
+    tomorrow, tomorrow_quality = check_prices(
+        tomorrow, date + datetime.timedelta(days=1) if date else None, published_today, factor)
+    index = PriceIndex(today, tomorrow, today_quality, tomorrow_quality)
+    _cache[sensor] = (raw_today, raw_tomorrow, date, index)
+    return index
+
+
+def get_price_index(app, sensor):
+    """PriceIndex for a Nordpool sensor read through an AppDaemon app."""
+    attributes = app.get_state(sensor, attribute="all") or {}
+    now = app.datetime(aware=True)
+    return price_index(attributes.get("attributes"), now.tzinfo, now.date(), sensor)
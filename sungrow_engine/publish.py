@@ -0,0 +1,105 @@
+"""Minimal write publishing of the output sensors.
+
+Every set_state is a recorder row and a websocket message to each open dashboard,
+also when nothing changed. A Publisher compares the new state and attributes with
+what Home Assistant already has and only writes real changes. Long lists and strings
+are summarized before they reach the recorder, and an entity can be given a minimum
+time between writes; a change inside it is held back and the latest one written when
+the time is up.
+"""
+
+import json
+import math
+
+MAX_ITEMS = 48  # Longer lists and dicts are summarized, a day of quarter hour prices is 96
+MAX_STRING = 255  # Home Assistant's limit for a state
+
+
+def trim(value, max_items=MAX_ITEMS):
+    """A JSON value small enough for the recorder: long lists become count/min/max/mean."""
+    if isinstance(value, float):
+        return round(value, 4) if math.isfinite(value) else None
+    if isinstance(value, str):
+        return value if len(value) <= MAX_STRING else value[:MAX_STRING - 3] + "..."
+    if isinstance(value, dict):
+        if len(value) > max_items:
+            return {"count": len(value)}
+        return {str(key): trim(item, max_items) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) <= max_items:
+            return [trim(item, max_items) for item in value]
+        numbers = [item for item in value if isinstance(item, (int, float)) and not isinstance(item, bool)]
+        summary = {"count": len(value)}
+        if numbers:
+            summary.update(min=trim(min(numbers)), max=trim(max(numbers)), mean=trim(sum(numbers) / len(numbers)))
+        return summary
+    if value is None or isinstance(value, (bool, int)):
+        return value
+    return str(value)
+
+
+def _state_string(state):
+    """The state as Home Assistant stores it."""
+    if isinstance(state, float):
+        state = trim(state)
+    return "unknown" if state is None else str(state)[:MAX_STRING]
+
+
+class Publisher:
+    """Writes the output sensors of an app, skipping writes that change nothing."""
+
+    def __init__(self, app, min_interval=0.0, intervals=None, max_items=MAX_ITEMS):
+        self.app = app
+        self.min_interval = min_interval  # Seconds between writes of an entity
+        self.intervals = dict(intervals or {})  # Per entity overrides of min_interval
+        self.max_items = max_items
+        self.last_write = {}  # entity -> unix time
+        self.pending = {}  # entity -> (state, attributes) held back by the rate limit
+        self.timers = {}  # entity -> handle of the pending write
+        self.writes = 0
+        self.skipped = 0
+
+    def unchanged(self, entity_id, state, attributes):
+        current = self.app.get_state(entity_id, attribute="all")
+        if not current:
+            return False
+        return str(current.get("state")) == state and (current.get("attributes") or {}) == attributes
+
+    def publish(self, entity_id, state, attributes=None):
+        """Set the entity if state or attributes differ from Home Assistant's, returns True if written now."""
+        state = _state_string(state)
+        attributes = json.loads(json.dumps(trim(dict(attributes or {}), self.max_items), default=str))
+        if self.unchanged(entity_id, state, attributes):
+            self.pending.pop(entity_id, None)
+            self.skipped += 1
+            return False
+
+        now = self.app.datetime(aware=True).timestamp()
+        interval = self.intervals.get(entity_id, self.min_interval)
+        last = self.last_write.get(entity_id)
+        if interval and last is not None and now - last < interval:
+            self.pending[entity_id] = (state, attributes)
+            if entity_id not in self.timers:
+                self.timers[entity_id] = self.app.run_in(self.flush, interval - (now - last), entity_id=entity_id)
+            return False
+
+        self.write(entity_id, state, attributes, now)
+        return True
+
+    def write(self, entity_id, state, attributes, now):
+        self.pending.pop(entity_id, None)
+        self.last_write[entity_id] = now
+        self.writes += 1
+        self.app.set_state(entity_id, state=state, attributes=attributes, replace=True)
+
+    def flush(self, kwargs):
+        """Write the change held back for an entity, if it is still a change."""
+        entity_id = kwargs["entity_id"]
+        self.timers.pop(entity_id, None)
+        if entity_id not in self.pending:
+            return
+        state, attributes = self.pending.pop(entity_id)
+        if self.unchanged(entity_id, state, attributes):
+            self.skipped += 1
+            return
+        self.write(entity_id, state, attributes, self.app.datetime(aware=True).timestamp())
@@ -0,0 +1,139 @@
+"""Data quality checks for the price feed and the telemetry.
+
+The price checks run once per Nordpool publication, when price_index parses a new
+one, in a single pass over the day's slots: duplicate slot starts, missing prices
+and holes in the time line, a day that is stale (yesterday's prices, or tomorrow a
+copy of today), outliers and a unit change (SEK instead of öre, MWh instead of kWh,
+read from the sensor's unit attributes). Missing prices are filled from their
+neighbours and prices in another unit are scaled to öre/kWh; outliers are only
+flagged since a price spike is a real price. A day whose problems can't be repaired
+is marked degraded and the planners run their fixed fallback plan for it.
+
+Telemetry samples are checked against the unit and the physical range of the
+entity before they reach the buffers.
+"""
+
+from collections import namedtuple
+
+Quality = namedtuple("Quality", "issues degraded")  # issues: {kind: count}
+
+OK = Quality({}, False)
+
+ISSUES = {
+    "duplicate": "the same slot was published more than once",
+    "gap": "a price or a slot is missing",
+    "stale": "the prices are for another day or repeat the day before",
+    "outlier": "a price far outside the rest of the day",
+    "unit": "the sensor publishes in another unit than öre/kWh, the prices were scaled",
+}
+
+MAX_GAP_SHARE = 0.25  # More missing prices than this can't be filled with any trust
+OUTLIER_MADS = 10.0  # Distance from the median in median absolute deviations
+MIN_SPREAD = 10.0  # öre/kWh, the deviation used for a day of nearly equal prices
+
+
+def _median(values):
+    ordered = sorted(values)
+    n = len(ordered)
+    if not n:
+        return None
+    return ordered[n // 2] if n % 2 else (ordered[n // 2 - 1] + ordered[n // 2]) / 2
+
+
+def unit_factor(attributes):
+    """Factor from the Nordpool sensor's unit to öre/kWh, 1.0 for the usual setup."""
+    factor = 1.0
+    if attributes.get("price_in_cents") is False:
+        factor *= 100.0
+    unit = str(attributes.get("unit") or "kWh")
+    if unit.lower() == "mwh":
+        factor /= 1000.0
+    return factor
+
+
+def check_prices(slots, date=None, previous=None, factor=1.0):
+    """(checked slots, Quality) for one day of PriceSlots.
+
+    date is the day the slots should be for, previous the values of the day before
+    (for a repeated publication) and factor the unit_factor of the sensor.
+    """
+    issues = {}
+
+    def flag(kind, count=1):
+        issues[kind] = issues.get(kind, 0) + count
+
+    # Duplicates keep the last entry, the slots are sorted by start already
+    checked = []
+    for slot in slots:
+        if checked and slot.start == checked[-1].start:
+            checked[-1] = slot
+            flag("duplicate")
+        else:
+            checked.append(slot)
+    if not checked:
+        return checked, OK
+
+    values = [slot.value for slot in checked]
+    known = [value for value in values if value is not None]
+    missing = len(values) - len(known)
+    holes = sum(1 for a, b in zip(checked, checked[1:]) if a.end != b.start)
+    if missing or holes:
+        flag("gap", missing + holes)
+
+    stale = date is not None and checked[0].start.date() != date
+    stale = stale or (previous is not None and len(set(known)) > 1 and values == list(previous))
+    if stale:
+        flag("stale")
+
+    if factor != 1.0:
+        flag("unit")
+    median = _median(known)
+
+    # Fill the missing prices from the neighbours, scale and flag outliers in the same pass
+    if known:
+        spread = max(_median([abs(value - median) for value in known]) * abs(factor), MIN_SPREAD)
+        median *= factor
+        for i, value in enumerate(values):
+            if value is None:
+                before = next((v for v in reversed(values[:i]) if v is not None), None)
+                after = next((v for v in values[i + 1:] if v is not None), None)
+                value = before if after is None else after if before is None else (before + after) / 2
+                values[i] = value
+                checked[i] = checked[i]._replace(value=value * factor)
+            elif factor != 1.0:
+                checked[i] = checked[i]._replace(value=value * factor)
+            if abs(checked[i].value - median) > OUTLIER_MADS * spread:
+                flag("outlier")
+
+    degraded = stale or len(known) < 2 or missing + holes > MAX_GAP_SHARE * len(checked)
+    return checked, Quality(issues, degraded)
+
+
+def describe(quality):
+    """Readable list of the issues of a Quality."""
+    return [f"{count} x {ISSUES[kind]}" if count > 1 else ISSUES[kind] for kind, count in quality.issues.items()]
+
+
+# Telemetry units -> factor to the unit the apps use, and entity name part -> valid range
+SCALES = {"kW": 1000.0, "MW": 1e6, "mV": 0.001, "mA": 0.001}
+RANGES = (
+    ("battery_level", (0.0, 100.0)),
+    ("temperature", (-40.0, 120.0)),
+    ("voltage", (0.0, 1000.0)),
+    ("current", (-500.0, 500.0)),
+    ("power", (-100000.0, 100000.0)),
+)
+
+
+def check_sample(entity, value, unit=None):
+    """Value of a telemetry sample in the entity's base unit, None if it can't be right."""
+    if value != value:  # NaN
+        return None
+    if unit == "°F":
+        value = (value - 32) / 1.8
+    else:
+        value *= SCALES.get(unit, 1.0)
+    for part, (low, high) in RANGES:
+        if part in entity:
+            return value if low <= value <= high else None
+    return value
@@ -0,0 +1,36 @@
+"""Selected price slots as ranges of back to back slots, for the timers and the sensor text.
+
+Positions index the slots, a list of PriceSlots or a dict like the day discharging's
+hour -> slot. Two positions are in one range when the first slot ends where the
+second starts, so a range runs from the real start of its first slot to the real end
+of its last one: 23:00 is followed by midnight, a quarter hour by the next quarter
+hour and a DST day keeps its real clock, without any hour arithmetic. Times are
+compared in UTC, local times in the repeated autumn hour compare by the wall clock.
+"""
+
+import datetime
+
+
+def _utc(moment):
+    return moment.astimezone(datetime.timezone.utc)
+
+
+def group_ranges(slots, positions):
+    """Positions in runs of back to back slots, in time order, a position selected twice counts once."""
+    ranges = []
+    for position in sorted(set(positions), key=lambda position: _utc(slots[position].start)):
+        if ranges and _utc(slots[ranges[-1][-1]].end) == _utc(slots[position].start):
+            ranges[-1].append(position)
+        else:
+            ranges.append([position])
+    return ranges
+
+
+def range_times(slots, positions):
+    """(start, end) of every range of the positions."""
+    return [(slots[run[0]].start, slots[run[-1]].end) for run in group_ranges(slots, positions)]
+
+
+def format_ranges(slots, positions, separator=", "):
+    """Local clock ranges like "02:00-05:00, 23:00-00:00"."""
+    return separator.join(f"{start:%H:%M}-{end:%H:%M}" for start, end in range_times(slots, positions))
@@ -0,0 +1,227 @@
+"""Declarative price rules from apps.yaml, validated and compiled once per app.
+
+An app reads its `rules:` section with compile_rules(self.args.get("rules"), DEFAULTS).
+The section is merged over the app's defaults, checked against RULE_SCHEMA, and
+turned into small closures, so the callbacks only call functions and never look at
+the dict again. AppDaemon restarts only the apps whose apps.yaml section changed,
+so a new threshold applies to that app alone. Compiled rules are cached on the
+spec, so restarting with the same rules does not compile them again.
+
+    rules:
+      window: {first_slot: 0, slots: 7}      # or {start_hour: 6, end_hour: 22}, not across midnight
+      select: {order: cheapest, base: 3, options: [[5, 10], [4, 5]]}   # k of n, hours within tolerance
+      spread: {min: 40, expensive_slots: 7}
+      power: {3: 6200, 4: 4700, 5: 3800, default: 4000}
+      limits: {max_battery_level: 90}        # only the limits the app has in its defaults
+"""
+
+from collections import namedtuple
+
+from sungrow_engine.selection import choose_cheapest, mean, most_expensive, most_expensive_mean
+from sungrow_engine.store import shared
+
+Rules = namedtuple("Rules", "window select spread_min expensive_slots power limits")
+
+# SmartNightCharging's defaults, also the night charge the other apps and tools expect
+NIGHT_CHARGING_RULES = {
+    "window": {"first_slot": 0, "slots": 7},  # Night slots of tomorrow
+    "select": {"order": "cheapest", "base": 3, "options": [[5, 10], [4, 5]]},  # 5 or 4 hours if nearly as cheap as 3
+    "spread": {"min": 40, "expensive_slots": 7},  # Day vs night price difference needed to charge
+    "power": {3: 6200, 4: 4700, 5: 3800, "default": 4000},  # Selected hours -> max charging power W
+}
+
+
+class RuleError(ValueError):
+    """A rules section in apps.yaml that doesn't match the schema."""
+
+
+_number = (int, float)
+
+# section -> key -> (types, min, max)
+RULE_SCHEMA = {
+    "window": {
+        "first_slot": (int, 0, 100),
+        "slots": (int, 1, 100),
+        "start_hour": (int, 0, 23),
+        "end_hour": (int, 0, 23),
+    },
+    "select": {
+        "order": (str, None, None),
+        "base": (int, 1, 100),
+        "options": (list, None, None),
+        "max": (int, 1, 100),
+    },
+    "spread": {
+        "min": (_number, None, None),
+        "expensive_slots": (int, 1, 100),
+    },
+}
+
+# The keys of `select` that apply to each order
+SELECT_KEYS = {
+    "cheapest": ("order", "base", "options"),
+    "expensive": ("order", "max"),
+}
+
+# limit -> (types, min, max), an app only takes the limits of its defaults
+LIMIT_SCHEMA = {
+    "battery_threshold": (_number, 0, 100),
+    "min_battery_level": (_number, 0, 100),
+    "max_battery_level": (_number, 0, 100),
+    "max_mean_price": (_number, None, None),
+}
+
+
+def _check(path, value, types, low, high):
+    if isinstance(value, bool) or not isinstance(value, types):
+        raise RuleError(f"{path}: expected {getattr(types, '__name__', 'number')}, got {value!r}")
+    if low is not None and value < low or high is not None and value > high:
+        raise RuleError(f"{path}: {value} is outside {low}..{high}")
+
+
+def validate(spec, defaults=None):
+    """Raise RuleError for unknown sections, keys or values out of range.
+
+    With the app's defaults, `power` and `limits` are only taken when the app has
+    them, and only the limits it has.
+    """
+    if not isinstance(spec, dict):
+        raise RuleError(f"rules: expected a mapping, got {spec!r}")
+    for section, values in spec.items():
+        if section not in RULE_SCHEMA and section not in ("power", "limits"):
+            raise RuleError(f"rules.{section}: unknown section")
+        if section in ("power", "limits") and defaults is not None and section not in defaults:
+            raise RuleError(f"rules.{section}: not used by this app")
+        if not isinstance(values, dict):
+            raise RuleError(f"rules.{section}: expected a mapping, got {values!r}")
+        for key, value in values.items():
+            path = f"rules.{section}.{key}"
+            if section == "power":
+                if key != "default":
+                    _check(path, key, int, 1, 100)
+                _check(path, value, _number, 0, 20000)
+            elif section == "limits":
+                if key not in LIMIT_SCHEMA or defaults is not None and key not in defaults["limits"]:
+                    raise RuleError(f"{path}: unknown limit")
+                _check(path, value, *LIMIT_SCHEMA[key])
+            elif key not in RULE_SCHEMA[section]:
+                raise RuleError(f"{path}: unknown key")
+            else:
+                _check(path, value, *RULE_SCHEMA[section][key])
+
+    window = spec.get("window")
+    if window is not None and ("slots" in window) == ("start_hour" in window):
+        raise RuleError("rules.window: use either first_slot/slots or start_hour/end_hour")
+    if window is not None and window.get("start_hour", 0) > window.get("end_hour", 23):
+        raise RuleError(f"rules.window: start_hour {window['start_hour']} is after end_hour {window.get('end_hour', 23)}, "
+                        f"a window can't cross midnight")
+    select = spec.get("select", {})
+    order = select.get("order", "cheapest")
+    if order not in SELECT_KEYS:
+        raise RuleError(f"rules.select.order: expected cheapest or expensive, got {select['order']!r}")
+    for key in select:
+        if key not in SELECT_KEYS[order]:
+            raise RuleError(f"rules.select.{key}: not used with order {order}")
+    for i, option in enumerate(select.get("options", [])):
+        if not isinstance(option, (list, tuple)) or len(option) != 2:
+            raise RuleError(f"rules.select.options[{i}]: expected [hours, tolerance], got {option!r}")
+        _check(f"rules.select.options[{i}][0]", option[0], int, 1, 100)
+        _check(f"rules.select.options[{i}][1]", option[1], _number, None, None)
+
+
+def _merge(defaults, spec):
+    merged = {section: dict(values) for section, values in defaults.items()}
+    for section, values in (spec or {}).items():
+        if section == "window" or not isinstance(values, dict):
+            merged[section] = values  # A window is replaced, the two forms don't mix
+        elif section == "select" and values.get("order", merged.get("select", {}).get("order")) != merged.get("select", {}).get("order"):
+            merged[section] = dict(values)  # So is a selection of the other order, their keys differ
+        else:
+            merged.setdefault(section, {}).update(values)
+    return merged
+
+
+def _compile_window(window):
+    if "slots" in window:
+        first = window.get("first_slot", 0)
+        last = first + window["slots"]
+        return lambda slots: list(range(first, last))  # Positions past the end of slots mean too little data
+    start_hour, end_hour = window["start_hour"], window.get("end_hour", 23)
+    return lambda slots: [i for i, slot in enumerate(slots) if start_hour <= slot.start.hour <= end_hour]
+
+
+def _compile_select(select):
+    if select.get("order", "cheapest") == "expensive":
+        limit = select.get("max")
+        return lambda priced, floor=None: most_expensive(priced, floor, limit)
+    base = select.get("base", 3)
+    tolerances = sorted((tuple(option) for option in select.get("options", [])), reverse=True)
+    return lambda priced, floor=None: choose_cheapest(priced, base, tolerances)
+
+
+def _compile_power(power):
+    table = {int(count): value for count, value in power.items() if count != "default"}
+    default = power.get("default", 4000)
+    return lambda count: table.get(count, default)
+
+
+def _compile(spec):
+    return Rules(
+        window=_compile_window(spec["window"]) if "window" in spec else None,
+        select=_compile_select(spec.get("select", {})),
+        spread_min=spec.get("spread", {}).get("min", 0),
+        expensive_slots=spec.get("spread", {}).get("expensive_slots", 7),
+        power=_compile_power(spec.get("power", {})),
+        limits=dict(spec.get("limits", {})),
+    )
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def compile_rules(spec, defaults):
+    """Rules for an app: its apps.yaml `rules:` merged over the defaults, validated and compiled."""
+    if spec is not None and not isinstance(spec, dict):
+        raise RuleError(f"rules: expected a mapping, got {spec!r}")
+    merged = _merge(defaults, spec)
+    validate(merged, defaults)
+    return shared(("rules", _freeze(merged)), lambda: _compile(merged))
+
+
+def configured_rules(app, name):
+    """The `rules:` section of another app, from the running app or its apps.yaml entry, None without one."""
+    other = app.get_app(name)
+    if other is not None:
+        return other.args.get("rules")
+    return ((getattr(app, "app_config", None) or {}).get(name) or {}).get("rules")
+
+
+def night_charge(rules, slots):
+    """(positions, mean price, spread) the night charging rules choose on a day of PriceSlots.
+
+    Follows SmartNightCharging: the mean of the 3 cheapest night slots must be at least
+    spread_min under the mean of the expensive other slots. positions is [] when the day
+    doesn't charge; spread is None without enough prices.
+    """
+    values = [slot.value for slot in slots]
+    night = rules.window(slots)
+    if not night or max(night) >= len(values):
+        return [], None, None
+    night_prices = [(i, values[i]) for i in night]
+    cheapest = choose_cheapest(night_prices, 3, ())
+    night_set = set(night)
+    expensive_mean = most_expensive_mean([value for i, value in enumerate(values) if i not in night_set], rules.expensive_slots)
+    if not cheapest or expensive_mean is None:
+        return [], None, None
+    spread = expensive_mean - mean(price for _, price in cheapest)
+    if spread < rules.spread_min:
+        return [], None, spread
+    selected = rules.select(night_prices)
+    if not selected:
+        return [], None, spread
+    return sorted(i for i, _ in selected), mean(price for _, price in selected), spread
@@ -0,0 +1,156 @@
+"""Scenario based (stochastic) battery planning.
+
+Price scenarios are drawn from the P10/P50/P90 curves with a common factor so a
+scenario is consistently cheap or expensive, load and PV get their own noise. Every
+scenario is solved with a dynamic program over discrete SOC levels, and the distinct
+plans are then evaluated against all scenarios (sample average approximation); the
+plan with the lowest expected cost wins.
+"""
+
+import random
+import statistics
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sungrow_engine.battery_model import simulate, slot_cost
+
+Scenario = namedtuple("Scenario", "prices export_prices net_load")
+
+_normal = statistics.NormalDist()
+
+
+def quantile_value(p10, p50, p90, u):
+    """Value at probability u of the distribution through the three quantiles, linear between them."""
+    u = min(0.99, max(0.01, u))
+    if u <= 0.5:
+        return p50 + (p50 - p10) * (u - 0.5) / 0.4
+    return p50 + (p90 - p50) * (u - 0.5) / 0.4
+
+
+def sample_scenarios(p10, p50, p90, count, seed=None, correlation=0.7, export_factor=0.8, export_offset=0.0,
+                     load_kwh=None, load_sigma=0.3, pv_kwh=None, pv_sigma=0.4):
+    """Draw `count` scenarios for the horizon. load_kwh and pv_kwh are expected energy per slot."""
+    rng = random.Random(seed)
+    slots = len(p50)
+    load_kwh = load_kwh or [0.0] * slots
+    pv_kwh = pv_kwh or [0.0] * slots
+    idiosyncratic = (1 - correlation ** 2) ** 0.5
+    scenarios = []
+    for _ in range(count):
+        common = rng.gauss(0, 1)
+        cloud = max(0.0, rng.gauss(1, pv_sigma))  # One cloudiness factor per scenario
+        prices = []
+        for lo, mid, hi in zip(p10, p50, p90):
+            if lo == hi:
+                prices.append(mid)
+                continue
+            u = _normal.cdf(correlation * common + idiosyncratic * rng.gauss(0, 1))
+            prices.append(quantile_value(lo, mid, hi, u))
+        net_load = [
+            max(0.0, load * rng.gauss(1, load_sigma)) - pv * cloud
+            for load, pv in zip(load_kwh, pv_kwh)
+        ]
+        export_prices = [price * export_factor + export_offset for price in prices]
+        scenarios.append(Scenario(prices, export_prices, net_load))
+    return scenarios
+
+
+def terminal_price(scenario, model):
+    """Value per kWh left in the battery at the end: what it costs to buy again in the cheapest quarter."""
+    cheapest = sorted(scenario.prices)[:max(1, len(scenario.prices) // 4)]
+    return statistics.fmean(cheapest)
+
+
+def dp_plan(scenario, model, start_kwh, step_kwh=1.0, slot_hours=1.0):
+    """Cost minimal plan (battery kWh per slot) for one scenario."""
+    levels = int((model.max_kwh - model.min_kwh) / step_kwh) + 1
+    max_up = int(model.charge_kw * slot_hours / step_kwh)
+    max_down = int(model.discharge_kw * slot_hours / step_kwh)
+    deltas = range(-max_down, max_up + 1)
+    slots = len(scenario.prices)
+    end_value = terminal_price(scenario, model) * step_kwh
+
+    # Backward pass: value[i] is the cost to go from level i
+    value = [-end_value * i for i in range(levels)]
+    choices = []
+    for t in range(slots - 1, -1, -1):
+        costs = {
+            d: slot_cost(d * step_kwh, scenario.prices[t], scenario.export_prices[t], scenario.net_load[t], model)
+            for d in deltas
+        }
+        new_value = [0.0] * levels
+        choice = [0] * levels
+        for i in range(levels):
+            best, best_d = None, 0
+            for d in deltas:
+                j = i + d
+                if 0 <= j < levels:
+                    cost = costs[d] + value[j]
+                    if best is None or cost < best:
+                        best, best_d = cost, d
+            new_value[i] = best
+            choice[i] = best_d
+        value = new_value
+        choices.append(choice)
+    choices.reverse()
+
+    level = min(levels - 1, max(0, round((start_kwh - model.min_kwh) / step_kwh)))
+    plan = []
+    for choice in choices:
+        plan.append(choice[level] * step_kwh)
+        level += choice[level]
+    return plan
+
+
+def evaluate(plan, scenarios, model, start_kwh, slot_hours=1.0):
+    """Cost of a plan in every scenario, the energy left at the end is credited."""
+    costs = []
+    for scenario in scenarios:
+        cost, trajectory, _ = simulate(plan, scenario.prices, model, start_kwh, scenario.export_prices,
+                                       scenario.net_load, slot_hours)
+        costs.append(cost - (trajectory[-1] - start_kwh) * terminal_price(scenario, model))
+    return costs
+
+
+def _solve_chunk(args):
+    scenarios, model, start_kwh, step_kwh, slot_hours = args
+    return [tuple(dp_plan(scenario, model, start_kwh, step_kwh, slot_hours)) for scenario in scenarios]
+
+
+def stochastic_plan(scenarios, model, start_kwh, step_kwh=1.0, slot_hours=1.0, max_candidates=30,
+                    extra_plans=(), workers=0):
+    """Best expected cost plan over the scenarios with its risk statistics.
+
+    workers > 0 solves the scenario DPs in a process pool, otherwise in process.
+    """
+    if workers > 0:
+        size = max(1, len(scenarios) // workers)
+        chunks = [(scenarios[i:i + size], model, start_kwh, step_kwh, slot_hours) for i in range(0, len(scenarios), size)]
+        with ProcessPoolExecutor(workers) as pool:
+            plans = [plan for chunk in pool.map(_solve_chunk, chunks) for plan in chunk]
+    else:
+        plans = _solve_chunk((scenarios, model, start_kwh, step_kwh, slot_hours))
+
+    candidates = [plan for plan, _ in Counter(plans).most_common(max_candidates)]
+    candidates.extend(tuple(plan) for plan in extra_plans if tuple(plan) not in candidates)
+
+    best = None
+    for plan in candidates:
+        costs = evaluate(plan, scenarios, model, start_kwh, slot_hours)
+        mean = statistics.fmean(costs)
+        if best is None or mean < best[1]:
+            best = (plan, mean, costs)
+
+    plan, mean, costs = best
+    ordered = sorted(costs)
+    tail = ordered[int(len(ordered) * 0.9):] or ordered[-1:]
+    return {
+        "plan": list(plan),
+        "expected_cost": mean,
+        "std": statistics.pstdev(costs),
+        "p10_cost": ordered[int(len(ordered) * 0.1)],
+        "p90_cost": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+        "cvar_90": statistics.fmean(tail),
+        "candidates": len(candidates),
+        "scenarios": len(scenarios),
+    }
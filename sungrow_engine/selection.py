@@ -0,0 +1,86 @@
+"""Charging and discharging hour selection rules shared by the apps and the what-if evaluation.
+
+Prices are plain lists (None for missing slots) and hours are positions in them, so
+the same rules run on the live Nordpool prices and on proposed or forecast prices.
+"""
+
+CHARGE_TOLERANCES = ((5, 10), (4, 5))  # (hours, max extra mean price over the cheapest 3 hours)
+CHARGE_POWER = {3: 6200, 4: 4700, 5: 3800}  # Selected hours -> max charging power W
+DEFAULT_CHARGE_POWER = 4000
+
+
+def mean(values):
+    values = list(values)
+    return sum(values) / len(values)
+
+
+def cheapest_hours(prices, count):
+    """The `count` cheapest (hour, price) pairs, cheapest first."""
+    return sorted([(i, price) for i, price in enumerate(prices) if price is not None], key=lambda x: x[1])[:count]
+
+
+def most_expensive_mean(prices, count=7):
+    """Mean of the `count` most expensive prices, None without enough prices."""
+    prices = [price for price in prices if price is not None]
+    if len(prices) < count:
+        return None
+    return mean(sorted(prices, reverse=True)[:count])
+
+
+def choose_cheapest(priced, base=3, tolerances=CHARGE_TOLERANCES):
+    """The cheapest (position, price) pairs, cheapest first, [] with fewer than `base` prices.
+
+    More pairs (lower power) are chosen when their mean price is within the tolerance
+    of the `base` cheapest ones; tolerances are (count, tolerance), largest count first.
+    """
+    ordered = sorted(((i, price) for i, price in priced if price is not None), key=lambda x: x[1])
+    if len(ordered) < base:
+        return []
+    base_mean = mean(price for _, price in ordered[:base])
+    for count, tolerance in tolerances:
+        if len(ordered) >= count and mean(price for _, price in ordered[:count]) - base_mean <= tolerance:
+            return ordered[:count]
+    return ordered[:base]
+
+
+def most_expensive(priced, floor=None, limit=None):
+    """The most expensive (position, price) pairs at or above floor, most expensive first."""
+    chosen = [(i, price) for i, price in priced if price is not None and (floor is None or price >= floor)]
+    chosen.sort(key=lambda x: x[1], reverse=True)
+    return chosen[:limit]
+
+
+def choose_charging_hours(night_prices, base=3, tolerances=CHARGE_TOLERANCES):
+    """Pick how many of the cheapest night hours to charge in, returns (sorted hours, mean price of them)."""
+    chosen = choose_cheapest(enumerate(night_prices), base, tolerances)
+    return sorted(hour for hour, _ in chosen), mean(price for _, price in chosen)
+
+
+def select_charging_hours(prices, night_hours=7, spread_threshold=40, base=3, tolerances=CHARGE_TOLERANCES):
+    """Night charging hours for a day of prices, [] if the day isn't expensive enough.
+
+    Returns (hours, mean price of the hours, spread between the expensive day hours and
+    the cheapest night hours); spread is None without enough prices.
+    """
+    night_prices = prices[:night_hours]
+    if len(night_prices) < night_hours or len(cheapest_hours(night_prices, base)) < base:
+        return [], None, None
+    base_mean = mean(price for _, price in cheapest_hours(night_prices, base))
+    expensive_mean = most_expensive_mean(prices[night_hours:])
+    if expensive_mean is None:
+        return [], None, None
+    spread = expensive_mean - base_mean
+    if spread < spread_threshold:
+        return [], None, spread
+    hours, selected_mean = choose_charging_hours(night_prices, base, tolerances)
+    return hours, selected_mean, spread
+
+
+def charging_power(hours_count, power_map=None):
+    """Max charging power W for the number of selected hours."""
+    return (power_map or CHARGE_POWER).get(hours_count, DEFAULT_CHARGE_POWER)
+
+
+def select_discharging_hours(hour_prices, charge_price, offset=40, max_hours=7):
+    """The most expensive (hour, price) pairs at least `offset` above the charge price, most expensive first."""
+    return most_expensive(hour_prices, charge_price + offset, max_hours)
@@ -0,0 +1,59 @@
+"""Daily min/max SOC choice from the price horizon, temperature and wear cost."""
+
+import math
+
+# (min SOC, max SOC) the inverter can be set to, narrowest first
+CANDIDATES = ((5, 98), (3, 99), (1, 99))
+BALANCING = (1, 100)
+
+
+def spread_value(prices, energy_kwh, power_kw, efficiency):
+    """Value of moving energy_kwh from the cheapest to the most expensive slots of one day."""
+    prices = sorted(price for price in prices if price is not None)
+    if energy_kwh <= 0 or len(prices) < 2:
+        return 0.0
+    slots = min(len(prices) // 2, max(1, math.ceil(energy_kwh / power_kw)))
+    cheap = sum(prices[:slots]) / slots
+    expensive = sum(prices[-slots:]) / slots
+    return max(0.0, energy_kwh * (expensive * efficiency - cheap))
+
+
+def choose_soc_limits(days, capacity_kwh, degradation_cost, temperature=None, cold_limit=10.0,
+                      power_kw=5.0, efficiency=0.9):
+    """Pick (min SOC, max SOC, values) for a horizon of days (lists of prices).
+
+    Every candidate widens the default 5-98 window; the extra energy is worth the
+    spread it can be moved over in each day of the horizon minus the wear of the
+    deeper cycle (degradation_cost per extra kWh and day). Below cold_limit the
+    narrowest window is always used.
+    """
+    base_min, base_max = CANDIDATES[0]
+    values = {}
+    for soc_min, soc_max in CANDIDATES:
+        extra_kwh = ((base_min - soc_min) + (soc_max - base_max)) / 100 * capacity_kwh
+        value = sum(spread_value(day, extra_kwh, power_kw, efficiency) for day in days) - extra_kwh * degradation_cost * len(days)
+        values[(soc_min, soc_max)] = round(value, 2)
+
+    if temperature is not None and temperature < cold_limit:
+        return base_min, base_max, values
+    soc_min, soc_max = max(values, key=lambda candidate: (values[candidate], -CANDIDATES.index(candidate)))
+    return soc_min, soc_max, values
+
+
+def balancing_cost(prices, slots=3):
+    """Cost indicator for a full charge: mean of the cheapest night slots."""
+    night = sorted(price for price in prices[:max(1, len(prices) * 7 // 24)] if price is not None)
+    return sum(night[:slots]) / len(night[:slots]) if night else None
+
+
+def balance_today(days_since, today_prices, tomorrow_prices, min_interval=4, max_interval=7):
+    """True if today is the day to balance (1-100%): due now, or cheaper than tomorrow once allowed."""
+    if days_since is None or days_since >= max_interval:
+        return True
+    if days_since < min_interval:
+        return False
+    today_cost = balancing_cost(today_prices)
+    tomorrow_cost = balancing_cost(tomorrow_prices) if tomorrow_prices else None
+    if today_cost is None:
+        return False
+    return tomorrow_cost is None or today_cost <= tomorrow_cost
@@ -0,0 +1,28 @@
+"""Process wide store for state that has to survive app reloads."""
+
+import threading
+
+_store = {}
+_lock = threading.Lock()
+
+
+def shared(key, factory):
+    """Return the object stored under key, creating it with factory() the first time.
+
+    The object lives as long as the AppDaemon process, so an app that is reloaded gets
+    back the same price index, history cache or model it built before.
+    """
+    try:
+        return _store[key]
+    except KeyError:
+        pass
+    with _lock:
+        if key not in _store:
+            _store[key] = factory()
+        return _store[key]
+
+
+def drop(key):
+    """Forget a stored object, the next shared() call builds it again."""
+    with _lock:
+        _store.pop(key, None)
@@ -0,0 +1,210 @@
+"""In-memory telemetry buffers for the inverter and battery sensors.
+
+Each entity gets a fixed size, array backed ring of samples at full resolution plus
+1 min and 15 min time weighted aggregates, shared by every app in the process.
+Samples are (unix time, value) and values hold until the next sample, like a
+Home Assistant state does.
+"""
+
+import math
+from array import array
+
+from sungrow_engine.store import shared
+
+
+class RingBuffer:
+    """Fixed size ring of (time, value) samples with a running time integral.
+
+    The integral makes the mean over any window two lookups; finding the window
+    start is a binary search over the ring, so queries are O(log n) and appends O(1).
+    Samples come when the sensor changes, not on a clock, so a position can't be
+    computed from the time, and a few thousand samples take a dozen probes.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.integrals = array("d", bytes(8 * capacity))  # Integral of value dt up to the sample
+        self.count = 0
+        self.head = 0  # Next write position
+
+    def __len__(self):
+        return self.count
+
+    def _pos(self, i):
+        """Array position of the i:th oldest sample."""
+        return (self.head - self.count + i) % self.capacity
+
+    def append(self, t, value):
+        if self.count:
+            last = (self.head - 1) % self.capacity
+            if t < self.times[last]:
+                return  # Out of order samples are dropped
+            integral = self.integrals[last] + self.values[last] * (t - self.times[last])
+        else:
+            integral = 0.0
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.integrals[self.head] = integral
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        if not self.count:
+            return None
+        last = (self.head - 1) % self.capacity
+        return self.times[last], self.values[last]
+
+    def oldest_time(self):
+        return self.times[self._pos(0)] if self.count else None
+
+    def _last_at_or_before(self, t):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._pos(mid)] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def integral_at(self, t):
+        i = self._last_at_or_before(t)
+        if i < 0:
+            return None
+        pos = self._pos(i)
+        return self.integrals[pos] + self.values[pos] * (t - self.times[pos])
+
+    def mean(self, start, end):
+        """Time weighted mean over [start, end], None if the buffer doesn't cover it."""
+        if end <= start:
+            return None
+        first = self.integral_at(start)
+        last = self.integral_at(end)
+        if first is None or last is None:
+            return None
+        return (last - first) / (end - start)
+
+    def samples(self, start=None):
+        """(time, value) samples from `start` (oldest first)."""
+        first = 0 if start is None else max(0, self._last_at_or_before(start))
+        for i in range(first, self.count):
+            pos = self._pos(i)
+            yield self.times[pos], self.values[pos]
+
+
+class Aggregates:
+    """Ring of fixed width buckets with time weighted mean, min and max.
+
+    Each bucket also stores the running sum and duration of everything before it,
+    so the mean between two times is two bucket lookups, O(1) for any window. The
+    spans must follow each other in time, as Telemetry.record adds them.
+    """
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.keys = array("q", [-1]) * capacity  # Bucket number (time // width) stored at each position
+        self.sums = array("d", bytes(8 * capacity))
+        self.durations = array("d", bytes(8 * capacity))
+        self.base_sums = array("d", bytes(8 * capacity))  # Running sum before the bucket
+        self.base_durations = array("d", bytes(8 * capacity))
+        self.mins = array("d", bytes(8 * capacity))
+        self.maxs = array("d", bytes(8 * capacity))
+        self.total = 0.0
+        self.total_duration = 0.0
+        self.first_key = None
+        self.last_key = None
+
+    def _bucket(self, key):
+        pos = key % self.capacity
+        if self.keys[pos] != key:
+            self.keys[pos] = key
+            self.sums[pos] = 0.0
+            self.durations[pos] = 0.0
+            self.base_sums[pos] = self.total
+            self.base_durations[pos] = self.total_duration
+            self.mins[pos] = math.inf
+            self.maxs[pos] = -math.inf
+            if self.first_key is None:
+                self.first_key = key
+            self.last_key = key
+        return pos
+
+    def add_span(self, t0, t1, value):
+        """Add `value` held from t0 to t1, split over the buckets it spans."""
+        while t0 < t1:
+            key = int(t0 // self.width)
+            end = min(t1, (key + 1) * self.width)
+            pos = self._bucket(key)
+            self.sums[pos] += value * (end - t0)
+            self.durations[pos] += end - t0
+            self.mins[pos] = min(self.mins[pos], value)
+            self.maxs[pos] = max(self.maxs[pos], value)
+            self.total += value * (end - t0)
+            self.total_duration += end - t0
+            t0 = end
+
+    def bucket(self, t):
+        """(mean, min, max) of the bucket containing t, None if not recorded."""
+        key = int(t // self.width)
+        pos = key % self.capacity
+        if self.keys[pos] != key or not self.durations[pos]:
+            return None
+        return self.sums[pos] / self.durations[pos], self.mins[pos], self.maxs[pos]
+
+    def mean(self, start, end):
+        """Time weighted mean of the whole buckets between start and end."""
+        if self.last_key is None:
+            return None
+        first = max(int(start // self.width), self.first_key, self.last_key - self.capacity + 1)
+        last = min(int(end // self.width), self.last_key)
+        if first > last:
+            return None
+        a, b = first % self.capacity, last % self.capacity
+        duration = self.base_durations[b] + self.durations[b] - self.base_durations[a]
+        total = self.base_sums[b] + self.sums[b] - self.base_sums[a]
+        return total / duration if duration else None
+
+
+class Telemetry:
+    """Full resolution ring plus 1 min and 15 min aggregates for one entity."""
+
+    def __init__(self, entity, max_samples=4320, minute_buckets=1440, quarter_buckets=672):
+        self.entity = entity
+        self.ring = RingBuffer(max_samples)
+        self.minutes = Aggregates(60, minute_buckets)
+        self.quarters = Aggregates(900, quarter_buckets)
+
+    def record(self, t, value):
+        latest = self.ring.latest()
+        if latest is not None and t > latest[0]:
+            self.minutes.add_span(latest[0], t, latest[1])
+            self.quarters.add_span(latest[0], t, latest[1])
+        self.ring.append(t, value)
+
+    def latest(self):
+        latest = self.ring.latest()
+        return None if latest is None else latest[1]
+
+    def mean(self, seconds, now):
+        """Time weighted mean over the last `seconds` before `now`.
+
+        Served from the full resolution ring while it covers the window, otherwise
+        from the 1 min or 15 min aggregates.
+        """
+        start = now - seconds
+        oldest = self.ring.oldest_time()
+        if oldest is not None and oldest <= start:
+            return self.ring.mean(start, now)
+        if seconds <= 24 * 3600:
+            value = self.minutes.mean(start, now)
+            if value is not None:
+                return value
+        return self.quarters.mean(start, now)
+
+
+def telemetry(entity, **kwargs):
+    """The process wide Telemetry for an entity, shared by all apps."""
+    return shared(("telemetry", entity), lambda: Telemetry(entity, **kwargs))
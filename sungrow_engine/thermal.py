@@ -0,0 +1,82 @@
+"""Temperature dependent charge power envelope.
+
+LFP cells take less charge current when cold and the inverter derates when hot, so a
+night plan at full power may not get its energy in. The envelope is the share of the
+max charge power allowed at a battery and inverter temperature; temperatures for the
+coming slots come from the trend of the last hour of telemetry. Slots that can't take
+their planned energy hand the rest to the next cheapest slots of the window.
+"""
+
+import bisect
+
+# (°C, share of the max charge power), linear in between and flat outside
+BATTERY_ENVELOPE = ((0, 0.0), (5, 0.3), (10, 0.6), (15, 1.0), (40, 1.0), (45, 0.6), (50, 0.0))
+INVERTER_ENVELOPE = ((60, 1.0), (70, 0.7), (75, 0.0))
+
+
+def _interpolate(points, x):
+    xs = [point[0] for point in points]
+    i = bisect.bisect_right(xs, x)
+    if i == 0:
+        return points[0][1]
+    if i == len(points):
+        return points[-1][1]
+    (x0, y0), (x1, y1) = points[i - 1], points[i]
+    return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+
+
+def power_limit(max_power, battery_temperature=None, inverter_temperature=None,
+                battery_envelope=BATTERY_ENVELOPE, inverter_envelope=INVERTER_ENVELOPE):
+    """Max charge power at the temperatures, unknown temperatures don't limit."""
+    share = 1.0
+    if battery_temperature is not None:
+        share = min(share, _interpolate(battery_envelope, battery_temperature))
+    if inverter_temperature is not None:
+        share = min(share, _interpolate(inverter_envelope, inverter_temperature))
+    return max_power * share
+
+
+def trend(buffer, now, window=3600):
+    """(current °C, change per hour) from a Telemetry buffer, None without samples.
+
+    The change compares the mean of the last quarter with the quarter a window earlier.
+    """
+    current = buffer.mean(900, now)
+    if current is None:
+        current = buffer.latest()
+    if current is None:
+        return None
+    earlier = buffer.mean(900, now - window + 900)
+    slope = 0.0 if earlier is None else (current - earlier) * 3600 / window
+    return current, slope
+
+
+def forecast(current, slope, hours_ahead, max_change=5.0):
+    """Temperature hours_ahead from a trend, the change capped at max_change °C."""
+    if current is None:
+        return None
+    return current + max(-max_change, min(max_change, slope * hours_ahead))
+
+
+def plan_energy(candidates, chosen, energy_kwh):
+    """Spread energy_kwh over the window within each slot's limit.
+
+    candidates are (position, price, hours, limit kW) for every slot of the window;
+    the chosen positions are filled first, cheapest first, then the other slots
+    cheapest first. Returns ({position: kWh} of the slots that get energy, kWh that
+    fits nowhere).
+    """
+    chosen = set(chosen)
+    order = sorted(
+        (candidate for candidate in candidates if candidate[1] is not None),
+        key=lambda candidate: (candidate[0] not in chosen, candidate[1]),
+    )
+    energies = {}
+    for position, _, hours, limit_kw in order:
+        if energy_kwh <= 1e-6:
+            break
+        energy = min(energy_kwh, max(0.0, limit_kw) * hours)
+        if energy > 1e-6:
+            energies[position] = energy
+            energy_kwh -= energy
+    return energies, max(0.0, energy_kwh)
@@ -0,0 +1,128 @@
+"""What-if evaluation of battery schedules on the cached price slots.
+
+A schedule is a dict of slot start -> battery kWh (positive charges). It can come
+from the dashboard as explicit entries, from the selection rules with overridden
+parameters, or from the selected hours the apps have published (the active plan).
+Evaluating one is a single pass of the battery model, well below a millisecond for
+two days of slots.
+"""
+
+import bisect
+import datetime
+
+from sungrow_engine.battery_model import simulate
+from sungrow_engine.rules import NIGHT_CHARGING_RULES, compile_rules, night_charge
+from sungrow_engine.selection import select_discharging_hours
+
+# Overrides of the night charging rules, their defaults are the charging app's rules
+NIGHT_OVERRIDES = ("night_hours", "spread_threshold", "charge_power")
+
+RULE_DEFAULTS = {
+    "discharge_offset": 40,
+    "max_discharge_hours": 7,
+    "day_start_hour": 6,
+    "day_end_hour": 22,
+    "house_load_kw": 0.5,
+    "export_enabled": False,  # Opt-in, like in SmartDayDischarging
+    "export_price_factor": 0.8,
+    "export_price_offset": 0,
+}
+
+
+def slot_hours(slot):
+    return (slot.end - slot.start).total_seconds() / 3600
+
+
+def days(slots):
+    """Split slots into lists of consecutive slots with the same local date."""
+    grouped = []
+    for slot in slots:
+        if grouped and grouped[-1][0].start.date() == slot.start.date():
+            grouped[-1].append(slot)
+        else:
+            grouped.append([slot])
+    return grouped
+
+
+def night_rules(params=None, spec=None):
+    """Compiled night charging rules: the charging app's `rules:` spec with the NIGHT_OVERRIDES of params."""
+    params = params or {}
+    spec = {section: dict(values) for section, values in (spec or {}).items()}
+    if "night_hours" in params:
+        spec["window"] = {"first_slot": 0, "slots": int(params["night_hours"])}
+    if "spread_threshold" in params:
+        spec.setdefault("spread", {})["min"] = float(params["spread_threshold"])
+    if "charge_power" in params:
+        spec.setdefault("power", {}).update(params["charge_power"])
+    # JSON keys are strings, the selected hour counts of the power table are numbers
+    if "power" in spec:
+        spec["power"] = {count if count == "default" else int(count): power for count, power in spec["power"].items()}
+    return compile_rules(spec, NIGHT_CHARGING_RULES)
+
+
+def rule_plan(slots, model, params=None, charge_price=None, night_spec=None):
+    """Schedule the selection rules would make over whole days of slots.
+
+    Night charging follows SmartNightCharging with its `rules:` (night_spec) and day
+    discharging SmartDayDischarging; the mean price of a day's charge is the cost the
+    next discharge hours must beat. `charge_price` is used until the first day with charging.
+    """
+    night = night_rules(params, night_spec)
+    params = dict(RULE_DEFAULTS, **(params or {}))
+    plan = {}
+    for day in days(slots):
+        hours, selected_mean, _ = night_charge(night, day)
+        for hour in hours:
+            plan[day[hour].start] = night.power(len(hours)) / 1000 * slot_hours(day[hour])
+        if selected_mean is not None:
+            charge_price = selected_mean
+        if charge_price is None:
+            continue
+
+        hour_prices = [
+            (i, slot.value) for i, slot in enumerate(day)
+            if int(params["day_start_hour"]) <= slot.start.hour <= int(params["day_end_hour"])
+        ]
+        selected = select_discharging_hours(hour_prices, charge_price, float(params["discharge_offset"]),
+                                            int(params["max_discharge_hours"]))
+        for i, price in selected:
+            export_price = price * float(params["export_price_factor"]) + float(params["export_price_offset"])
+            export = params["export_enabled"] and export_price >= charge_price + model.cycle_cost
+            power_kw = model.discharge_kw if export else float(params["house_load_kw"])
+            plan[day[i].start] = -power_kw * slot_hours(day[i])
+    return plan
+
+
+def plan_from_entries(slots, entries):
+    """Schedule from [{"start": iso time, "energy_kwh": kWh}], each entry lands in the slot containing it."""
+    starts = [slot.start for slot in slots]
+    plan = {}
+    for entry in entries:
+        when = datetime.datetime.fromisoformat(str(entry["start"]))
+        i = bisect.bisect_right(starts, when) - 1
+        if i < 0 or when >= slots[i].end:
+            raise ValueError(f"{entry['start']} is outside the price horizon")
+        plan[starts[i]] = plan.get(starts[i], 0.0) + float(entry["energy_kwh"])
+    return plan
+
+
+def evaluate(slots, plan, model, start_kwh, export_price_factor=0.8, export_price_offset=0.0, house_load_kw=0.5):
+    """Cost and SOC trajectory of a schedule over the slots.
+
+    Returns (cost in öre compared with no battery, SOC kWh per slot boundary, kWh used per slot).
+    """
+    prices = [slot.value for slot in slots]
+    export_prices = [None if price is None else price * export_price_factor + export_price_offset for price in prices]
+    net_load = [house_load_kw * slot_hours(slot) for slot in slots]
+    energies = [plan.get(slot.start, 0.0) for slot in slots]
+    hours = slot_hours(slots[0]) if slots else 1.0
+    return simulate(energies, prices, model, start_kwh, export_prices, net_load, hours)
+
+
+def plan_difference(slots, used, active_used):
+    """Slots where the evaluated schedule does something else than the active plan."""
+    return [
+        {"start": slot.start.isoformat(), "energy_kwh": round(energy, 2) or 0.0, "active_energy_kwh": round(active, 2) or 0.0}
+        for slot, energy, active in zip(slots, used, active_used)
+        if abs(energy - active) >= 0.01
+    ]
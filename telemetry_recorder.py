@@ -0,0 +1,60 @@
+import appdaemon.plugins.hass.hassapi as hass
+
+from sungrow_engine.quality import check_sample
+from sungrow_engine.telemetry import telemetry
+
+    # This app records the live inverter and battery sensors into in-memory ring buffers.
+    # Other apps read averages like "battery power the last 5 minutes" from the buffers instead of calling Home Assistant.
+    # The last hours are kept at full resolution, older data as 1 min and 15 min aggregates.
+    # Samples are converted to the unit the apps use (W, °C) and values outside the physical range of the sensor
+    # (a battery level of 250 %, a spike from a lost modbus frame) are dropped before they reach the buffers.
+
+DEFAULT_ENTITIES = [
+    "sensor.battery_power_raw",
+    "sensor.battery_level_nominal",
+    "sensor.battery_temperature",
+    "sensor.battery_voltage",
+    "sensor.battery_current",
+    "sensor.meter_active_power",
+    "sensor.import_power",
+    "sensor.mppt1_power",
+    "sensor.mppt2_power",
+    "sensor.total_power_solar_and_battery",
+    "sensor.inverter_temperature",
+]
+
+
+class TelemetryRecorder(hass.Hass):
+    def initialize(self):
+        """Initialize the buffers and subscribe to every telemetry entity."""
+        self.entities = list(self.args.get("entities", DEFAULT_ENTITIES))
+        full_hours = float(self.args.get("full_resolution_hours", 6))
+        sample_interval = float(self.args.get("sample_interval", 5))  # Expected seconds between updates
+
+        self.rejected = {}  # entity -> samples dropped by the quality check
+        for entity in self.entities:
+            buffer = telemetry(entity, max_samples=int(full_hours * 3600 / sample_interval))
+            self.record(entity, buffer, self.get_state(entity, attribute="all"))
+            self.listen_state(self.on_state, entity, attribute="all", buffer=buffer)
+
+        self.log(f"Recording telemetry for {len(self.entities)} entities.")
+
+    def on_state(self, entity, attribute, old, new, kwargs):
+        if old and new and old.get("state") == new.get("state"):
+            return  # Only an attribute changed
+        self.record(entity, kwargs["buffer"], new)
+
+    def record(self, entity, buffer, state):
+        """Store a numeric state in the app's unit, "unavailable" and impossible values are skipped."""
+        state = state or {}
+        try:
+            value = float(state.get("state"))
+        except (TypeError, ValueError):
+            return
+        value = check_sample(entity, value, (state.get("attributes") or {}).get("unit_of_measurement"))
+        if value is None:
+            self.rejected[entity] = self.rejected.get(entity, 0) + 1
+            if self.rejected[entity] == 1:
+                self.log(f"Dropped an invalid sample of {entity}: {state.get('state')}")
+            return
+        buffer.record(self.datetime(aware=True).timestamp(), value)
@@ -0,0 +1,54 @@
+"""The rolling timeline with the forecast day across the DST switches."""
+
+import datetime
+import os
+import sys
+import zoneinfo
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sungrow_engine.horizon import build_timeline  # noqa: E402
+from sungrow_engine.prices import PriceIndex, slots_from_list  # noqa: E402
+
+TZ = zoneinfo.ZoneInfo("Europe/Stockholm")
+UTC = datetime.timezone.utc
+
+
+def published(day):
+    """A published day like the raw_today attribute: hourly slots with the fixed UTC offsets of their ISO strings."""
+    midnight = datetime.datetime.combine(day, datetime.time(0)).replace(tzinfo=TZ).astimezone(UTC)
+    hours = round((datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0)).replace(tzinfo=TZ)
+                   .astimezone(UTC) - midnight).total_seconds() / 3600)
+    return [
+        slot._replace(start=datetime.datetime.fromisoformat(slot.start.isoformat()),
+                      end=datetime.datetime.fromisoformat(slot.end.isoformat()))
+        for slot in slots_from_list([50.0] * hours, day, TZ)
+    ]
+
+
+@pytest.mark.parametrize("day, hours", [
+    (datetime.date(2025, 10, 26), list(range(3)) + [2] + list(range(3, 24))),  # Summer time ends, 02:00 twice
+    (datetime.date(2025, 10, 27), list(range(24))),  # The day after, the published day ends in winter time
+    (datetime.date(2025, 3, 30), [0, 1] + list(range(3, 24))),  # Summer time starts, no 02:00
+    (datetime.date(2025, 3, 31), list(range(24))),
+])
+def test_forecast_day_on_its_own_clock(day, hours):
+    today = day - datetime.timedelta(days=1)
+    now = datetime.datetime.combine(today, datetime.time(12)).replace(tzinfo=TZ)
+    p50 = [100.0 + hour for hour in range(24)]
+    p90 = [200.0 + hour for hour in range(24)]
+    timeline = build_timeline(PriceIndex(published(today), []), now, {"date": day.isoformat(), "p50": p50, "p90": p90})
+
+    forecast = timeline.slots[timeline.forecast_from:]
+    assert [slot.start.hour for slot in forecast] == hours
+    assert all(slot.start.date() == day for slot in forecast)
+    assert [slot.value for slot in forecast] == [p50[hour] for hour in hours]
+    assert timeline.p90[timeline.forecast_from:] == [p90[hour] for hour in hours]
+
+    # Back to back from the last published slot, an hour each, up to the next midnight
+    boundaries = [timeline.slots[timeline.forecast_from - 1].end] + [slot.end for slot in forecast]
+    assert all(slot.start.astimezone(UTC) == start.astimezone(UTC) for slot, start in zip(forecast, boundaries))
+    assert all(slot.end.astimezone(UTC) - slot.start.astimezone(UTC) == datetime.timedelta(hours=1) for slot in forecast)
+    assert forecast[-1].end == datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0)).replace(tzinfo=TZ)
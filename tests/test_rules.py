@@ -0,0 +1,112 @@
+"""Validation of the `rules:` sections against the schema and the app's defaults."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sungrow_engine.rules import RuleError, compile_rules  # noqa: E402
+
+NIGHT = {
+    "window": {"first_slot": 0, "slots": 7},
+    "select": {"order": "cheapest", "base": 3, "options": [[5, 10], [4, 5]]},
+    "spread": {"min": 40, "expensive_slots": 7},
+    "power": {3: 6200, 4: 4700, 5: 3800, "default": 4000},
+}
+DAY = {
+    "window": {"start_hour": 6, "end_hour": 22},
+    "select": {"order": "expensive", "max": 7},
+    "spread": {"min": 40},
+}
+RECHARGE = {"limits": {"battery_threshold": 5}}
+
+
+def test_defaults_and_overrides_compile():
+    rules = compile_rules({"spread": {"min": 50}, "power": {3: 5000}}, NIGHT)
+    assert rules.spread_min == 50
+    assert rules.power(3) == 5000
+    assert rules.power(4) == 4700
+    assert compile_rules({"limits": {"battery_threshold": 8}}, RECHARGE).limits == {"battery_threshold": 8}
+
+
+def test_misspelled_limit():
+    with pytest.raises(RuleError, match="rules.limits.battery_treshold"):
+        compile_rules({"limits": {"battery_treshold": 3}}, RECHARGE)
+
+
+def test_limit_of_another_app():
+    with pytest.raises(RuleError, match="rules.limits.max_mean_price"):
+        compile_rules({"limits": {"max_mean_price": 3}}, RECHARGE)
+
+
+def test_limit_value_out_of_range():
+    with pytest.raises(RuleError, match="rules.limits.battery_threshold"):
+        compile_rules({"limits": {"battery_threshold": 150}}, RECHARGE)
+
+
+def test_section_the_app_doesnt_use():
+    with pytest.raises(RuleError, match="rules.power"):
+        compile_rules({"power": {3: 5000}}, DAY)
+    with pytest.raises(RuleError, match="rules.limits"):
+        compile_rules({"limits": {"battery_threshold": 5}}, DAY)
+
+
+def test_power_key():
+    with pytest.raises(RuleError, match="rules.power.defualt"):
+        compile_rules({"power": {"defualt": 4000}}, NIGHT)
+
+
+def test_select_key_of_the_other_order():
+    with pytest.raises(RuleError, match="rules.select.max: not used with order cheapest"):
+        compile_rules({"select": {"max": 5}}, NIGHT)
+    with pytest.raises(RuleError, match="rules.select.base: not used with order expensive"):
+        compile_rules({"select": {"base": 5}}, DAY)
+
+
+def test_changing_the_order_replaces_the_selection():
+    rules = compile_rules({"select": {"order": "expensive", "max": 2}}, NIGHT)
+    assert rules.select([(0, 1.0), (1, 3.0), (2, 2.0), (3, 4.0)]) == [(3, 4.0), (1, 3.0)]
+
+
+def test_window_across_midnight():
+    with pytest.raises(RuleError, match="rules.window: start_hour 22 is after end_hour 6"):
+        compile_rules({"window": {"start_hour": 22, "end_hour": 6}}, DAY)
+
+
+def test_unknown_section_and_key():
+    with pytest.raises(RuleError, match="rules.windows"):
+        compile_rules({"windows": {}}, DAY)
+    with pytest.raises(RuleError, match="rules.spread.minimum"):
+        compile_rules({"spread": {"minimum": 3}}, DAY)
+
+
+def day_slots(values):
+    import datetime
+    import zoneinfo
+
+    from sungrow_engine.prices import slots_from_list
+    return slots_from_list(values, datetime.date(2025, 1, 15), zoneinfo.ZoneInfo("Europe/Stockholm"))
+
+
+def test_night_charge_with_the_defaults_is_the_default_selection():
+    import random
+
+    from sungrow_engine.rules import NIGHT_CHARGING_RULES, night_charge
+    from sungrow_engine.selection import select_charging_hours
+    rules = compile_rules(None, NIGHT_CHARGING_RULES)
+    rng = random.Random(1)
+    for _ in range(200):
+        values = [round(rng.uniform(-10, 200), 2) for _ in range(24)]
+        assert night_charge(rules, day_slots(values)) == select_charging_hours(values)
+
+
+def test_night_charge_follows_the_configured_rules():
+    from sungrow_engine.rules import NIGHT_CHARGING_RULES, night_charge
+    values = [50, 40, 10, 12, 11, 30, 60] + [100] * 17
+    hours, _, spread = night_charge(compile_rules(None, NIGHT_CHARGING_RULES), day_slots(values))
+    assert hours == [1, 2, 3, 4, 5] and spread > 40  # 5 slots within 10 öre of the 3 cheapest
+    assert night_charge(compile_rules({"spread": {"min": 200}}, NIGHT_CHARGING_RULES), day_slots(values))[0] == []
+    assert night_charge(compile_rules({"window": {"first_slot": 0, "slots": 3}, "select": {"base": 2}},
+                                      NIGHT_CHARGING_RULES), day_slots(values))[0] == [1, 2]
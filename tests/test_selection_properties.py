@@ -0,0 +1,48 @@
+"""The properties of tools/fuzz_selection.py with a fixed seed and case count, drawn by Hypothesis when it is installed."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+
+import fuzz_selection  # noqa: E402
+
+try:
+    from hypothesis import given, settings, strategies
+except ImportError:
+    given = None
+
+SEED = 1
+CASES = 300  # Per property, a tenth of them for the apps
+
+
+@pytest.fixture(scope="module")
+def apps():
+    return fuzz_selection.AppCase()
+
+
+if given is not None:
+    def examples(count):
+        return settings(max_examples=count, derandomize=True, deadline=None, database=None)
+
+    @examples(CASES)
+    @given(strategies.randoms(use_true_random=False))
+    def test_ranges(rng):
+        fuzz_selection.check_ranges(rng)
+
+    @examples(CASES)
+    @given(strategies.randoms(use_true_random=False))
+    def test_selection(rng):
+        fuzz_selection.check_selection(rng)
+
+    @examples(CASES // 10)
+    @given(rng=strategies.randoms(use_true_random=False))
+    def test_apps(apps, rng):
+        apps.run(rng)
+else:
+    @pytest.mark.parametrize("name", fuzz_selection.PROPERTIES)
+    def test_properties(name):
+        stats, failures = fuzz_selection.run(CASES, SEED, (name,))
+        assert not failures, "\n".join(f"--only {name} --replay {seed}: {message}" for name, seed, message in failures[:10])
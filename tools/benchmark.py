@@ -0,0 +1,183 @@
+"""Benchmarks for the price selection and scheduling hot paths.
+
+Runs the apps on the fake Hass from fake_hass.py with 24, 96 and 100 slot price days
+and on a synthetic multi-year batch, and stores the timings as JSON:
+
+    python tools/benchmark.py --output benchmark_results.json
+    python tools/benchmark.py --compare benchmark_results.json
+
+With --compare the run fails (exit code 1) if a benchmark got slower than the
+allowed regression compared to the stored results. A compare run leaves the stored
+results alone and only writes its own with --output (to another file).
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import fake_hass
+
+SLOT_COUNTS = (24, 96, 100)
+NORDPOOL = "sensor.nordpool_kwh_se3_sek_3_10_025"
+
+
+def synthetic_day(rng, slots, missing=0.0):
+    """One day of prices with a night dip, morning and evening peaks and some noise."""
+    prices = []
+    level = rng.uniform(20, 150)
+    for slot in range(slots):
+        hour = slot * 24 / slots
+        shape = 0.6 if hour < 6 else 1.3 if 7 <= hour < 10 or 17 <= hour < 21 else 1.0
+        price = round(max(-10.0, level * shape + rng.gauss(0, level * 0.15)), 2)
+        prices.append(None if rng.random() < missing else price)
+    return prices
+
+
+def synthetic_days(days, slots, seed=1):
+    rng = random.Random(seed)
+    return [synthetic_day(rng, slots) for _ in range(days)]
+
+
+def set_prices(hub, today, tomorrow):
+    attributes = fake_hass.nordpool_attributes(today, tomorrow, hub.now.date())
+    hub.set(NORDPOOL, today[hub.now.hour * len(today) // 24], attributes, replace=True)
+
+
+def make_hub():
+    hub = fake_hass.FakeHub(now=datetime.datetime(2025, 1, 15, 12, 0, 0), record=False)
+    hub.set("sensor.selected_charging_hours_prices", "30.00")
+    hub.set("sensor.battery_level_nominal", "50")
+    return hub
+
+
+def measure(func, repeat, number):
+    """Best and mean time per call in microseconds over `repeat` rounds of `number` calls."""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    return {"min_us": round(min(rounds), 3), "mean_us": round(sum(rounds) / len(rounds), 3), "calls": repeat * number}
+
+
+def app_benchmarks(hub):
+    """(name, callable) for every hot path that reads the Nordpool sensor."""
+    apps = {
+        "nordpool_mean_low_vs_high_price_today": ("NordpoolMeanLowVsHighPriceToday", "calculate_mean_difference"),
+        "nordpool_mean_low_vs_high_price_tomorrow": ("NordpoolMeanLowVsHighPriceTomorrow", "calculate_mean_difference"),
+        "nordpool_mean_high_today_vs_low_tomorrow": ("NordpoolMeanHighTodayVsLowTomorrow", "calculate_mean_difference"),
+        "smart_night_charging": ("SmartNightCharging", "update_charging_hours"),
+        "smart_day_discharging": ("SmartDayDischarging", "update_discharging_hours"),
+    }
+    for module, (class_name, method) in apps.items():
+        app = fake_hass.load_app(hub, module, class_name)
+        yield f"{module}.{method}", getattr(app, method)
+
+
+def run(repeat, number, batch_days):
+    results = {}
+    for slots in SLOT_COUNTS:
+        hub = make_hub()
+        days = synthetic_days(2, slots, seed=slots)
+        set_prices(hub, days[0], days[1])
+        benchmarks = list(app_benchmarks(hub))
+        night = hub.apps["smart_night_charging"]
+        day = hub.apps["smart_day_discharging"]
+        selected = sorted(random.Random(slots).sample(range(min(slots, 24)), 7))
+        benchmarks.append(("smart_night_charging.format_selected_hours", lambda: night.format_selected_hours(selected)))
+        benchmarks.append(("smart_day_discharging.group_sequential_hours", lambda: day.group_sequential_hours(selected)))
+
+        for name, func in benchmarks:
+            def call():
+                func()
+                hub.clear_timers()
+            results[f"{name}[{slots}]"] = dict(measure(call, repeat, number), slots=slots)
+
+        # Synthetic multi-year batch: every app evaluated once per day
+        batch = synthetic_days(batch_days + 1, slots, seed=100 + slots)
+        start = time.perf_counter()
+        for today, tomorrow in zip(batch, batch[1:]):
+            set_prices(hub, today, tomorrow)
+            for _, func in benchmarks:
+                func()
+            hub.clear_timers()
+        elapsed = time.perf_counter() - start
+        results[f"batch_{batch_days}_days[{slots}]"] = {
+            "total_s": round(elapsed, 4),
+            "per_day_us": round(elapsed / batch_days * 1e6, 3),
+            "slots": slots,
+        }
+    return results
+
+
+def reload_benchmarks(repeat):
+    """Time an AppDaemon style reload of every app module, the engine stays imported."""
+    results = {}
+    for module in ("nordpool_price_forecast", "peak_shaving", "smart_night_charging", "smart_day_discharging"):
+        loaded = importlib.import_module(module)
+        results[f"reload.{module}"] = measure(lambda: importlib.reload(loaded), repeat, 10)
+    return results
+
+
+def compare(results, previous, max_regression):
+    """Names of the benchmarks that got slower than allowed."""
+    regressions = []
+    for name, result in results.items():
+        old = previous.get(name)
+        key = "min_us" if "min_us" in result else "per_day_us"
+        if not old or key not in old or old[key] <= 0:
+            continue
+        change = result[key] / old[key] - 1
+        if change > max_regression:
+            regressions.append(f"{name}: {old[key]:.1f} -> {result[key]:.1f} us ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="Where to store the results, default benchmark_results.json without --compare")
+    parser.add_argument("--compare", help="Stored results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--batch-days", type=int, default=3 * 365)
+    args = parser.parse_args(argv)
+    # A compare run keeps its baseline, it only stores its results where --output says
+    output = args.output or (None if args.compare else "benchmark_results.json")
+    if output and args.compare and os.path.realpath(output) == os.path.realpath(args.compare):
+        parser.error("--output would overwrite the --compare baseline")
+
+    fake_hass.install()
+    results = run(args.repeat, args.number, args.batch_days)
+    results.update(reload_benchmarks(args.repeat))
+    for name, result in results.items():
+        print(f"{name:70s} {result.get('min_us', result.get('per_day_us')):>12.1f} us")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.max_regression)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""Minimal in-memory stand-in for AppDaemon's Hass API.
+
+Used by the benchmark, replay and fuzz tools to run the apps without Home Assistant.
+Nothing here is imported by the apps themselves; call install() before importing an
+app module so that `import appdaemon.plugins.hass.hassapi as hass` resolves to this file.
+"""
+
+import datetime
+import heapq
+import importlib
+import itertools
+import os
+import sys
+import types
+import zoneinfo
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeHub:
+    """Shared state, timers and listeners for all fake apps."""
+
+    def __init__(self, now=None, record=True, tz="Europe/Stockholm", catch_errors=False):
+        self.tz = zoneinfo.ZoneInfo(tz)
+        self.now = now or datetime.datetime(2025, 1, 1, 0, 0, 0)  # Naive local time like AppDaemon
+        self.states = {}  # entity -> {"state": ..., "attributes": {...}}
+        self.timers = []  # heap of (time, handle)
+        self.callbacks = {}  # handle -> (callback, kwargs, interval)
+        self.state_listeners = []  # (entity, attribute, callback, kwargs)
+        self.event_listeners = []  # (event, callback, kwargs)
+        self.endpoints = {}
+        self.apps = {}
+        self.record = record
+        self.catch_errors = catch_errors  # Keep going after an app callback raises, the error goes to self.errors
+        self.errors = []  # (time, callback name, exception)
+        self.service_calls = []  # (time, app, service, kwargs)
+        self.state_writes = []  # (time, app, entity, state)
+        self.logs = []
+        self._seq = itertools.count()
+
+    # States
+
+    def get(self, entity):
+        return self.states.get(entity)
+
+    def set(self, entity, state=None, attributes=None, replace=False):
+        """Set an entity like Home Assistant would and notify the state listeners."""
+        old = self.states.get(entity, {"state": None, "attributes": {}})
+        new_attributes = dict(attributes or {}) if replace else dict(old["attributes"], **(attributes or {}))
+        new = {"state": old["state"] if state is None else state, "attributes": new_attributes}
+        self.states[entity] = new
+
+        for listen_entity, attribute, callback, kwargs in list(self.state_listeners):
+            if listen_entity is not None and listen_entity != entity:
+                continue
+            if attribute is None:
+                old_value, new_value = old["state"], new["state"]
+            elif attribute == "all":
+                old_value, new_value = old, new
+            else:
+                old_value, new_value = old["attributes"].get(attribute), new["attributes"].get(attribute)
+            if old_value != new_value:
+                self.call(callback, entity, attribute, old_value, new_value, kwargs)
+
+    # Timers
+
+    def schedule(self, when, callback, kwargs, interval=None):
+        if when.tzinfo is not None:
+            when = when.astimezone(self.tz).replace(tzinfo=None)
+        handle = next(self._seq)
+        self.callbacks[handle] = (callback, kwargs, interval)
+        heapq.heappush(self.timers, (when, handle))
+        return handle
+
+    def cancel(self, handle):
+        self.callbacks.pop(handle, None)
+
+    def advance(self, until):
+        """Run every timer due up to `until` in time order, moving the clock along."""
+        while self.timers and self.timers[0][0] <= until:
+            when, handle = heapq.heappop(self.timers)
+            entry = self.callbacks.get(handle)
+            if entry is None:
+                continue
+            callback, kwargs, interval = entry
+            self.now = max(self.now, when)
+            if interval is not None:
+                heapq.heappush(self.timers, (when + interval, handle))
+            else:
+                del self.callbacks[handle]
+            self.call(callback, dict(kwargs))
+        self.now = max(self.now, until)
+
+    def call(self, callback, *args):
+        """Run an app callback, with catch_errors an exception is recorded instead of raised."""
+        if not self.catch_errors:
+            return callback(*args)
+        try:
+            return callback(*args)
+        except Exception as e:
+            self.errors.append((self.now, getattr(callback, "__qualname__", repr(callback)), e))
+
+    def clear_records(self):
+        self.service_calls.clear()
+        self.state_writes.clear()
+        self.logs.clear()
+
+    def clear_timers(self):
+        self.timers.clear()
+        self.callbacks.clear()
+
+
+class Hass:
+    """The subset of appdaemon.plugins.hass.hassapi.Hass used by the apps."""
+
+    def __init__(self, hub, name, args=None):
+        self.hub = hub
+        self.name = name
+        self.args = dict(args or {})
+
+    # Logging
+
+    def log(self, message, *args, **kwargs):
+        if self.hub.record:
+            self.hub.logs.append((self.hub.now, self.name, message))
+
+    error = log
+
+    # Time
+
+    def datetime(self, aware=False):
+        if aware:
+            return self.hub.now.replace(tzinfo=self.hub.tz)
+        return self.hub.now
+
+    def get_now(self):
+        return self.hub.now.replace(tzinfo=self.hub.tz)
+
+    def get_timezone(self):
+        return str(self.hub.tz)
+
+    def date(self):
+        return self.hub.now.date()
+
+    def time(self):
+        return self.hub.now.time()
+
+    # States and services
+
+    def get_state(self, entity_id=None, attribute=None, default=None, **kwargs):
+        if entity_id is None:
+            return {entity: dict(value) for entity, value in self.hub.states.items()}
+        entry = self.hub.get(entity_id)
+        if entry is None:
+            return default
+        if attribute == "all":
+            return {"state": entry["state"], "attributes": entry["attributes"], "entity_id": entity_id}
+        if attribute is not None:
+            return entry["attributes"].get(attribute, default)
+        return entry["state"]
+
+    def set_state(self, entity_id, state=None, attributes=None, **kwargs):
+        if self.hub.record:
+            self.hub.state_writes.append((self.hub.now, self.name, entity_id, state))
+        self.hub.set(entity_id, state, attributes, replace=kwargs.get("replace", False))
+
+    def call_service(self, service, **kwargs):
+        if self.hub.record:
+            self.hub.service_calls.append((self.hub.now, self.name, service, kwargs))
+        domain_service = service.replace(".", "/")
+        if domain_service == "input_select/select_option":
+            self.hub.set(kwargs["entity_id"], kwargs["option"])
+        elif domain_service == "input_number/set_value":
+            self.hub.set(kwargs["entity_id"], kwargs["value"])
+
+    def listen_state(self, callback, entity_id=None, attribute=None, **kwargs):
+        entry = (entity_id, attribute, callback, kwargs)
+        self.hub.state_listeners.append(entry)
+        return entry
+
+    def listen_event(self, callback, event=None, **kwargs):
+        entry = (event, callback, kwargs)
+        self.hub.event_listeners.append(entry)
+        return entry
+
+    def fire_event(self, event, **kwargs):
+        for listen_event, callback, listen_kwargs in list(self.hub.event_listeners):
+            if listen_event is None or listen_event == event:
+                self.hub.call(callback, event, kwargs, listen_kwargs)
+
+    def register_endpoint(self, callback, endpoint=None, **kwargs):
+        self.hub.endpoints[endpoint or self.name] = callback
+
+    def register_route(self, callback, route=None, **kwargs):
+        self.hub.endpoints[route or self.name] = callback
+
+    def get_app(self, name):
+        return self.hub.apps.get(name)
+
+    # Scheduler
+
+    @staticmethod
+    def _parse_time(start):
+        if isinstance(start, datetime.time):
+            return start
+        return datetime.time.fromisoformat(str(start))
+
+    def _next(self, start, period):
+        now = self.hub.now
+        if isinstance(start, datetime.datetime):
+            return start
+        if start is None or start == "now":
+            return now
+        at = self._parse_time(start)
+        if period == datetime.timedelta(hours=1):
+            candidate = now.replace(minute=at.minute, second=at.second, microsecond=0)
+        elif period == datetime.timedelta(minutes=1):
+            candidate = now.replace(second=at.second, microsecond=0)
+        else:
+            candidate = datetime.datetime.combine(now.date(), at)
+        while candidate <= now:
+            candidate += period
+        return candidate
+
+    def run_in(self, callback, delay, **kwargs):
+        return self.hub.schedule(self.hub.now + datetime.timedelta(seconds=delay), callback, kwargs)
+
+    def run_at(self, callback, start, **kwargs):
+        if not isinstance(start, datetime.datetime):
+            start = self._next(start, datetime.timedelta(days=1))
+        return self.hub.schedule(start, callback, kwargs)
+
+    def run_once(self, callback, start, **kwargs):
+        return self.run_at(callback, start, **kwargs)
+
+    def run_daily(self, callback, start, **kwargs):
+        period = datetime.timedelta(days=1)
+        return self.hub.schedule(self._next(start, period), callback, kwargs, period)
+
+    def run_hourly(self, callback, start, **kwargs):
+        period = datetime.timedelta(hours=1)
+        return self.hub.schedule(self._next(start, period), callback, kwargs, period)
+
+    def run_minutely(self, callback, start, **kwargs):
+        period = datetime.timedelta(minutes=1)
+        return self.hub.schedule(self._next(start, period), callback, kwargs, period)
+
+    def run_every(self, callback, start, interval, **kwargs):
+        period = datetime.timedelta(seconds=interval)
+        first = self.hub.now + period if start == "now" else self._next(start, period)
+        return self.hub.schedule(first, callback, kwargs, period)
+
+    def cancel_timer(self, handle):
+        self.hub.cancel(handle)
+
+    def cancel_listen_state(self, handle):
+        if handle in self.hub.state_listeners:
+            self.hub.state_listeners.remove(handle)
+
+
+def install():
+    """Make `appdaemon.plugins.hass.hassapi` importable and point it at this module."""
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    if "appdaemon.plugins.hass.hassapi" in sys.modules:
+        return
+    for name in ("appdaemon", "appdaemon.plugins", "appdaemon.plugins.hass"):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    module = types.ModuleType("appdaemon.plugins.hass.hassapi")
+    module.Hass = Hass
+    sys.modules["appdaemon.plugins.hass.hassapi"] = module
+
+
+def load_app(hub, module, class_name, name=None, args=None, initialize=True):
+    """Import an app module, create the app on the hub and run its initialize()."""
+    install()
+    cls = getattr(importlib.import_module(module), class_name)
+    name = name or module
+    app = cls(hub, name, dict(args or {}, module=module, **{"class": class_name}))
+    hub.apps[name] = app
+    if initialize:
+        app.initialize()
+    return app
+
+
+def nordpool_attributes(today, tomorrow, day, tz="Europe/Stockholm"):
+    """Attributes of the Nordpool sensor for the given price lists, raw_* entries included."""
+    install()
+    from sungrow_engine.prices import slots_from_list
+
+    def raw(prices, date):
+        return [
+            {"start": slot.start.isoformat(), "end": slot.end.isoformat(), "value": slot.value}
+            for slot in slots_from_list(prices, date, zoneinfo.ZoneInfo(tz))
+        ]
+
+    return {
+        "today": list(today),
+        "tomorrow": list(tomorrow),
+        "tomorrow_valid": bool(tomorrow),
+        "raw_today": raw(today, day),
+        "raw_tomorrow": raw(tomorrow, day + datetime.timedelta(days=1)),
+    }
@@ -0,0 +1,111 @@
+"""Plan the night charging and day discharging for a batch of battery sites.
+
+Sites come from a CSV file with the columns of sungrow_engine.fleet.Site (site_id,
+area, soc and optionally capacity_kwh, charge_kw, discharge_kw, min_soc, max_soc),
+prices from a JSON file {"SE3": {"date": "2025-01-15", "prices": [...]}, ...}:
+
+    python tools/fleet_plan.py --sites sites.csv --prices prices.json --output plans.json
+    python tools/fleet_plan.py --synthetic 100000 --processes 4
+
+--synthetic plans random sites on random prices and prints the throughput.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import sys
+import time
+import zoneinfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sungrow_engine.fleet import Site, plan_fleet
+from sungrow_engine.prices import slots_from_list
+
+AREAS = ("SE1", "SE2", "SE3", "SE4")
+APPS_YAML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "apps.yaml")
+
+
+def read_sites(path):
+    floats = ("soc", "capacity_kwh", "charge_kw", "discharge_kw", "min_soc", "max_soc")
+    with open(path, newline="") as f:
+        for record in csv.DictReader(f):
+            values = {key: float(value) if key in floats else value for key, value in record.items()
+                      if key in Site._fields and value not in (None, "")}
+            yield Site(**values)
+
+
+def read_prices(path, tz):
+    with open(path) as f:
+        data = json.load(f)
+    return {
+        area: slots_from_list(entry["prices"], datetime.date.fromisoformat(entry["date"]), tz)
+        for area, entry in data.items()
+    }
+
+
+def night_spec(path):
+    """The rules: of smart_night_charging in apps.yaml, None without the file or the section."""
+    if not path or not os.path.exists(path):
+        return None
+    import yaml  # Comes with AppDaemon
+
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    return (config.get("smart_night_charging") or {}).get("rules")
+
+
+def synthetic(count, day, tz, seed=1):
+    """Random sites spread over the areas and a price day per area."""
+    rng = random.Random(seed)
+    prices = {}
+    for area in AREAS:
+        level = rng.uniform(20, 150)
+        values = [round(level * (0.6 if hour < 6 else 1.3 if 7 <= hour < 10 or 17 <= hour < 21 else 1.0)
+                        + rng.gauss(0, level * 0.15), 2) for hour in range(24)]
+        prices[area] = slots_from_list(values, day, tz)
+    sites = [
+        Site(f"site-{i}", rng.choice(AREAS), round(rng.uniform(5, 95), 1), rng.choice((9.6, 12.8, 16.0, 25.6)),
+             rng.choice((3.0, 5.0, 6.2)), rng.choice((5.0, 7.0)))
+        for i in range(count)
+    ]
+    return sites, prices
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", help="CSV file with the sites")
+    parser.add_argument("--prices", help="JSON file with one price day per area")
+    parser.add_argument("--synthetic", type=int, help="Plan this many random sites instead")
+    parser.add_argument("--rules", help="JSON object overriding sungrow_engine.whatif.RULE_DEFAULTS")
+    parser.add_argument("--apps-yaml", default=APPS_YAML, help="apps.yaml with the rules: of smart_night_charging")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--output", help="Where to write the plans as JSON, default nowhere")
+    parser.add_argument("--timezone", default="Europe/Stockholm")
+    args = parser.parse_args(argv)
+
+    tz = zoneinfo.ZoneInfo(args.timezone)
+    if args.synthetic:
+        sites, prices = synthetic(args.synthetic, datetime.date(2025, 1, 15), tz)
+    elif args.sites and args.prices:
+        sites, prices = list(read_sites(args.sites)), read_prices(args.prices, tz)
+    else:
+        parser.error("give --sites and --prices, or --synthetic")
+
+    start = time.perf_counter()
+    plans = plan_fleet(sites, prices, json.loads(args.rules) if args.rules else None, processes=args.processes,
+                       night_spec=night_spec(args.apps_yaml))
+    elapsed = time.perf_counter() - start
+    print(f"{len(plans)} site plans in {elapsed:.3f} s ({len(plans) / elapsed:.0f} per second).", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([plan._asdict() for plan in plans], f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""Deterministic property based checks of the slot selection, range grouping and scheduling.
+
+Random price days of 23 to 100 slots (DST days, quarter hours, odd publications,
+flat days, spikes, negative and missing prices) and battery states are generated
+from a seed, and every case is checked against invariants instead of fixed answers:
+
+- ranges: the ranges of the selected slots hold every selected slot once, the slots
+  of a range are back to back, ranges don't touch or overlap and the sensor text has
+  one valid HH:MM-HH:MM per range
+- selection: the selected positions are inside the day and the rules' window and
+  count, discharging prices are above the floor
+- apps (SmartNightCharging and SmartDayDischarging on the fake Hass): the timers
+  are in the future, start and stop timers alternate so charging and discharging
+  windows never overlap, every start is at a selected slot, and planning the same
+  prices again leaves the same timers
+- energy: the planned charge is at most the planned power over the selected slots,
+  the planned export at most what the battery holds above its floor
+
+    python tools/fuzz_selection.py --cases 5000 --seed 1
+    python tools/fuzz_selection.py --only apps --replay 1000123    # one failing case again
+    python tools/fuzz_selection.py --hypothesis    # the same properties with Hypothesis shrinking, if it is installed
+
+Every case is generated from its own seed (from the run seed and the case number),
+the failures are listed with the seed that replays them. The ranges and selection
+properties run a few thousand to over ten thousand cases/s; an apps case plans a
+whole day twice on the fake hub, about 200-250 cases/s, so it gets a tenth of the
+cases. tests/test_selection_properties.py runs the same properties under pytest.
+"""
+
+import argparse
+import datetime
+import random
+import re
+import sys
+import time
+import zoneinfo
+
+import fake_hass
+
+fake_hass.install()
+
+from sungrow_engine.prices import slots_from_list  # noqa: E402
+from sungrow_engine.ranges import format_ranges, group_ranges, range_times  # noqa: E402
+from sungrow_engine.selection import select_charging_hours, select_discharging_hours  # noqa: E402
+
+TZ = zoneinfo.ZoneInfo("Europe/Stockholm")
+UTC = datetime.timezone.utc  # Local times in the repeated autumn hour only compare right in UTC
+NORDPOOL = "sensor.nordpool_kwh_se3_sek_3_10_025"
+SLOT_COUNTS = (23, 24, 25, 92, 96, 100)  # The usual ones, random counts from 23 to 100 in between
+DATES = (
+    datetime.date(2025, 1, 15),
+    datetime.date(2025, 3, 29),  # The day before the spring DST switch, tomorrow has 23 hours
+    datetime.date(2025, 10, 25),  # The day before the autumn switch, tomorrow has 25 hours
+    datetime.date(2025, 12, 31),
+)
+RANGE_TEXT = re.compile(r"^\d\d:\d\d-\d\d:\d\d$")
+
+
+class PropertyError(AssertionError):
+    """A generated case that breaks an invariant."""
+
+
+def check(condition, message):
+    if not condition:
+        raise PropertyError(message)
+
+
+def utc(moment):
+    return moment.astimezone(UTC)
+
+
+def duration(start, end):
+    return utc(end) - utc(start)
+
+
+# Generators, everything is drawn from the rng so a seed gives the same case again
+
+def random_prices(rng, slots):
+    """A day of prices in one of a few shapes, with some missing."""
+    shape = rng.choice(("daily", "flat", "steps", "spike", "negative", "noise"))
+    level = rng.uniform(0, 200)
+    prices = []
+    for slot in range(slots):
+        hour = slot * 24 / slots
+        if shape == "flat":
+            price = level
+        elif shape == "steps":
+            price = level * (1 + (slot * 4 // slots) % 2)
+        elif shape == "noise":
+            price = rng.uniform(-20, 300)
+        else:
+            factor = 0.5 if hour < 6 else 1.6 if 7 <= hour < 10 or 17 <= hour < 21 else 1.0
+            price = level * factor + rng.gauss(0, level * 0.1 + 1)
+            if shape == "negative" and hour < 6:
+                price = -abs(price) / 4
+        prices.append(round(price, 2))
+    if shape == "spike":
+        prices[rng.randrange(slots)] = round(rng.uniform(500, 3000), 2)
+    for _ in range(rng.choice((0, 0, 0, 1, 2))):
+        prices[rng.randrange(slots)] = None
+    return prices
+
+
+def random_slot_count(rng):
+    return rng.choice(SLOT_COUNTS) if rng.random() < 0.6 else rng.randint(23, 100)
+
+
+def random_positions(rng, count):
+    """Selected positions, sometimes with a position selected twice and always including the edges now and then."""
+    positions = rng.sample(range(count), rng.randint(0, min(count, 12)))
+    if rng.random() < 0.3:
+        positions.append(count - 1)  # The last slot of the day, its end is midnight
+    if positions and rng.random() < 0.2:
+        positions.append(rng.choice(positions))
+    return positions
+
+
+# Properties
+
+def check_ranges(rng):
+    """group_ranges, range_times and format_ranges on a random day and selection."""
+    date = rng.choice(DATES) + datetime.timedelta(days=rng.randint(0, 1))
+    slots = slots_from_list(random_prices(rng, random_slot_count(rng)), date, TZ)
+    positions = random_positions(rng, len(slots))
+    if rng.random() < 0.3:
+        # Keyed like the day discharging's hour -> slot, the first slot of every hour
+        keyed = {}
+        for slot in slots:
+            keyed.setdefault(slot.start.hour, slot)
+        slots = keyed
+        positions = [position for position in positions if position in keyed]
+
+    runs = group_ranges(slots, positions)
+    flat = [position for run in runs for position in run]
+    check(sorted(flat) == sorted(set(positions)), f"ranges {runs} don't hold the positions {positions} once each")
+    for run in runs:
+        for a, b in zip(run, run[1:]):
+            check(utc(slots[a].end) == utc(slots[b].start), f"range {run} has a gap between {a} and {b}")
+    for previous, following in zip(runs, runs[1:]):
+        check(utc(slots[previous[-1]].end) < utc(slots[following[0]].start), f"ranges {previous} and {following} touch or overlap")
+
+    times = range_times(slots, positions)
+    selected = sum((duration(slots[p].start, slots[p].end) for p in set(positions)), datetime.timedelta())
+    check(sum((duration(start, end) for start, end in times), datetime.timedelta()) == selected, f"range times {times} don't cover the slots")
+
+    text = format_ranges(slots, positions)
+    parts = text.split(", ") if text else []
+    check(len(parts) == len(runs), f"{text!r} has {len(parts)} ranges, expected {len(runs)}")
+    check(all(RANGE_TEXT.match(part) for part in parts), f"{text!r} isn't HH:MM-HH:MM ranges")
+
+
+def check_selection(rng):
+    """select_charging_hours and select_discharging_hours stay in their bounds."""
+    prices = random_prices(rng, random_slot_count(rng))
+    night_hours = rng.randint(1, 10)
+    threshold = rng.uniform(0, 80)
+    hours, selected_mean, spread = select_charging_hours(prices, night_hours, threshold)
+    check(len(hours) == len(set(hours)), f"charging hours {hours} repeat")
+    check(all(0 <= hour < night_hours and prices[hour] is not None for hour in hours), f"charging hours {hours} outside the night")
+    check(len(hours) in (0, 3, 4, 5), f"{len(hours)} charging hours selected")
+    if hours:
+        check(spread is not None and spread >= threshold, f"charging selected with spread {spread} under {threshold}")
+        check(abs(selected_mean - sum(prices[hour] for hour in hours) / len(hours)) < 1e-9, "charging mean is off")
+
+    charge_price = rng.uniform(-10, 150)
+    offset, max_hours = rng.uniform(0, 80), rng.randint(1, 10)
+    chosen = select_discharging_hours(list(enumerate(prices)), charge_price, offset, max_hours)
+    check(len(chosen) <= max_hours, f"{len(chosen)} discharging hours over the limit {max_hours}")
+    check(all(price >= charge_price + offset for _, price in chosen), "discharging hour under the price floor")
+    check([price for _, price in chosen] == sorted((price for _, price in chosen), reverse=True), "discharging hours not most expensive first")
+
+
+class AppCase:
+    """SmartNightCharging and SmartDayDischarging on one fake hub, fed a new random case every run."""
+
+    def __init__(self):
+        self.hub = fake_hass.FakeHub(now=datetime.datetime(2025, 1, 15, 12, 0), record=False)
+        self.night = fake_hass.load_app(self.hub, "smart_night_charging", "SmartNightCharging")
+        self.day = fake_hass.load_app(self.hub, "smart_day_discharging", "SmartDayDischarging")
+
+    def timers(self, app):
+        """(time, callback name) of the app's pending timers, in time order."""
+        pending = []
+        for when, handle in self.hub.timers:
+            entry = self.hub.callbacks.get(handle)
+            if entry is None or entry[2] is not None:  # Cancelled or a repeating routine
+                continue
+            callback = entry[0]
+            if getattr(callback, "__self__", None) is app:
+                pending.append((utc(when.replace(tzinfo=TZ)), callback.__name__))
+        return sorted(pending)
+
+    def run(self, rng):
+        hub = self.hub
+        date = rng.choice(DATES) + datetime.timedelta(days=rng.randint(0, 1))
+        count = random_slot_count(rng)
+        today, tomorrow = random_prices(rng, count), random_prices(rng, count)
+        hub.clear_timers()
+        hub.now = datetime.datetime.combine(date, datetime.time(rng.randint(0, 23), rng.choice((0, 7, 30, 59))))
+        soc, min_soc, max_soc = round(rng.uniform(0, 100), 1), rng.randint(0, 20), rng.randint(80, 100)
+        reserved = rng.randint(0, 30)
+        hub.set("sensor.battery_level_nominal", str(soc))
+        hub.set("input_number.set_sg_min_soc", str(min_soc))
+        hub.set("input_number.set_sg_max_soc", str(max_soc))
+        hub.set("sensor.peak_shaving_reserved_soc", str(reserved))
+        hub.set("sensor.selected_charging_hours_prices", f"{rng.uniform(-5, 120):.2f}")
+        hub.set(NORDPOOL, today[hub.now.hour * count // 24], fake_hass.nordpool_attributes(today, tomorrow, date), replace=True)
+
+        self.night.update_charging_hours()
+        self.day.update_discharging_hours()
+        now = utc(hub.now.replace(tzinfo=TZ))
+        night_timers, day_timers = self.timers(self.night), self.timers(self.day)
+        self.check_night(now, night_timers)
+        self.check_day(now, day_timers, max(soc, max_soc) - max(min_soc, reserved))
+
+        # Planning the same prices again replaces the timers with the same ones
+        self.night.update_charging_hours()
+        self.day.update_discharging_hours()
+        check(self.timers(self.night) == night_timers, "re-planning the night charge changed its timers")
+        check(self.timers(self.day) == day_timers, "re-planning the day discharge changed its timers")
+
+    def check_night(self, now, timers):
+        app = self.night
+        sensor = self.hub.get("sensor.selected_charging_hours") or {}
+        hours = list(sensor.get("attributes", {}).get("selected_hours") or [])
+        slots = app.plan_slots
+        if " | Mean: " not in str(sensor.get("state")):
+            check(not timers, f"night charging timers {timers} without a plan ({sensor.get('state')!r})")
+            return
+        check(hours == sorted(set(hours)), f"charging hours {hours} not sorted and unique")
+        check(all(0 <= hour < len(slots) for hour in hours), f"charging hours {hours} outside the {len(slots)} slots")
+        state = sensor["state"]
+        check(state.startswith(format_ranges(slots, hours) + " | "), f"charging sensor {state!r} doesn't match the hours {hours}")
+        windows = alternate(now, timers, "start_charging", "stop_charging", "charging")
+        check(windows == expected_windows(now, range_times(slots, hours)),
+              f"charging windows {windows} aren't the ranges of {hours}")
+
+        slot_hours = sum(duration(slots[hour].start, slots[hour].end).total_seconds() / 3600 for hour in hours)
+        planned = (app.planned_power or 0) / 1000 * slot_hours
+        check(sum(app.slot_energy.values()) <= planned + 1e-6, f"{sum(app.slot_energy.values()):.2f} kWh planned over {planned:.2f} kWh")
+
+    def check_day(self, now, timers, usable_soc):
+        app = self.day
+        hours = list(app.selected_hour_indices)
+        check(hours == sorted(set(hours)), f"discharging hours {hours} not sorted and unique")
+        check(all(hour in app.hour_slots for hour in hours), f"discharging hours {hours} aren't today's slots")
+        starts = [when for when, name in timers if name == "start_discharging"]
+        windows = alternate(now, [timer for timer in timers if timer[1] != "switch_discharge_mode"],
+                            "start_discharging", "stop_discharging", "discharging")
+        check(windows == expected_windows(now, range_times(app.hour_slots, hours)),
+              f"discharging windows {windows} aren't the ranges of {hours}")
+        check(all(any(utc(app.hour_slots[hour].start) == when for hour in hours) for when in starts), "discharging starts off a selected slot")
+
+        energy_wh = max(0.0, usable_soc) / 100 * app.battery_capacity_kwh * 1000
+        exported = sum(power * duration(app.hour_slots[hour].start, app.hour_slots[hour].end).total_seconds() / 3600
+                       for hour, power in app.export_power.items())
+        check(set(app.export_power) <= set(hours), f"export hours {sorted(app.export_power)} aren't selected")
+        # The powers are rounded to whole W
+        check(exported <= energy_wh + len(app.export_power), f"{exported:.0f} Wh export planned, the battery holds {energy_wh:.0f} Wh")
+        check(all(0 < power <= app.max_discharge_power for power in app.export_power.values()), "export power outside the inverter limit")
+
+
+def alternate(now, timers, start_name, stop_name, what):
+    """(start, stop) windows of start/stop timers that must alternate; a window that runs already has no start."""
+    check(all(when >= now for when, _ in timers), f"{what} timer in the past: {timers}")
+    check(len(set(timers)) == len(timers), f"{what} timer scheduled twice: {timers}")
+    windows = []
+    start = None
+    for when, name in timers:
+        if name == start_name:
+            check(start is None, f"{what} started twice without a stop: {timers}")
+            start = when
+        elif name == stop_name:
+            check(start is not None or not windows, f"{what} stopped twice without a start: {timers}")
+            check(start is None or start < when, f"{what} stops before it starts: {timers}")
+            windows.append((start, when))
+            start = None
+    check(start is None, f"{what} starts without a stop: {timers}")
+    return windows
+
+
+def expected_windows(now, ranges):
+    """The (start, stop) windows still to come, a window that runs already has no start timer."""
+    ranges = [(utc(start), utc(end)) for start, end in ranges]
+    return [(start if start >= now else None, end) for start, end in ranges if end >= now]
+
+
+PROPERTIES = ("ranges", "selection", "apps")
+
+
+def run_case(name, seed, apps):
+    rng = random.Random(seed)
+    if name == "ranges":
+        check_ranges(rng)
+    elif name == "selection":
+        check_selection(rng)
+    else:
+        apps.run(rng)
+
+
+def run(cases, seed, properties, verbose=False, replay=None):
+    """{property: (cases, seconds)} and the failures as (property, seed, message)."""
+    apps = AppCase() if "apps" in properties else None
+    stats, failures = {}, []
+    for name in properties:
+        count = cases if name != "apps" else max(1, cases // 10)  # An app case plans a whole day twice
+        seeds = [replay] if replay is not None else [seed * 1_000_003 + case for case in range(count)]
+        started = time.perf_counter()
+        for case_seed in seeds:
+            try:
+                run_case(name, case_seed, apps)
+            except PropertyError as e:
+                failures.append((name, case_seed, str(e)))
+            except Exception as e:  # A crash is a failure of the case too
+                failures.append((name, case_seed, f"{type(e).__name__}: {e}"))
+                if verbose:
+                    print(f"{name} seed {case_seed}: {e}")
+        stats[name] = (len(seeds), time.perf_counter() - started)
+    return stats, failures
+
+
+def run_hypothesis(cases, properties):
+    """The same properties with Hypothesis drawing the rng, failing cases are shrunk."""
+    try:
+        from hypothesis import given, settings, strategies
+    except ImportError:
+        sys.exit("Hypothesis isn't installed, run without --hypothesis for the seeded cases.")
+    apps = AppCase() if "apps" in properties else None
+    for name in properties:
+        @settings(max_examples=cases if name != "apps" else max(1, cases // 10), derandomize=True, deadline=None, database=None)
+        @given(strategies.randoms(use_true_random=False))
+        def prop(rng):
+            if name == "apps":
+                apps.run(rng)
+            else:
+                (check_ranges if name == "ranges" else check_selection)(rng)
+
+        prop()
+        print(f"{name}: passed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=2000, help="Cases per property, a tenth of them for the apps")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", choices=PROPERTIES, action="append", help="Run only these properties")
+    parser.add_argument("--replay", type=int, metavar="SEED", help="Run the one case of a failure's seed again")
+    parser.add_argument("--hypothesis", action="store_true", help="Draw the cases with Hypothesis and shrink failures")
+    parser.add_argument("--verbose", action="store_true", help="Print every failure as it happens")
+    args = parser.parse_args(argv)
+    properties = args.only or PROPERTIES
+
+    if args.hypothesis:
+        run_hypothesis(args.cases, properties)
+        return 0
+
+    stats, failures = run(args.cases, args.seed, properties, args.verbose, args.replay)
+    for name, (count, seconds) in stats.items():
+        print(f"{name:10} {count:7} cases  {count / seconds:9.0f} cases/s")
+    for name, seed, message in failures[:20]:
+        print(f"FAIL --only {name} --replay {seed}: {message}")
+    if len(failures) > 20:
+        print(f"... and {len(failures) - 20} more failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
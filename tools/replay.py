@@ -0,0 +1,333 @@
+"""Replay recorded Home Assistant history through the apps and diff their decisions.
+
+Reads the Nordpool and battery sensors from a recorder database (SQLite, old and new
+schema) or a CSV history export and streams them in time order into the fake Hass
+from fake_hass.py, with the apps running on top. The inverter settings and plan
+sensors the apps wrote back then are read from the same history and compared with
+what the current code does:
+
+    python tools/replay.py home-assistant_v2.db --start 2025-01-14 --end 2025-01-16
+    python tools/replay.py history.csv --start 2025-01-14 --app smart_night_charging:SmartNightCharging
+
+Rows are read with generators (fetchmany on SQLite, a merge of per-entity streams on
+grouped CSV files), so long histories don't have to fit in memory.
+"""
+
+import argparse
+import csv
+import datetime
+import heapq
+import itertools
+import json
+import sqlite3
+import sys
+from collections import namedtuple
+
+import fake_hass
+
+Row = namedtuple("Row", "time entity state attributes")  # time is an aware UTC datetime, attributes a JSON string or dict
+
+INPUT_ENTITIES = [
+    "sensor.nordpool_kwh_se3_sek_3_10_025",
+    "sensor.nordpool_price_forecast",
+    "sensor.battery_level_nominal",
+    "sensor.battery_level",
+    "sensor.battery_power_raw",
+    "sensor.battery_temperature",
+    "sensor.inverter_temperature",
+    "sensor.meter_active_power",
+    "sensor.daily_imported_energy",
+    "sensor.daily_exported_energy",
+    "sensor.daily_battery_charge",
+    "sensor.daily_battery_discharge",
+]
+
+DECISION_ENTITIES = [
+    "input_select.set_sg_ems_mode",
+    "input_select.set_sg_battery_forced_charge_discharge_cmd",
+    "input_number.set_sg_battery_max_charge_power",
+    "input_number.set_sg_forced_charge_discharge_power",
+    "input_number.set_sg_min_soc",
+    "input_number.set_sg_max_soc",
+    "sensor.selected_charging_hours",
+    "sensor.selected_discharging_hours",
+]
+
+SETTER_SERVICES = ("input_select/select_option", "input_number/set_value")
+
+DEFAULT_APPS = [
+    "smart_night_charging:SmartNightCharging",
+    "smart_day_discharging:SmartDayDischarging",
+    "extra_night_discharging:ExtraNightDischarging",
+    "battery_charging_app:BatteryChargingApp",
+    "dynamic_soc_manager:DynamicSOCManager",
+]
+
+
+def parse_time(value):
+    """Aware UTC datetime from a unix timestamp or an ISO string (naive strings are UTC)."""
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+    when = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.astimezone(datetime.timezone.utc)
+
+
+# Readers
+
+def sqlite_rows(path, entities, start=None, end=None, batch=1000):
+    """States of the entities from a recorder database in time order."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(states)")}
+
+        # Since 2023 the entity id lives in states_meta and the times are unix timestamps
+        if "metadata_id" in columns and "states_meta" in tables:
+            entity_column, joins = "states_meta.entity_id", "JOIN states_meta ON states.metadata_id = states_meta.metadata_id"
+        else:
+            entity_column, joins = "states.entity_id", ""
+        if "attributes_id" in columns and "state_attributes" in tables:
+            attributes_column = "COALESCE(state_attributes.shared_attrs, states.attributes)" if "attributes" in columns else "state_attributes.shared_attrs"
+            joins += " LEFT JOIN state_attributes ON states.attributes_id = state_attributes.attributes_id"
+        else:
+            attributes_column = "states.attributes"
+        if "last_updated_ts" in columns:
+            time_column = "states.last_updated_ts"
+            convert = lambda when: when.timestamp()
+        else:
+            time_column = "states.last_updated"
+            convert = lambda when: when.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+        where = [f"{entity_column} IN ({', '.join('?' * len(entities))})"]
+        params = list(entities)
+        if start is not None:
+            where.append(f"{time_column} >= ?")
+            params.append(convert(start))
+        if end is not None:
+            where.append(f"{time_column} < ?")
+            params.append(convert(end))
+        query = (
+            f"SELECT {time_column}, {entity_column}, states.state, {attributes_column} FROM states {joins} "
+            f"WHERE {' AND '.join(where)} ORDER BY {time_column}"
+        )
+        cursor = connection.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            for when, entity, state, attributes in rows:
+                yield Row(parse_time(when), entity, state, attributes)
+    finally:
+        connection.close()
+
+
+def _csv_records(path, offset=None):
+    """(byte offset, row) of each record of a CSV export, from `offset` (a record start) on."""
+    with open(path, "rb") as f:
+        position = 0
+
+        def lines():
+            nonlocal position
+            for line in f:
+                position += len(line)
+                yield line.decode("utf-8")
+
+        # csv.reader pulls exactly the lines of one record, a quoted field may span several
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        if header is None:
+            return
+        if offset is not None:
+            f.seek(offset)
+            position = offset
+        while True:
+            start = position
+            values = next(reader, None)
+            if values is None:
+                return
+            if not values:
+                continue
+            record = dict(zip(header, values))
+            yield start, Row(parse_time(record.get("last_changed") or record["last_updated"]), record["entity_id"],
+                             record["state"], record.get("attributes") or None)
+
+
+def csv_rows(path, entities, start=None, end=None):
+    """States of the entities from a CSV history export in time order.
+
+    The export from the history panel is grouped by entity; the first pass notes
+    where each group starts, then each group is streamed from its offset and the
+    groups are merged by time. A file already in time order is streamed as it is.
+    """
+    wanted = set(entities)
+    groups = []  # (entity, byte offset of the first row)
+    in_order = True
+    last_time = None
+    for offset, row in _csv_records(path):
+        if not groups or groups[-1][0] != row.entity:
+            groups.append((row.entity, offset))
+        if last_time is not None and row.time < last_time:
+            in_order = False
+        last_time = row.time
+
+    def select(rows):
+        for row in rows:
+            if row.entity in wanted and (start is None or row.time >= start) and (end is None or row.time < end):
+                yield row
+
+    if in_order:
+        yield from select(row for _, row in _csv_records(path))
+        return
+
+    def group(entity, offset):
+        rows = (row for _, row in _csv_records(path, offset))
+        return select(itertools.takewhile(lambda row: row.entity == entity, rows))
+
+    yield from heapq.merge(*(group(entity, offset) for entity, offset in groups if entity in wanted),
+                           key=lambda row: row.time)
+
+
+def read_rows(path, entities, start=None, end=None):
+    if path.endswith(".csv"):
+        return csv_rows(path, entities, start, end)
+    return sqlite_rows(path, entities, start, end)
+
+
+# Replay
+
+def value_of(entity, state):
+    """Comparable value, the input_number settings rounded to whole watts or percent."""
+    try:
+        return f"{float(state):.0f}" if entity.startswith("input_number.") else str(state)
+    except (TypeError, ValueError):
+        return str(state)
+
+
+def replay(rows, hub, apps, start, end, decision_entities=DECISION_ENTITIES):
+    """Feed the rows into the hub, loading the apps at `start` and running them until `end`.
+
+    Rows before `start` only set the initial states. Returns (recorded decisions,
+    replayed decisions, initial decision states), the decisions as lists of
+    (local time, entity, value) and the initial states as {entity: value}.
+    """
+    decisions = set(decision_entities)
+    recorded = []
+    replayed = []
+    initial = {}
+    loaded = False
+
+    def collect():
+        for when, app, service, kwargs in hub.service_calls:
+            entity = kwargs.get("entity_id")
+            if entity in decisions and service in SETTER_SERVICES:  # Not the logbook entries about an entity
+                replayed.append((when, entity, value_of(entity, kwargs.get("option", kwargs.get("value")))))
+        for when, app, entity, state in hub.state_writes:
+            if entity in decisions and state is not None:
+                replayed.append((when, entity, value_of(entity, state)))
+        hub.clear_records()
+
+    def load(local):
+        hub.now = max(hub.now, local)
+        for spec in apps:
+            module, class_name, *name = spec.split(":")
+            hub.call(fake_hass.load_app, hub, module, class_name, name[0] if name else None)
+        collect()
+
+    for row in rows:
+        local = row.time.astimezone(hub.tz).replace(tzinfo=None)
+        if not loaded and row.time >= start:
+            load(start.astimezone(hub.tz).replace(tzinfo=None))
+            loaded = True
+        if loaded:
+            hub.advance(local)
+            collect()
+        else:
+            hub.now = local
+
+        if row.entity in decisions:
+            if loaded:
+                recorded.append((local, row.entity, value_of(row.entity, row.state)))
+            else:
+                hub.set(row.entity, row.state)  # The inverter settings at the start
+                initial[row.entity] = value_of(row.entity, row.state)
+            continue
+        attributes = json.loads(row.attributes) if isinstance(row.attributes, str) else row.attributes
+        hub.set(row.entity, row.state, attributes or {}, replace=True)
+        collect()
+
+    # The timers after the last row still decide until the end
+    if not loaded:
+        load(start.astimezone(hub.tz).replace(tzinfo=None))
+    hub.advance(end.astimezone(hub.tz).replace(tzinfo=None))
+    collect()
+    return recorded, replayed, initial
+
+
+def changes(decisions, initial=None):
+    """Only the entries where an entity gets a new value, the recorder stores nothing else.
+
+    `initial` holds the values the entities had before the first decision.
+    """
+    last = dict(initial or {})
+    for when, entity, value in sorted(decisions, key=lambda d: d[0]):
+        if last.get(entity) != value:
+            last[entity] = value
+            yield when, entity, value
+
+
+def diff(recorded, replayed, tolerance=datetime.timedelta(minutes=2), initial=None):
+    """Differences as (time, entity, logged value, replayed value); None where one side is missing.
+
+    A replayed change matches a logged one with the same entity and value within the
+    tolerance. Both sides start from the `initial` values.
+    """
+    pending = list(changes(replayed, initial))
+    differences = []
+    for when, entity, value in changes(recorded, initial):
+        match = next((i for i, (t, e, v) in enumerate(pending)
+                      if e == entity and v == value and abs(t - when) <= tolerance), None)
+        if match is None:
+            differences.append((when, entity, value, None))
+        else:
+            del pending[match]
+    differences.extend((when, entity, None, value) for when, entity, value in pending)
+    return sorted(differences, key=lambda d: d[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("history", help="Recorder database (home-assistant_v2.db) or CSV history export")
+    parser.add_argument("--start", required=True, help="Local date/time to start the apps, e.g. 2025-01-14")
+    parser.add_argument("--end", help="Local date/time to stop, default one day after start")
+    parser.add_argument("--app", action="append", help="module:Class[:name] to run, default the planning apps")
+    parser.add_argument("--entity", action="append", default=[], help="Extra input entity to feed")
+    parser.add_argument("--warmup-hours", type=float, default=24, help="History before start used for the initial states")
+    parser.add_argument("--tolerance", type=float, default=120, help="Seconds a replayed decision may differ from the log")
+    parser.add_argument("--timezone", default="Europe/Stockholm")
+    args = parser.parse_args(argv)
+
+    hub = fake_hass.FakeHub(tz=args.timezone, catch_errors=True)
+    start_local = datetime.datetime.fromisoformat(args.start)
+    end_local = datetime.datetime.fromisoformat(args.end) if args.end else start_local + datetime.timedelta(days=1)
+    start = start_local.replace(tzinfo=hub.tz).astimezone(datetime.timezone.utc)
+    end = end_local.replace(tzinfo=hub.tz).astimezone(datetime.timezone.utc)
+    hub.now = start_local - datetime.timedelta(hours=args.warmup_hours)
+
+    entities = INPUT_ENTITIES + args.entity + DECISION_ENTITIES
+    rows = read_rows(args.history, entities, start - datetime.timedelta(hours=args.warmup_hours), end)
+    recorded, replayed, initial = replay(rows, hub, args.app or DEFAULT_APPS, start, end)
+
+    differences = diff(recorded, replayed, datetime.timedelta(seconds=args.tolerance), initial)
+    for when, entity, logged, now in differences:
+        print(f"{when:%Y-%m-%d %H:%M:%S}  {entity:<55} log: {logged if logged is not None else '-':<30} replay: {now if now is not None else '-'}")
+    for when, name, error in hub.errors:
+        print(f"{when:%Y-%m-%d %H:%M:%S}  error in {name}: {error!r}")
+    print(f"{len(list(changes(recorded, initial)))} logged and {len(list(changes(replayed, initial)))} replayed decisions, "
+          f"{len(differences)} differences, {len(hub.errors)} errors.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import appdaemon.plugins.hass.hassapi as hass
+import time
+
+from sungrow_engine.battery_model import BatteryModel
+from sungrow_engine.horizon import get_timeline
+from sungrow_engine.rules import configured_rules
+from sungrow_engine.whatif import NIGHT_OVERRIDES, RULE_DEFAULTS, evaluate, plan_difference, plan_from_entries, rule_plan
+
+    # This app answers "what if" questions from the dashboard: what would a different schedule or rule setting cost?
+    # A request is evaluated on the cached Nordpool prices (plus tomorrow's forecast before publication) with the battery
+    # model and compared with the plan the charging/discharging apps are running, in a few milliseconds.
+    # Ask through the AppDaemon endpoint /api/appdaemon/battery_what_if or by firing the event battery_what_if,
+    # the event answer is published to sensor.battery_what_if and fired as battery_what_if_result.
+    #
+    # Request fields (all optional):
+    #   plan:  [{"start": "2024-01-02T03:00:00+01:00", "energy_kwh": 6.2}, ...]  explicit schedule, negative discharges
+    #   rules: {"spread_threshold": 30, "max_discharge_hours": 5, ...}  the selection rules with overrides, the night
+    #          charge starts from the rules: of smart_night_charging in apps.yaml
+    #   battery: {"capacity_kwh": 16, "min_soc": 10, ...}  battery model overrides
+    #   soc: start SOC in %, default the current battery level
+
+
+class WhatIfService(hass.Hass):
+    def initialize(self):
+        """Initialize the app and register the endpoint and event."""
+        self.sensor_name = "sensor.nordpool_kwh_se3_sek_3_10_025"
+        self.forecast_sensor = "sensor.nordpool_price_forecast"
+        self.battery_sensor = "sensor.battery_level_nominal"
+        self.charging_sensor = "sensor.selected_charging_hours"
+        self.discharging_sensor = "sensor.selected_discharging_hours"
+        self.charge_price_sensor = "sensor.selected_charging_hours_prices"
+        self.output_sensor = "sensor.battery_what_if"
+
+        self.rules = {key: self.args[key] for key in (*RULE_DEFAULTS, *NIGHT_OVERRIDES) if key in self.args}
+
+        self.register_endpoint(self.what_if_endpoint, "battery_what_if")
+        self.listen_event(self.what_if_event, "battery_what_if")
+
+    def what_if_endpoint(self, data, *args, **kwargs):
+        """AppDaemon API endpoint, answers with the evaluation as JSON."""
+        try:
+            return self.evaluate(data or {}), 200
+        except (TypeError, ValueError, KeyError) as e:
+            return {"error": str(e)}, 400
+
+    def what_if_event(self, event_name, data, kwargs):
+        """Event from a Home Assistant script or automation, the answer goes to a sensor and an event."""
+        request = {key: value for key, value in (data or {}).items() if key in ("plan", "rules", "battery", "soc")}
+        try:
+            result = self.evaluate(request)
+        except (TypeError, ValueError, KeyError) as e:
+            self.log(f"What-if request failed: {e}")
+            self.set_state(self.output_sensor, state="error", attributes={"error": str(e)})
+            return
+        self.set_state(self.output_sensor, state=round(result["difference"] / 100, 2), attributes=dict(
+            result, unit_of_measurement="SEK"))
+        self.fire_event("battery_what_if_result", **result)
+
+    def horizon(self):
+        """Price slots of the rolling timeline, the unpublished day from the forecast P50."""
+        timeline = get_timeline(self, self.sensor_name, self.forecast_sensor)
+        return timeline.slots, timeline.position(self.datetime(aware=True)) or 0
+
+    def active_plan(self, slots, model):
+        """The schedule the charging and discharging apps have published, by slot start."""
+        by_start = {slot.start.isoformat(): slot for slot in slots}
+        plan = {}
+
+        charge_starts = self.get_state(self.charging_sensor, attribute="slot_starts") or []
+        power_kw = min(model.charge_kw, self.get_float("input_number.set_sg_battery_max_charge_power", model.charge_kw * 1000) / 1000)
+        for start in charge_starts:
+            if start in by_start:
+                slot = by_start[start]
+                plan[slot.start] = power_kw * (slot.end - slot.start).total_seconds() / 3600
+
+        export_power = self.get_state(self.discharging_sensor, attribute="export_power") or {}
+        house_load_kw = float(self.rules.get("house_load_kw", RULE_DEFAULTS["house_load_kw"]))
+        for start in self.get_state(self.discharging_sensor, attribute="slot_starts") or []:
+            if start in by_start:
+                slot = by_start[start]
+                power_kw = float(export_power.get(str(slot.start.hour), house_load_kw * 1000)) / 1000
+                plan[slot.start] = -power_kw * (slot.end - slot.start).total_seconds() / 3600
+        return plan
+
+    def evaluate(self, request):
+        """Evaluate the requested schedule against the active plan."""
+        started = time.perf_counter()
+        slots, current = self.horizon()
+        if not slots:
+            raise ValueError("No price data")
+
+        battery = {
+            "min_soc": self.get_float("input_number.set_sg_min_soc", 5),
+            "max_soc": self.get_float("input_number.set_sg_max_soc", 98),
+        }
+        model = BatteryModel.from_args(dict(self.args, **battery, **(request.get("battery") or {})))
+        soc = request.get("soc")
+        start_kwh = model.soc_kwh(float(soc if soc is not None else self.get_float(self.battery_sensor, model.min_soc)))
+
+        rules = dict(self.discharging_args(), **self.rules, **(request.get("rules") or {}))
+        if request.get("plan"):
+            plan = plan_from_entries(slots, request["plan"])
+        else:
+            charge_price = self.get_float(self.charge_price_sensor, None)
+            plan = rule_plan(slots, model, rules, charge_price, configured_rules(self, "smart_night_charging"))
+        active = self.active_plan(slots, model)
+
+        # Only what's left of the horizon counts, the past slots are already decided
+        remaining = slots[current:]
+        options = dict(
+            export_price_factor=float(rules.get("export_price_factor", RULE_DEFAULTS["export_price_factor"])),
+            export_price_offset=float(rules.get("export_price_offset", RULE_DEFAULTS["export_price_offset"])),
+            house_load_kw=float(rules.get("house_load_kw", RULE_DEFAULTS["house_load_kw"])),
+        )
+        cost, trajectory, used = evaluate(remaining, plan, model, start_kwh, **options)
+        active_cost, _, active_used = evaluate(remaining, active, model, start_kwh, **options)
+
+        boundaries = [slot.start for slot in remaining] + [remaining[-1].end]
+        return {
+            "expected_cost": round(cost, 1),
+            "active_cost": round(active_cost, 1),
+            "difference": round(cost - active_cost, 1),
+            "soc_trajectory": [
+                {"time": when.isoformat(), "soc": round(kwh / model.capacity_kwh * 100, 1)}
+                for when, kwh in zip(boundaries, trajectory)
+            ],
+            "plan": [
+                {"start": slot.start.isoformat(), "energy_kwh": round(energy, 2)}
+                for slot, energy in zip(remaining, used) if energy
+            ],
+            "changes": plan_difference(remaining, used, active_used),
+            "slots": len(remaining),
+            "evaluation_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def discharging_args(self):
+        """Export settings of the day discharging app, so the rule plan exports only when the app does."""
+        app = self.get_app("smart_day_discharging")
+        args = app.args if app is not None else (getattr(self, "app_config", None) or {}).get("smart_day_discharging") or {}
+        return {key: args[key] for key in ("export_enabled", "export_price_factor", "export_price_offset") if key in args}
+
+    def get_float(self, entity, default):
+        try:
+            return float(self.get_state(entity))
+        except (TypeError, ValueError):
+            return default